@@ -2,6 +2,7 @@ import streamlit as st
 from contract import ContractPipeline
 from ner.clf_ner import CLF_NER
 from ner.regex_ner import RegexNER
+from ner.rules import EFFECTIVE_DATE_RULES, CURRENCY_RULES
 from normalization.date_normalizer import DateNorm
 from normalization.gov_normalizer import GovNorm
 from normalization.lang_normalizer import LangNorm
@@ -11,13 +12,19 @@ from classification.sklearn_classifier import SklearnClassifier
 from ner.transformer_ner import TransformersNER
 import pandas as pd
 from io import StringIO
+import logging
 import os
 from streamlit_pdf_viewer import pdf_viewer
 from utils.generate_annotations import generate_annotations
+from utils.cache import ResultCache
 import json
 from datetime import date
 from pathlib import Path
 
+if __name__ == "__main__":
+    # streamlit runs this script as __main__, importing it leaves logging to the caller
+    logging.basicConfig(level=logging.INFO)
+
 tooltip_css = """
 <style>
     .tooltip {
@@ -112,43 +119,24 @@ def get_html(html, start, entities):
     """
     return WRAPPER.strip(), entity_info_str
 
-def hash_func(obj: ContractPipeline) -> int:
-    return obj 
+def hash_func(obj: ContractPipeline) -> str:
+    return obj.fingerprint()
 
-@st.cache_resource(hash_funcs={ContractPipeline: hash_func})
-def create_pipeline():
-    contract_pipeline = ContractPipeline(defaults=True)
+# built once for each sidebar configuration
+@st.cache_resource
+def create_pipeline(language_classifier, governing_law, effective_date, currency, document_type, legal_entities):
+    contract_pipeline = ContractPipeline(defaults=True, cache=ResultCache())
     if governing_law:
         gov_law_ner = CLF_NER(keywords=["law","jurisdicition","governing"],model="sguarnaccio/gov_law_clf_ner",normalizer=GovNorm())
-        contract_pipeline.add_pipe(name="governing_law",component=gov_law_ner)
+        # sessions processing contracts at the same time share forward passes
+        contract_pipeline.add_pipe(name="governing_law",component=gov_law_ner.schedule())
     if effective_date:
-        effective_date_rules = [(r"(?:effective|dated) (?:as of|on)*? ((?:\d{1,2}[-/th|st|nd|rd\s]*)?(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|January|February|March|April|May|June|July|August|September|October|November|Decmebter)?[a-z\s,.]*(?:\d{1,2}[-/th|st|nd|rd)\s,]*)+(?:\d{2,4})+)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(day)\s*(of)\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*? (January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*?  ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*of\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE"),
-                   (
-                   r"(?:effective|dated) (?:as of|on)*?  (January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                   "EFFECTIVE_DATE")]
         eff_date_ner = RegexNER(normalizer=DateNorm())
-        eff_date_ner.load_raw_rules(effective_date_rules)
+        eff_date_ner.load_raw_rules(EFFECTIVE_DATE_RULES)
         contract_pipeline.add_pipe(name="effective_date",component=eff_date_ner)
     if currency:
-        currency_rules = [(r"(?P<currency>[\$£€¥₹]|(?:USD|US Dollar|GBP|British Pound|EUR|Euro|JPY|Japanese Yen|INR|Indian Rupee|CAD|Canadian Dollar|AUD|Australian Dollar|CHF|Swiss Franc|CNY|Chinese Yuan|SGD|Singapore Dollar|NZD|New Zealand Dollar|HKD|Hong Kong Dollar|SEK|Swedish Krona|NOK|Norwegian Krone|KRW|South Korean Won|MXN|Mexican Peso|BRL|Brazilian Real|TRY|Turkish Lira|ZAR|South African Rand|IDR|Indonesian Rupiah|MYR|Malaysian Ringgit|PHP|Philippine Peso|THB|Thai Baht|HUF|Hungarian Forint|CZK|Czech Koruna|ILS|Israeli New Shekel|PLN|Polish Złoty|DKK|Danish Krone|AED|United Arab Emirates Dirham|SAR|Saudi Riyal|RON|Romanian Leu|RUB|Russian Ruble|CLP|Chilean Peso|TWD|New Taiwan Dollar|ARS|Argentine Peso|COP|Colombian Peso|VND|Vietnamese Đồng|NGN|Nigerian Naira|UAH|Ukrainian Hryvnia|EGP|Egyptian Pound|QAR|Qatari Riyal|BDT|Bangladeshi Taka|PKR|Pakistani Rupee|PEN|Peruvian Sol))\s*(?P<amount>[0-9]+(?:[,.][0-9]{3})*(?:[,.][0-9]+)?)","currency")]
         currency_ner = RegexNER()
-        currency_ner.load_raw_rules(currency_rules)
+        currency_ner.load_raw_rules(CURRENCY_RULES)
         contract_pipeline.add_pipe(name="currency",component=currency_ner)
     if document_type:
         document_type_classifier = SklearnClassifier(
@@ -177,12 +165,13 @@ def create_pipeline():
             params={"text_range":(0,50)})
     if legal_entities:
         le_ner = TransformersNER(keywords=["signature"],model="sguarnaccio/le_signatory",normalizer=EntityNormalizer())
-        contract_pipeline.add_pipe(name="legal_entities",component=le_ner)
+        contract_pipeline.add_pipe(name="legal_entities",component=le_ner.schedule())
     return contract_pipeline
 
-@st.cache_resource
-def run_pipeline(_pipeline,file_path):
-    doc = _pipeline(file_path)
+# keyed on the pipeline configuration and the file content, which is passed only for the key
+@st.cache_resource(hash_funcs={ContractPipeline: hash_func})
+def run_pipeline(pipeline,file_path,content):
+    doc = pipeline(file_path)
     return doc
 
 if 'counter' not in st.session_state:
@@ -190,14 +179,14 @@ if 'counter' not in st.session_state:
 
 if text_file is not None:
     st.session_state.counter = 1
-    pipeline = create_pipeline()
+    pipeline = create_pipeline(language_classifier, governing_law, effective_date, currency, document_type, legal_entities)
     bytes_data = text_file.read()  # read the content of the file in binary
     file_path = f"tmp/{text_file.name}"
     os.makedirs(os.path.dirname(file_path), exist_ok=True)
     with open(file_path, "wb") as f:
         f.write(text_file.getbuffer())
     print(file_path )
-    doc = run_pipeline(pipeline,file_path)           
+    doc = run_pipeline(pipeline,file_path,bytes_data)
     segments = [(segment.section,segment.subsection,segment.title,segment.text,segment.start,segment.end) 
         for segment in doc.segments]
     annotations = generate_annotations(doc.ents)
@@ -0,0 +1,431 @@
+"""
+Benchmarks for pipeline components against the sample contracts in tests/.
+
+Each benchmark checks the current implementation gives the same results as the one it
+replaced before timing them both.
+
+    python benchmarks.py regex_ner
+"""
+import argparse
+import bisect
+import glob
+import os
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+CORPUS = str(Path(__file__).parent / "tests" / "*.txt")
+DOCUMENTS = [str(Path(__file__).parent / "tests" / f"*.{ext}") for ext in ("txt", "pdf", "jpg")]
+
+def load_corpus(pattern=CORPUS):
+    texts = []
+    for path in sorted(glob.glob(pattern)):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            texts.append(f.read())
+    return texts
+
+def best_of(fn, repeat=3):
+    """Best wall clock time of `repeat` runs of fn, and its last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def report(name, baseline, current):
+    print(f"{name}: {baseline:.3f}s -> {current:.3f}s ({baseline / current:.1f}x)")
+
+def bench_regex_ner():
+    """RegexNER with the combined prefilter against one finditer pass per rule."""
+    from ner.regex_ner import RegexNER
+    from ner.rules import EFFECTIVE_DATE_RULES, CURRENCY_RULES
+
+    ner = RegexNER()
+    ner.load_raw_rules(EFFECTIVE_DATE_RULES + CURRENCY_RULES)
+    # paragraphs stand in for document segments
+    texts = [paragraph for text in load_corpus() for paragraph in text.split("\n\n")]
+
+    def per_rule():
+        return [[(match.span(), label) for regex, label in ner.regexes for match in regex.finditer(text)]
+                for text in texts]
+
+    def combined():
+        return [[((ent.start, ent.end), ent.label) for ent in ner.predict(text)] for text in texts]
+
+    baseline, expected = best_of(per_rule)
+    current, result = best_of(combined)
+    assert result == expected, "combined RegexNER results differ from the per rule loop"
+    report(f"regex_ner ({len(texts)} segments, {len(ner.regexes)} rules)", baseline, current)
+
+def legacy_fix_line_breaks(text):
+    """TextCleaner.fix_line_breaks before the fused normalizer: joins lines starting lowercase to the line before."""
+    lines = []
+    for line in text.split("\n"):
+        if line and line[0].islower():
+            lines[-1] += line
+        else:
+            lines.append(line)
+    return "\n".join(lines)
+
+def legacy_clean(text, lower=False, remove_num=False):
+    """TextCleaner before the fused normalizer: unidecode, then one regex pass per step."""
+    from unidecode import unidecode
+    from utils.clean_text import (NORMALIZE_SPACE, NORMALIZE_NEWLINES, REMOVE_NUM,
+                                  page_number_pattern, digit_word_pattern)
+
+    if lower:
+        text = text.lower()
+    text = unidecode(text)
+    text = NORMALIZE_SPACE.sub(" ", text)
+    text = page_number_pattern.sub("\n", text)
+    text = NORMALIZE_NEWLINES.sub("\n", text)
+    text = digit_word_pattern.sub(r"\1 \2", text)
+    text = legacy_fix_line_breaks(text)
+    if remove_num:
+        text = REMOVE_NUM.sub("", text)
+    return text
+
+def bench_clean():
+    """TextCleaner's single scan normalizer against one pass per cleaning step.
+
+    Also checks every letter and digit of the cleaned text maps back to the same character of the raw text.
+    """
+    from contract import Contract
+    from utils.clean_text import TextCleaner
+
+    cleaner = TextCleaner()
+    texts = load_corpus()
+
+    for remove_num in (False, True):
+        def clean():
+            return [cleaner(Contract(text=text), lower=False, remove_num=remove_num) for text in texts]
+
+        baseline, expected = best_of(lambda: [legacy_clean(text, remove_num=remove_num) for text in texts])
+        current, contracts = best_of(clean)
+        assert [contract.text for contract in contracts] == expected, "cleaned text differs from the step by step cleaner"
+        for raw, contract in zip(texts, contracts):
+            for pos, char in enumerate(contract.text):
+                source = raw[contract.offsets.to_raw(pos)]
+                if char.isalnum() and source.isascii():
+                    assert source == char, f"offset {pos} of the cleaned text maps to {source!r}, not {char!r}"
+        pieces = sum(len(contract.offsets) for contract in contracts)
+        report(f"clean (remove_num={remove_num}, {sum(map(len, texts))} characters, {pieces} offset pieces)", baseline, current)
+
+def bench_definitions(n_workers=4):
+    """DefinitionFinder against the extractor it replaced, on the sentences of the sample contracts.
+
+    Checks both find the same glossary for every contract, that searching segment by segment,
+    serially and on n_workers processes, finds it too, and that the definitions' offsets point
+    at their terms in the contract text.
+    """
+    from contract import ContractPipeline
+    from definitions.definitions import NOT_TERM, DefinitionFinder, Glossary, normalize_sentence
+    from tests.legacy_definitions import legacy_extract
+
+    pipeline = ContractPipeline(defaults=True)
+    pipeline.pipeline = [item for item in pipeline.pipeline if item["name"] != "definition_finder"]
+    contracts = list(pipeline.stream(sorted(glob.glob(CORPUS))))
+    documents = [[normalize_sentence(sentence.text) for sentence in contract.sentences] for contract in contracts]
+    finder = DefinitionFinder()
+
+    def glossaries(extract):
+        results = []
+        for sentences in documents:
+            glossary, terms = Glossary(), set()
+            for text in sentences:
+                extract(text, terms, glossary)
+            results.append([(d.term, d.definition, d.phrase, d.start, d.end) for d in glossary])
+        return results
+
+    baseline, expected = best_of(lambda: glossaries(legacy_extract), repeat=1)
+    current, result = best_of(lambda: glossaries(finder.extract))
+    assert result == expected, "glossaries differ from the previous DefinitionFinder"
+    sentences = sum(map(len, documents))
+    report(f"definitions ({sentences} sentences, {sum(map(len, result))} definitions, "
+           f"{sentences / current:.0f} sentences/s)", baseline, current)
+
+    def by_segment(finder):
+        return [[(d.term, d.definition, d.phrase, d.start, d.end) for d in finder(contract).glossary]
+                for contract in contracts]
+
+    with DefinitionFinder(n_workers=n_workers) as parallel:
+        by_segment(parallel)  # start the worker processes
+        serial, located = best_of(lambda: by_segment(finder))
+        pooled, result = best_of(lambda: by_segment(parallel))
+    assert result == located, f"definitions found on {n_workers} workers differ from a serial search"
+    assert [[entry[:3] for entry in glossary] for glossary in located] == [[entry[:3] for entry in glossary] for glossary in expected], \
+        "searching by segment changed the glossary"
+    for contract, glossary in zip(contracts, located):
+        for term, _, phrase, start, end in glossary:
+            assert "".join(NOT_TERM.sub("", contract.text[start:end]).split()) == "".join(term.split()), \
+                f"offsets {start}:{end} don't point at {term!r}"
+    report(f"definitions by segment ({n_workers} workers against 1)", serial, pooled)
+
+def bench_usage():
+    """The glossary's usage index against scanning the text once per term.
+
+    Checks every use the index finds is a match of its own term, and that the matches it
+    leaves out overlap the use of another term.
+    """
+    import re
+    from contract import ContractPipeline
+
+    contracts = list(ContractPipeline(defaults=True).stream(sorted(glob.glob(CORPUS))))
+
+    def per_term():
+        results = []
+        for contract in contracts:
+            uses = {}
+            for term in dict.fromkeys(" ".join(term.split()) for term in contract.glossary.terms if term.strip()):
+                regex = re.compile(r"(?<!\w)" + r"\s+".join(map(re.escape, term.split())) + r"(?!\w)")
+                uses[term] = [(match.start(), match.end()) for match in regex.finditer(contract.text)]
+            results.append(uses)
+        return results
+
+    baseline, expected = best_of(per_term, repeat=1)
+    current, indexes = best_of(lambda: [contract.glossary.build_usage_index(contract) for contract in contracts])
+    for uses, index in zip(expected, indexes):
+        spans = list(zip(index.starts, index.ends))
+        for start, end, term in index.occurrences():
+            assert (start, end) in uses[term], f"{term!r} at {start} is not a use of it"
+        for term, matches in uses.items():
+            for start, end in matches:
+                i = bisect.bisect_left(spans, (end, end))
+                assert i and spans[i - 1][1] > start, f"use of {term!r} at {start} missing"
+    terms = sum(len(index.terms) for index in indexes)
+    report(f"usage index ({terms} terms, {sum(map(len, indexes))} uses)", baseline, current)
+
+def legacy_sentences(contract):
+    """SentenceTokenizer before it kept offsets: (i, j, text) over the non space tokens."""
+    import re, string
+    from tokenization.sentence import SentenceTokenizer
+
+    splitter = SentenceTokenizer()
+    tokens = [t.text for t in contract.tokens if not t.is_space]
+    len_tks = len(tokens)
+    i, j = 0, 0
+    sentences = []
+
+    def create_sentence(i, j):
+        text = " ".join(tokens[i:j]).strip()
+        return i, j, re.sub(r'\s+([{}])'.format(re.escape(string.punctuation)), r'\1', text)
+
+    while j < len_tks:
+        if splitter.is_potential_line_break(tokens[j]) or splitter.is_potential_line_break(tokens[j - 1] + tokens[j]):
+            if tokens[j - 1].isdigit() or tokens[j - 2].isdigit():
+                j += 1
+                continue
+            if splitter.newline_and_spaces.match(tokens[j]):
+                if j + 1 < len_tks and not splitter.sent_start_re.match(tokens[j + 1]):
+                    j += 1
+                    continue
+            while j < len_tks and (
+                    splitter.is_potential_line_break(tokens[j]) or
+                    splitter.is_potential_line_break(tokens[j - 1] + tokens[j]) or
+                    tokens[j] in splitter.quotes):
+                if tokens[j] in splitter.quotes and tokens[j] != tokens[j - 1]:
+                    break
+                j += 1
+            sentences.append(create_sentence(i, j))
+            i = j
+        j += 1
+    sentences.append(create_sentence(i, j))
+    return sentences
+
+def bench_sentences(copies=8):
+    """SentenceTokenizer against the one it replaced, on the sample contracts joined into large ones.
+
+    Checks both split at the same tokens, and that each sentence's offsets span its tokens.
+    """
+    from contract import Contract, ContractPipeline
+    from tokenization.sentence import SentenceTokenizer
+
+    pipeline = ContractPipeline(defaults=True)
+    names = [item["name"] for item in pipeline.pipeline]
+    pipeline.pipeline = pipeline.pipeline[:names.index("sentence_tokenizer")]
+    texts = [contract.text for contract in pipeline.stream(sorted(glob.glob(CORPUS)))]
+    tokenizer = next(item["component"] for item in pipeline.pipeline if item["name"] == "tokenizer")
+    contracts = []
+    for n in range(0, len(texts), copies):
+        contract = Contract(text="\n\n".join(texts[n:n + copies]))
+        contracts.append(tokenizer(contract))
+    splitter = SentenceTokenizer()
+
+    baseline, expected = best_of(lambda: [legacy_sentences(contract) for contract in contracts], repeat=1)
+    current, result = best_of(lambda: [splitter(contract).sentences for contract in contracts])
+    for contract, old, new in zip(contracts, expected, result):
+        tokens = [token for token in contract.tokens if not token.is_space]
+        old = [(tokens[i].idx, tokens[j - 1].idx + len(tokens[j - 1].text), text) for i, j, text in old if i < min(j, len(tokens))]
+        assert [(start, end) for start, end, _ in old] == [(sentence.start, sentence.end) for sentence in new], \
+            "sentence boundaries differ from the previous SentenceTokenizer"
+        for (_, _, text), sentence in zip(old, new):
+            assert "".join(text.split()) == "".join(sentence.text.split()), f"sentence at {sentence.start} lost text"
+    sentences = sum(map(len, result))
+    characters = sum(len(contract.text) for contract in contracts)
+    report(f"sentences ({len(contracts)} contracts of {characters // len(contracts)} characters, {sentences} sentences)",
+           baseline, current)
+
+def bench_memory():
+    """Memory held by the tokens, sentences and segments of the sample contracts, against the objects they replaced.
+
+    The previous layout kept the spaCy tokens and their Doc, and a copy of the text of every
+    sentence and segment. Also checks both give the same sentence and segment texts.
+    """
+    import gc
+    import tracemalloc
+    from types import SimpleNamespace
+    from contract import Contract, ContractPipeline
+    from tokenization.segments import SectionSegmenter
+    from tokenization.sentence import SentenceTokenizer
+    from tokenization.tokenizer import Tokenizer, blank_tokenizer
+
+    pipeline = ContractPipeline(defaults=True)
+    names = [item["name"] for item in pipeline.pipeline]
+    pipeline.pipeline = pipeline.pipeline[:names.index("tokenizer")]
+    texts = [contract.text for contract in pipeline.stream(sorted(glob.glob(CORPUS)))]
+    tokenizer, splitter, segmenter = Tokenizer(), SentenceTokenizer(), SectionSegmenter()
+    blank_tokenizer()
+
+    def legacy(text):
+        tokens = list(blank_tokenizer()(text))
+        old = legacy_sentences(SimpleNamespace(tokens=tokens))
+        sentences = [SimpleNamespace(start=i, end=j, text=sentence) for i, j, sentence in old]
+        segments = [SimpleNamespace(start=segment.start, end=segment.end, title=segment.title, text=segment.text[:])
+                    for segment in segmenter(Contract(text=text)).segments]
+        return tokens, sentences, segments
+
+    def current(text):
+        contract = segmenter(splitter(tokenizer(Contract(text=text))))
+        return contract.tokens, contract.sentences, contract.segments
+
+    def held(build):
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        results = [build(text) for text in texts]
+        # what is left of the documents once they are released
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return size, results
+
+    baseline, expected = held(legacy)
+    size, result = held(current)
+    for (_, old_sentences, old_segments), (_, sentences, segments) in zip(expected, result):
+        assert ["".join(sentence.text.split()) for sentence in old_sentences if sentence.text] == \
+            ["".join(text.split()) for text in sentences.text], "sentence texts differ"
+        assert [segment.text for segment in old_segments] == segments.text, "segment texts differ"
+    tokens = sum(len(tokens) for tokens, _, _ in result)
+    print(f"memory ({len(texts)} contracts, {tokens} tokens): {baseline / 2 ** 20:.1f}MB -> {size / 2 ** 20:.1f}MB "
+          f"({baseline / size:.1f}x)")
+
+def bench_ingest(n_threads=8):
+    """Loading the sample documents on threads against one at a time.
+
+    Also checks the working directory never changes while the threads run, the OCR path
+    used to chdir into each document's directory which raced between threads.
+    """
+    from contract import ContractPipeline
+    from utils.ocr import FileProcessor
+
+    pipeline = ContractPipeline(defaults=False)
+    pipeline.add_pipe(FileProcessor(), name="file_loader")
+    paths = sorted(path for pattern in DOCUMENTS for path in glob.glob(pattern))
+    cwd = os.getcwd()
+    seen = set()
+    done = threading.Event()
+
+    def watch_cwd():
+        while not done.is_set():
+            seen.add(os.getcwd())
+            time.sleep(0.001)
+
+    def load(n):
+        return [(contract.raw, contract.bbox_info, contract.error is None)
+                for contract in pipeline.pipe(paths, batch_size=len(paths), n_threads=n)]
+
+    baseline, expected = best_of(lambda: load(1))
+    watcher = threading.Thread(target=watch_cwd)
+    watcher.start()
+    try:
+        current, result = best_of(lambda: load(n_threads))
+    finally:
+        done.set()
+        watcher.join()
+    assert seen == {cwd}, f"working directory changed while loading: {seen - {cwd}}"
+    assert result == expected, "documents loaded on threads differ from loading them one at a time"
+    report(f"ingest ({len(paths)} documents, {n_threads} threads)", baseline, current)
+
+# libraries that used to be loaded by importing contract.py and must now wait for the component using them
+HEAVY_MODULES = ("spacy", "nltk", "pandas", "torch", "transformers", "PyPDF2", "textract", "pdf2image", "chardet")
+
+REGEX_WORKER = """
+import sys, time
+start = time.perf_counter()
+from contract import Contract, ContractPipeline
+from ner.regex_ner import RegexNER
+from ner.rules import EFFECTIVE_DATE_RULES, CURRENCY_RULES
+pipeline = ContractPipeline(defaults=True)
+ner = RegexNER()
+ner.load_raw_rules(EFFECTIVE_DATE_RULES + CURRENCY_RULES)
+pipeline.add_pipe(ner, name="regex_ner")
+ner.predict("This Agreement is effective as of January 1, 2024 for $5,000.")
+print(time.perf_counter() - start)
+print(",".join(name for name in %r if name in sys.modules))
+"""
+
+EAGER_IMPORTS = """
+import time
+start = time.perf_counter()
+import contract
+import spacy
+spacy.load("en_core_web_md")
+spacy.blank("en")
+import pandas, nltk, PyPDF2, textract, pdf2image, chardet
+pandas.read_csv("normalization/utils/gpe.csv")
+print(time.perf_counter() - start)
+"""
+
+def run_python(code):
+    """Output lines of code run in a fresh interpreter from the repository root."""
+    output = subprocess.run([sys.executable, "-c", code], cwd=Path(__file__).parent,
+                            capture_output=True, text=True, check=True).stdout
+    return output.splitlines()
+
+def bench_startup(limit=1.0):
+    """Starting a regex NER worker against importing everything contract.py used to load at import.
+
+    Checks the worker starts within limit seconds and never imports spaCy, NLTK, pandas, the
+    model libraries or the document converters.
+    """
+    baseline = min(float(run_python(EAGER_IMPORTS)[0]) for _ in range(3))
+    runs = [run_python(REGEX_WORKER % (HEAVY_MODULES,)) for _ in range(3)]
+    current = min(float(elapsed) for elapsed, _ in runs)
+    loaded = {name for _, names in runs for name in names.split(",") if name}
+    assert not loaded, f"a regex NER worker imported {', '.join(sorted(loaded))}"
+    assert current < limit, f"a regex NER worker took {current:.2f}s to start"
+    report("startup (regex NER worker)", baseline, current)
+
+BENCHMARKS = {
+    "regex_ner": bench_regex_ner,
+    "clean": bench_clean,
+    "definitions": bench_definitions,
+    "usage": bench_usage,
+    "sentences": bench_sentences,
+    "memory": bench_memory,
+    "ingest": bench_ingest,
+    "startup": bench_startup,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("names", nargs="*", default=list(BENCHMARKS),
+                        help=f"benchmarks to run, all by default: {', '.join(BENCHMARKS)}")
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)} (choose from {', '.join(BENCHMARKS)})")
+    for name in args.names:
+        BENCHMARKS[name]()
@@ -1,16 +1,65 @@
+from utils.cache import model_identity
+from utils.inference import shared_scheduler
+from utils.models import RegisteredModel
+
 class Classifier:
+    requires = ("text", "sentences", "segments")
+    # loaded through the registry on first use by the subclasses, see utils.models.share_model
+    model = RegisteredModel()
+
     def __init__(self, model=None, attribute=None, positive_class=None,normalizer=None):
         self.model = model
         self.attribute = attribute
         self.positive_class = positive_class
         self.normalizer = normalizer
+        # name or path the model was loaded from, identifies it in ContractPipeline.fingerprint
+        self.model_name = model
+        self.scheduler = None
+
+    def config(self):
+        """Settings that change the classifier's output, hashed into ContractPipeline.fingerprint."""
+        return {
+            "model": model_identity(self.model_name),
+            "attribute": self.attribute,
+            "method": getattr(self, "method", None),
+            "positive_class": self.positive_class,
+            "normalizer": type(self.normalizer).__name__ if self.normalizer else None,
+        }
 
     def predict(self, text, method, text_range=None):
         raise NotImplementedError("Subclasses must implement the predict method.")
 
+    def predict_texts(self, texts, batch_size):
+        """Classify a list of texts, returning one (label, score, text) tuple per text."""
+        raise NotImplementedError("Subclasses must implement the predict_texts method.")
+
+    def schedule(self, max_batch_size=16, max_wait_ms=5):
+        """Send the model calls through an InferenceScheduler shared with every classifier running the same model.
+
+        Texts from contracts classified at the same time, in other threads or pipelines, are
+        then batched into the same forward passes.
+
+        Returns:
+            Classifier: self.
+        """
+        key = (type(self).__name__, model_identity(self.model_name))
+        self.scheduler = shared_scheduler(key, self.forward, max_batch_size=max_batch_size,
+                                          max_wait_ms=max_wait_ms, name=f"{type(self).__name__}:{self.model_name}")
+        return self
+
+    def forward(self, texts):
+        """Raw model output for each text. Model backed classifiers implement this to be scheduled."""
+        raise NotImplementedError(f"{type(self).__name__} has no model to schedule.")
+
     def __call__(self, contract, batch_size=5, text_range=None):
         results = self.predict(contract, batch_size, text_range)
+        if getattr(self, "method", None) == "segments" and not text_range:
+            for segment, (label, score, _) in zip(contract.segments, results):
+                segment.predictions[self.attribute] = (label, score)
+        return self.apply(contract, results)
 
+    def apply(self, contract, results):
+        """Set the classifier's attribute on the contract from the (label, score, text) predictions."""
         if self.positive_class != "multi":
             for label, score, text in results:
                 if label == self.positive_class:
@@ -33,3 +82,38 @@ class Classifier:
                     setattr(contract, self.attribute, best_label)
 
         return contract
+
+    def update(self, contract, previous, diff, batch_size=5, text_range=None):
+        """Classify a revised version of a contract, reusing the previous predictions where the text is unchanged.
+
+        Segment level classifiers only predict the segments that changed. Other methods reuse the
+        previous result when the whole text is the same and run again otherwise.
+
+        Args:
+            contract (Contract): The revised contract.
+            previous (Contract): The processed previous version.
+            diff (SegmentDiff): Segments of contract matched against those of previous.
+
+        Returns:
+            Contract: The processed contract.
+        """
+        if getattr(self, "method", None) == "segments" and not text_range:
+            segments = list(contract.segments)
+            cached = []
+            for segment in segments:
+                old = diff.previous(segment)
+                cached.append(old.predictions.get(self.attribute) if old is not None else None)
+            fresh = iter(self.predict_texts([segment.text for segment, hit in zip(segments, cached) if hit is None], batch_size))
+            results = []
+            for segment, hit in zip(segments, cached):
+                if hit is None:
+                    label, score, _ = next(fresh)
+                else:
+                    label, score = hit
+                segment.predictions[self.attribute] = (label, score)
+                results.append((label, score, segment.text))
+            return self.apply(contract, results)
+        if previous.text == contract.text and hasattr(previous, self.attribute):
+            setattr(contract, self.attribute, getattr(previous, self.attribute))
+            return contract
+        return self(contract, batch_size=batch_size, text_range=text_range)
@@ -1,5 +1,7 @@
 import joblib
+from functools import partial
 from classification.classifier import Classifier
+from utils.models import share_model
 
 
 
@@ -8,7 +10,8 @@ class SklearnClassifier(Classifier):
         super().__init__(model=None, attribute=attribute, positive_class=positive_class,normalizer=normalizer)
         if not model or not method:
             raise ValueError("Model path and method must be provided.")
-        self.model = joblib.load(model)
+        share_model(self, "joblib", model, partial(joblib.load, model))
+        self.model_name = model
         self.method = method
         self.label_encoder = label_encoder
 
@@ -29,10 +32,13 @@ class SklearnClassifier(Classifier):
         if text_range:
             text = text[text_range[0]:text_range[1]]
 
-        predictions = self.model.predict_proba(text)
+        return self.predict_texts(text, batch_size)
+
+    def predict_texts(self, texts, batch_size):
+        predictions = self.model.predict_proba(texts)
         
         results = []
-        for text_item, prediction in zip(text, predictions):
+        for text_item, prediction in zip(texts, predictions):
             if self.label_encoder:
                 idx = prediction.argmax()
                 score = prediction[idx]
@@ -1,11 +1,13 @@
+from functools import partial
 from transformers import pipeline
 from classification.classifier import Classifier
+from utils.models import share_model
 import torch
 class TransformersClassifier(Classifier):
     def __init__(self, model=None, attribute=None, method=None, positive_class=None,normalizer=None):
         super().__init__(model=model, attribute=attribute, positive_class=positive_class,normalizer=normalizer)
         # device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = pipeline("text-classification", model=model,device="cpu")
+        share_model(self, "text-classification", model, partial(pipeline, "text-classification", model=model, device="cpu"))
         self.method = method
 
     def predict(self, contract, batch_size, text_range=None):
@@ -28,12 +30,25 @@ class TransformersClassifier(Classifier):
             raise ValueError("Unsupported classification method.")
         if text_range:
             text = text[text_range[0]:text_range[1]]
-        for i in range(0, len(text), batch_size):
-            batch_texts = text[i:i + batch_size]
-            batch_results = self.model(batch_texts, truncation=True)
+        results.extend(self.predict_texts(text, batch_size))
+
+        return results
+
+    def forward(self, texts):
+        return self.model(list(texts), truncation=True)
+
+    def predict_texts(self, texts, batch_size):
+        results = []
+        if self.scheduler is not None:
+            # the scheduler batches the texts, together with those of other contracts
+            for text, result in zip(texts, self.scheduler.submit(texts)):
+                results.append((result["label"], result["score"], text))
+            return results
+        for i in range(0, len(texts), batch_size):
+            batch_texts = texts[i:i + batch_size]
+            batch_results = self.forward(batch_texts)
             for text, result in zip(batch_texts, batch_results):
                 results.extend([(result["label"], result["score"], text)])
-
         return results
 
     def __call__(self, contract, batch_size=5, text_range=None):
@@ -1,10 +1,23 @@
+import hashlib
+import logging
+import os
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
 from typing import List, Union, Dict, Generator
 from tokenization.tokenizer import Tokenizer
 from tokenization.sentence import SentenceTokenizer
-from tokenization.segments import SectionSegmenter
+from tokenization.segments import SectionSegmenter, SegmentDiff
 from utils.clean_text import TextCleaner
 from definitions.definitions import DefinitionFinder
 from utils.ocr import FileProcessor
+from ner.span_index import TokenIndex
+from utils.cache import ResultCache
+
+# Contract attributes that are only needed while the pipeline runs and can be
+# released early when streaming large corpora
+HEAVY_FIELDS = ("tokens", "raw", "bbox_info")
 
 class Contract(object):
     def __init__(self,
@@ -20,19 +33,56 @@ class Contract(object):
         self.file_path = file_path
         self.text = text
         self.raw = text
+        # OffsetMap from text back to raw, set by TextCleaner
+        self.offsets = None
         #self.char_length = len(self.text)
         self.tokens = tokens
+        self.bbox_info = None
         self.sentences = sentences
         self.segments = segments
         self.segment_count = segment_count
         self.glossary = glossary
         self.table_of_contents = table_of_contents
         self.ents = ents
+        self.error = None
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self._tokens = tokens
+        self._token_index = None
+
+    def raw_span(self, start, end):
+        """Span of raw that the text between start and end was cleaned from."""
+        if getattr(self, "offsets", None) is None:
+            return start, end
+        return self.offsets.span(start, end)
+
+    @property
+    def token_index(self):
+        """Bisect index from character offsets to tokens, built on first use and shared by all components."""
+        if self._token_index is None and self._tokens is not None:
+            # Tokens look offsets up in their own columns
+            self._token_index = self._tokens if hasattr(self._tokens, "within") else TokenIndex(self._tokens)
+        return self._token_index
      
 class ContractPipeline:
-    def __init__(self,defaults=True):
+    def __init__(self,defaults=True,cache=None):
+        """
+        Args:
+        - defaults (bool): Start with the default loading, cleaning, tokenizing, segmenting and
+          definition components.
+        - cache (ResultCache): Store results on disk keyed by document content and pipeline
+          configuration, so processing the same document again loads the stored result. The
+          default file loader keeps its OCR page cache in a `pages` directory inside it.
+        """
+        self.cache = cache
         if defaults:
-            file_loader = FileProcessor()
+            # OCR'd pages are cached next to the results, so a changed document only redoes the pages that changed
+            file_loader = FileProcessor(cache=ResultCache(os.path.join(cache.directory, "pages")) if cache is not None else None)
             tokenizer = Tokenizer(default=True)
             section_segmenter = SectionSegmenter()
             sentence_tokenizer = SentenceTokenizer()
@@ -84,11 +134,288 @@ class ContractPipeline:
         else:
             self.pipeline.append(pipe_item)
             
-    def __call__(self, text):
-        contract = Contract(text)
+    def __call__(self, text, drop_heavy=False):
+        key, contract = self._load_cached(text, drop_heavy)
+        if contract is None:
+            contract = self._run(Contract(text), self.pipeline, drop_heavy)
+            self._store_cached(key, contract)
+        return contract
+
+    def close(self):
+        """Release what the components hold on to between documents, such as worker processes."""
+        for item in self.pipeline:
+            close = getattr(item["component"], "close", None)
+            if close is not None:
+                close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def fingerprint(self):
+        """
+        Hash of the pipeline configuration: component names, types and params, plus whatever
+        components report through a `config` method, such as their models and rules.
+        """
+        parts = []
         for item in self.pipeline:
+            component = item["component"]
+            config = component.config() if hasattr(component, "config") else None
+            parts.append((item["name"],
+                          f"{type(component).__module__}.{type(component).__qualname__}",
+                          sorted(item.get("params", {}).items()),
+                          config))
+        return hashlib.sha256(repr(parts).encode("utf-8")).hexdigest()
+
+    def _load_cached(self, source, drop_heavy=False):
+        """The cache key of a source and its cached result, if any."""
+        if self.cache is None:
+            return None, None
+        kind = "file" if isinstance(source, (str, os.PathLike)) and os.path.isfile(source) else "text"
+        key = self.cache.key(source, f"{self.fingerprint()}:{kind}:{drop_heavy}")
+        contract = self.cache.get(key)
+        if contract is not None:
+            logging.debug(f"Loaded cached result for {contract.file_path or key}")
+        return key, contract
+
+    def _store_cached(self, key, contract):
+        if key is not None and contract.error is None:
+            self.cache.put(key, contract)
+
+    def _run(self, contract, pipeline, drop_heavy=False):
+        release_after = self._release_points(pipeline) if drop_heavy else {}
+        for i, item in enumerate(pipeline):
             component = item["component"]
             params = item.get("params", {})
             contract = component(contract,**params)
+            for field in release_after.get(i, ()):
+                setattr(contract, field, None)
 
         return contract
+
+    def _release_points(self, pipeline):
+        """
+        Map each pipeline index to the heavy fields that can be dropped once it has run.
+
+        Components declare what they read from the contract in a `requires` attribute,
+        components without one are assumed to need every heavy field.
+        """
+        last_use = {field: 0 for field in HEAVY_FIELDS}
+        for i, item in enumerate(pipeline):
+            requires = getattr(item["component"], "requires", None)
+            for field in HEAVY_FIELDS:
+                if requires is None or field in requires:
+                    last_use[field] = i
+        release_after = {}
+        for field, i in last_use.items():
+            release_after.setdefault(i, []).append(field)
+        return release_after
+
+    def stream(self, sources, drop_heavy=False) -> Generator:
+        """
+        Lazily run the pipeline over an iterable of file paths or raw texts.
+
+        Args:
+        - sources (iterable): File paths, or already extracted contract texts.
+        - drop_heavy (bool): Release `tokens`, `raw` and `bbox_info` once the last
+          component that reads them has run, so memory stays flat over large corpora.
+
+        Texts skip the file loader. Contracts are yielded one at a time as they finish.
+        """
+        for source in sources:
+            key, contract = self._load_cached(source, drop_heavy)
+            if contract is None:
+                contract = self._run(*self._prepare(source), drop_heavy)
+                self._store_cached(key, contract)
+            yield contract
+
+    def _prepare(self, source):
+        """A new Contract for a file path or text, and the part of the pipeline to run on it."""
+        if isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+            return Contract(source), self.pipeline
+        return Contract(text=source), [item for item in self.pipeline if not isinstance(item["component"], FileProcessor)]
+
+    def update(self, previous, source, drop_heavy=False):
+        """
+        Process a revised version of a contract, reusing the results of the previous version
+        for the parts of the text that didn't change.
+
+        The revised text is loaded, cleaned, tokenized and segmented as usual, then its segments are
+        diffed against those of `previous`. Components with an `update` method (the named entity
+        recognizers, the definition finder and the classifiers) only run on what changed and carry
+        over the rest with shifted offsets, the others run on the whole contract.
+
+        Args:
+        - previous (Contract): The processed previous version, from this pipeline.
+        - source (str): File path or text of the revised version.
+        - drop_heavy (bool): Release heavy fields early, see `stream`.
+        """
+        contract, pipeline = self._prepare(source)
+        if previous is None or previous.segments is None:
+            return self._run(contract, pipeline, drop_heavy)
+        release_after = self._release_points(pipeline) if drop_heavy else {}
+        diff = None
+        for i, item in enumerate(pipeline):
+            component = item["component"]
+            params = item.get("params", {})
+            if diff is None and contract.segments is not None:
+                diff = SegmentDiff(previous.segments, contract.segments)
+                logging.info(f"{len(diff.changed)} of {len(contract.segments.segments)} segments changed")
+            if diff is not None and hasattr(component, "update"):
+                contract = component.update(contract, previous, diff, **params)
+            else:
+                contract = component(contract, **params)
+            for field in release_after.get(i, ()):
+                setattr(contract, field, None)
+        return contract
+
+    def _process_many(self, file_paths, drop_heavy=False, n_threads=1):
+        """
+        Run the pipeline over a batch of files one component at a time.
+
+        Components that have a `pipe` method get the whole batch at once, so model
+        inference can be batched across documents. Components marked `thread_safe`
+        (the file loader) run over the batch on `n_threads` threads. A failure is
+        recorded on the contract it happened in and that contract skips the remaining
+        components.
+        """
+        contracts = [Contract(file_path) for file_path in file_paths]
+        keys = [None] * len(contracts)
+        cached = set()
+        if self.cache is not None:
+            for j, file_path in enumerate(file_paths):
+                keys[j], hit = self._load_cached(file_path, drop_heavy)
+                if hit is not None:
+                    contracts[j] = hit
+                    cached.add(j)
+        release_after = self._release_points(self.pipeline) if drop_heavy else {}
+        self._apply(self.pipeline, contracts, release_after, n_threads, skip=cached)
+        for j, contract in enumerate(contracts):
+            if j not in cached:
+                self._store_cached(keys[j], contract)
+        return contracts
+
+    def _apply(self, pipeline, contracts, release_after=None, n_threads=1, skip=()):
+        """
+        Run pipeline items over a list of contracts one component at a time, see `_process_many`.
+
+        Contracts are replaced in the list as they are processed, indices in `skip` are left
+        alone. Returns the list.
+        """
+        release_after = release_after or {}
+        for i, item in enumerate(pipeline):
+            component = item["component"]
+            params = item.get("params", {})
+            live = [j for j, contract in enumerate(contracts) if contract.error is None and j not in skip]
+            if not live:
+                break
+            if hasattr(component, "pipe") and len(live) > 1:
+                try:
+                    results = component.pipe([contracts[j] for j in live], **params)
+                    for j, contract in zip(live, results):
+                        contracts[j] = contract
+                    live = []
+                except Exception as err:
+                    logging.error(f"Batch failed in {item['name']}, retrying one document at a time: {err}")
+            def run(j):
+                try:
+                    contracts[j] = component(contracts[j], **params)
+                except Exception as err:
+                    logging.error(f"Failed to process {contracts[j].file_path}: {err}")
+                    contracts[j].error = traceback.format_exc()
+            if n_threads > 1 and len(live) > 1 and getattr(component, "thread_safe", False):
+                with ThreadPoolExecutor(max_workers=min(n_threads, len(live))) as executor:
+                    list(executor.map(run, live))
+            else:
+                for j in live:
+                    run(j)
+            for field in release_after.get(i, ()):
+                for contract in contracts:
+                    setattr(contract, field, None)
+        return contracts
+
+    def pipe(self, file_paths, n_process=1, batch_size=8, ordered=True, drop_heavy=False, n_threads=1) -> Generator:
+        """
+        Process a stream of files, yielding one Contract per file.
+
+        Args:
+        - file_paths (iterable): Paths of the documents to process.
+        - n_process (int): Number of worker processes. 1 runs everything in the current process.
+        - batch_size (int): Number of documents handed to a worker at a time. Components with a
+          `pipe` method (e.g. the model based NER) process a whole batch in one go.
+        - ordered (bool): Yield contracts in input order, otherwise as soon as their batch finishes.
+        - drop_heavy (bool): Release heavy fields early, see `stream`.
+        - n_threads (int): Number of threads loading the documents of a batch. Text extraction
+          and OCR mostly wait on subprocesses, so threads overlap them without the memory of
+          extra processes. The other components still run one document at a time. Combines
+          with n_process, each worker then loads its batch on n_threads threads.
+
+        A document that fails is yielded with `contract.error` set to the traceback
+        so one bad file doesn't stop the run.
+        """
+        batches = _batched(file_paths, batch_size)
+        if n_process == 1:
+            for batch in batches:
+                yield from self._process_many(batch, drop_heavy, n_threads)
+            return
+
+        max_pending = n_process * 2
+        with ProcessPoolExecutor(max_workers=n_process, initializer=_init_worker, initargs=(self,)) as executor:
+            pending = deque() if ordered else set()
+            batch_of = {}
+
+            def submit_next():
+                batch = next(batches, None)
+                if batch is None:
+                    return False
+                future = executor.submit(_process_batch, batch, drop_heavy, n_threads)
+                batch_of[future] = batch
+                if ordered:
+                    pending.append(future)
+                else:
+                    pending.add(future)
+                return True
+
+            while len(pending) < max_pending and submit_next():
+                pass
+            while pending:
+                if ordered:
+                    done = [pending.popleft()]
+                else:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    pending.difference_update(done)
+                for future in done:
+                    yield from _collect_batch(future, batch_of.pop(future))
+                    submit_next()
+
+
+_worker_pipeline = None
+
+def _init_worker(pipeline):
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+def _process_batch(file_paths, drop_heavy=False, n_threads=1):
+    return _worker_pipeline._process_many(file_paths, drop_heavy, n_threads)
+
+def _collect_batch(future, file_paths):
+    try:
+        contracts = future.result()
+    except Exception as err:
+        logging.error(f"Worker failed on batch {file_paths}: {err}")
+        contracts = []
+        for file_path in file_paths:
+            contract = Contract(file_path)
+            contract.error = repr(err)
+            contracts.append(contract)
+    yield from contracts
+
+def _batched(iterable, batch_size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
@@ -1,6 +1,7 @@
 import os
 from ner.clf_ner import CLF_NER
 from ner.regex_ner import RegexNER
+from ner.rules import EFFECTIVE_DATE_RULES, CURRENCY_RULES
 from normalization.date_normalizer import DateNorm
 from normalization.gov_normalizer import GovNorm
 from normalization.lang_normalizer import LangNorm
@@ -10,6 +11,7 @@ from classification.sklearn_classifier import SklearnClassifier
 from ner.transformer_ner import TransformersNER
 from contract import ContractPipeline
 from utils import generate_annotations
+from utils.cache import ResultCache
 import streamlit as st
 
 class ContractData:
@@ -23,7 +25,7 @@ class ContractData:
         self.counterparties = counterparties
 
 def create_contract_pipeline():
-    pipeline = ContractPipeline(defaults=True)
+    pipeline = ContractPipeline(defaults=True, cache=ResultCache())
     if st.sidebar.checkbox("Document Language Classifier (Linear SVM)"):
         language_classifier = SklearnClassifier(
             model="./classification/pretrained/document_language_model.pkl",
@@ -44,38 +46,15 @@ def create_contract_pipeline():
     if st.sidebar.checkbox("Governing Law (BERT)"):
         gov_law_ner = CLF_NER(keywords=["law", "jurisdicition", "governing"],
                               model="sguarnaccio/gov_law_clf_ner", normalizer=GovNorm())
-        pipeline.add_pipe(name="governing_law", component=gov_law_ner)
+        # sessions processing contracts at the same time share forward passes
+        pipeline.add_pipe(name="governing_law", component=gov_law_ner.schedule())
     if st.sidebar.checkbox("Effective Dates (Regex)"):
-        effective_date_rules = [(
-            r"(?:effective|dated) (?:as of|on)*? ((?:\d{1,2}[-/th|st|nd|rd\s]*)?(?:Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|January|February|March|April|May|June|July|August|September|October|November|Decmebter)?[a-z\s,.]*(?:\d{1,2}[-/th|st|nd|rd)\s,]*)+(?:\d{2,4})+)",
-            "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*? ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*(day)\s*(of)\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*? (January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*?  ((?<!\d)([1-9]|([12][0-9])|(3[01]))(?!\d))((?<=1)st|(?<=2)nd|(?<=3)rd|(?<=[0456789])th|\"|°)?\s*of\s*(January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE"),
-            (
-                r"(?:effective|dated) (?:as of|on)*?  (January|February|March|April|May|June|July|August|September|October|November|December|Jan|Feb|Mar|Apr|May|Jun|Jul|Aug|Sep|Oct|Nov|Dec|JANUARY|FEBRUARY|MARCH|APRIL|MAY|JUNE|JULY|AUGUST|SEPTEMBER|OCTOBER|NOVEMBER|DECEMBER|JAN|FEB|MAR|APR|MAY|JUN|JUL|AUG|SEP|OCT|NOV|DEC)\s*[,\.]\s*(?<!\d)([12][0-9]{3})(?!\d)",
-                "EFFECTIVE_DATE")]
         eff_date_ner = RegexNER(normalizer=DateNorm())
-        eff_date_ner.load_raw_rules(effective_date_rules)
+        eff_date_ner.load_raw_rules(EFFECTIVE_DATE_RULES)
         pipeline.add_pipe(name="effective_date", component=eff_date_ner)
     if st.sidebar.checkbox("Currency (Regex)"):
-        currency_rules = [(
-            r"(?P<currency>[\$£€¥₹]|(?:USD|US Dollar|GBP|British Pound|EUR|Euro|JPY|Japanese Yen|INR|Indian Rupee|CAD|Canadian Dollar|AUD|Australian Dollar|CHF|Swiss Franc|CNY|Chinese Yuan|SGD|Singapore Dollar|NZD|New Zealand Dollar|HKD|Hong Kong Dollar|SEK|Swedish Krona|NOK|Norwegian Krone|KRW|South Korean Won|MXN|Mexican Peso|BRL|Brazilian Real|TRY|Turkish Lira|ZAR|South African Rand|IDR|Indonesian Rupiah|MYR|Malaysian Ringgit|PHP|Philippine Peso|THB|Thai Baht|HUF|Hungarian Forint|CZK|Czech Koruna|ILS|Israeli New Shekel|PLN|Polish Złoty|DKK|Danish Krone|AED|United Arab Emirates Dirham|SAR|Saudi Riyal|RON|Romanian Leu|RUB|Russian Ruble|CLP|Chilean Peso|TWD|New Taiwan Dollar|ARS|Argentine Peso|COP|Colombian Peso|VND|Vietnamese Đồng|NGN|Nigerian Naira|UAH|Ukrainian Hryvnia|EGP|Egyptian Pound|QAR|Qatari Riyal|BDT|Bangladeshi Taka|PKR|Pakistani Rupee|PEN|Peruvian Sol))\s*(?P<amount>[0-9]+(?:[,.][0-9]{3})*(?:[,.][0-9]+)?)",
-            "currency")]
         currency_ner = RegexNER()
-        currency_ner.load_raw_rules(currency_rules)
+        currency_ner.load_raw_rules(CURRENCY_RULES)
         pipeline.add_pipe(name="currency", component=currency_ner)
     if st.sidebar.checkbox("Document Type Classifier (Linear SVM)"):
         document_type_classifier = SklearnClassifier(
@@ -87,7 +66,7 @@ def create_contract_pipeline():
         pipeline.add_pipe(name="document_type_classifier", component=document_type_classifier, params={"text_range": (0, 15)})
     if st.sidebar.checkbox("Counterparties and Signatories (BERT)"):
         le_ner = TransformersNER(keywords=["signature"], model="sguarnaccio/le_signatory", normalizer=EntityNormalizer())
-        pipeline.add_pipe(name="legal_entities", component=le_ner)
+        pipeline.add_pipe(name="legal_entities", component=le_ner.schedule())
     return pipeline
 
 @st.cache_resource
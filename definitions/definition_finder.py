@@ -1,8 +1,4 @@
 import re
-import pandas as pd
-import nltk
-nltk.download('punkt')
-from nltk.tokenize import sent_tokenize
 
 pattern_1 = (re.compile(r"(?:(?:word|term|phrase)?\s+|[:,\.]\s*|^)?(?:\"|\u0093|\u0094|\u0022|\u0060{2}|\u0091|\u0092|\u201C|\u201D|\'{2}|\u2019{2}|\u2018\u2019|\u2019\u2018)(?P<term>[^\"\u0093\u0094\u0022\u0060{2}\u0091\u0092\u201C\u201D|\'{2}\u2019{2}\u2018\u2019]{1,75})(?:\"|\u0093|\u0094|\u0022|\u0060{2}|\u0091|\u0092|\u201C|\u201D|\'{2}|\u2019{2}\u2018\u2019|\u2019\u2018|[\s,])\s+(?:will\s+mean|will\s+be\s+defined|shall\s+be\s+defined|shall\s+have\s+the\s+meaning|will\s+have\s+the\s+meaning|includes?|shall\s+mean|means|shallmean|rneans|significa|shall\s+for\s+purposes|have\s+meaning|has\s+the\s+meaning|referred\s+to|known\s+as|refers\s+to|shall\s+refer\s+to|as\s+used|for\s+purposes|shall\s+be\s+deemed\s+to|may\s+be\s+used|is\s+hereby\s+changed\s+to|is\s+defined|shall\s+be\s+interpreted|means\s+each\s+of\s+|is\s+a\s+reference\s+to)(?:\s|[,:]\s){1,2}"),"trigger words/qoutes")
 pattern_2 = (re.compile(r"((?:each(?:,)?\s+)?(?:(?:the|a|an)\s+)?(?:\"|\u0093|\u0094|\u0022|\u0060{2}|\u0091|\u0092|\u201C|\u201D|\'{2}|\u2019{2}|\u2018\u2019|\u2019\u2018)(?P<term>[^\"\u0093\u0094\u0022\u0060{2}\u0091\u0092\u201C\u201D|\'{2}\u2019{2}\u2018\u2019]{1,75}}?)\.?(?:\"|\u0093|\u0094|\u0022|\u0060{2}|\u0091|\u0092|\u201C|\u201D|\'{2}|\u2019{2}|\u2018\u2019|\u2019\u2018))"),"each qoutes")
@@ -15,7 +11,17 @@ triggers = ['will mean','will be defined','shall be defined','shall have the mea
             'referred to','known as','refers to','shall refer to','as used','for purposes','shall be deemed to','may be used',
             'is hereby changed to','is defined','shall be interpreted','means each of','is a reference to',"a reference to"]
 
+def sent_tokenize(text:str):
+    """Split text into sentences with NLTK, downloading the punkt model the first time it is missing."""
+    import nltk
+    try:
+        return nltk.tokenize.sent_tokenize(text)
+    except LookupError:
+        nltk.download('punkt', quiet=True)
+        return nltk.tokenize.sent_tokenize(text)
+
 def definition_finder(text:str):
+    import pandas as pd
     sents = sent_tokenize(text)
     terms = []
     glossary = []
@@ -1,4 +1,8 @@
+import multiprocessing
 import re
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from utils.regex_prefix import first_char_guard
 
 class Definition:
     def __init__(self, term=None, definition=None, phrase=None, start=0, end=0):
@@ -19,20 +23,181 @@ class DefinitionPatterns:
                 'shall mean','means','shallmean','rneans','significa','shall for purposes','have meaning','has the meaning',
                 'referred to','known as','refers to','shall refer to','as used','for purposes','shall be deemed to','may be used',
                 'is hereby changed to','is defined','shall be interpreted','means each of','is a reference to',"a reference to"]
+    # every pattern needs an opening quote, sentences without one can't define anything.
+    # Starting with a class lets the regex engine skip straight to the candidates
+    quotes = re.compile(r"[\"\u0093\u0094\u0091\u0092\u201C\u201D\u0060\'\u2019\u2018]"
+                        r"(?:(?<=[\"\u0093\u0094\u0091\u0092\u201C\u201D])|(?<=\u0060)\u0060|(?<=\')\'|(?<=\u2019)[\u2019\u2018]|(?<=\u2018)\u2019)")
+    # the trigger earliest in the list starting at each position, overlapping ones included
+    trigger_regex = re.compile("(?=(" + "|".join(re.escape(trigger) for trigger in triggers) + "))")
+    trigger_rank = {trigger: rank for rank, trigger in enumerate(triggers)}
+
+WHITESPACE = re.compile(r"\s+")
+NON_SPACE = re.compile(r"\S")
+NOT_TERM = re.compile(r'[^0-9a-zA-Z\s]+')
+# titles of the segments definitions are usually found in
+DEFINITION_HEADINGS = re.compile(r"defin|interpretation|glossary", re.IGNORECASE)
+
+def normalize_sentence(text):
+    """Sentence text with its whitespace collapsed to single spaces, as definitions are searched in."""
+    return WHITESPACE.sub(' ', text).strip()
+
+def document_span(phrase, document, phrase_start, start, end):
+    """Span of document matching phrase[start:end].
+
+    Args:
+        phrase (str): A sentence whitespace normalized from the document.
+        document (str): The document text.
+        phrase_start (int): Offset in document where the sentence starts.
+        start (int): Offset in phrase.
+        end (int): End offset in phrase.
+
+    Returns:
+        tuple: (start, end) offsets in document.
+    """
+    while start < end and phrase[start] == " ":
+        start += 1
+    while end > start and phrase[end - 1] == " ":
+        end -= 1
+    if start == end:
+        return phrase_start, phrase_start
+    # the sentence keeps every non space character of the document, in order
+    first = start - phrase.count(" ", 0, start)
+    last = end - 1 - phrase.count(" ", 0, end - 1)
+    document_start = phrase_start
+    for i, match in enumerate(NON_SPACE.finditer(document, phrase_start)):
+        if i == first:
+            document_start = match.start()
+        if i == last:
+            return document_start, match.end()
+    return document_start, len(document)
+
+def find_definitions(finder, sentences):
+    """Definitions in a run of sentences, first one of a term wins. Also run in the worker processes.
+
+    Args:
+        finder (DefinitionFinder): The finder searching the sentences.
+        sentences (list): (index, text) of whitespace normalized sentences.
+
+    Returns:
+        list: (index, Definition) with offsets relative to the sentence.
+    """
+    glossary, terms = Glossary(), set()
+    found = []
+    for index, text in sentences:
+        count = len(glossary.glossary)
+        finder.extract(text, terms, glossary)
+        found.extend((index, definition) for definition in glossary.glossary[count:])
+    return found
 
 class Definition:
     def __init__(self, term=None, 
                  definition=None, 
                  phrase=None, 
                  start=0, 
-                 end=0):
+                 end=0,
+                 phrase_start=None):
         self.term = term
         self.definition = definition
         self.phrase = phrase
+        # offsets of the term in contract.text, and of the sentence it was found in
         self.start = start
         self.end = end
+        self.phrase_start = phrase_start
+
+def term_pattern(terms):
+    """Regex matching any of terms as whole words, with any whitespace between their words.
+
+    The terms are laid out as a trie, so a match is tried one character at a time whatever
+    the number of terms, and the longest term starting at a position wins.
+    """
+    trie = {}
+    for term in terms:
+        node = trie
+        for char in " ".join(term.split()):
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def pattern(node):
+        branches = [(r"\s+" if char == " " else re.escape(char)) + pattern(child)
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if "" in node:
+            return ("(?:" + body + ")?") if len(branches) == 1 else body + "?"
+        return body
+
+    return first_char_guard(re.compile(r"(?<!\w)(?:" + pattern(trie) + r")(?!\w)"))
+
+class UsageIndex:
+    """Where each defined term is used in a text.
+
+    Uses don't overlap: where terms nest, as "Date" in "Effective Date", only the longest is
+    a use. The place a term is defined counts as one of its uses.
+
+    Args:
+        terms (list): The terms, a term's position in the list is its id.
+        starts (list): Ascending start offsets of every use.
+        ends (list): End offset of every use.
+        ids (list): Id of the term of every use.
+    """
+    def __init__(self, terms, starts, ends, ids):
+        self.terms = terms
+        self.starts = starts
+        self.ends = ends
+        self.ids = ids
+        # sorted start offsets of each term's uses
+        self.offsets = {term: [] for term in terms}
+        for start, id in zip(starts, ids):
+            self.offsets[terms[id]].append(start)
+
+    @classmethod
+    def build(cls, terms, text):
+        """Find every use of terms in text in one pass.
+
+        Matching is case sensitive, a term written in lower case is usually not the defined term.
+        """
+        terms = list(dict.fromkeys(" ".join(term.split()) for term in terms if term and term.strip()))
+        starts, ends, ids = [], [], []
+        if terms and text:
+            id_of = {term: id for id, term in enumerate(terms)}
+            for match in term_pattern(terms).finditer(text):
+                starts.append(match.start())
+                ends.append(match.end())
+                ids.append(id_of[" ".join(match.group().split())])
+        return cls(terms, starts, ends, ids)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def uses(self, term):
+        """Start offsets of the uses of term."""
+        return self.offsets.get(" ".join(term.split()), [])
+
+    def count(self, term, start=0, end=None):
+        """Number of uses of term starting between start and end."""
+        offsets = self.uses(term)
+        last = len(offsets) if end is None else bisect_left(offsets, end)
+        return max(last - bisect_left(offsets, start), 0)
+
+    def occurrences(self, start=0, end=None):
+        """(start, end, term) of the uses lying within start and end."""
+        first = bisect_left(self.starts, start)
+        last = len(self.ends) if end is None else bisect_right(self.ends, end)
+        return [(self.starts[i], self.ends[i], self.terms[self.ids[i]]) for i in range(first, last)]
+
+    def used_in(self, start=0, end=None):
+        """The terms used within start and end, in order of their first use there."""
+        return list(dict.fromkeys(term for _, _, term in self.occurrences(start, end)))
+
+    def used_in_segment(self, segment):
+        """The terms used in a DocumentSegment, its title included."""
+        return self.used_in(segment.start, segment.end)
 
 class Glossary:
+    # where the terms are used in the contract, see build_usage_index
+    usage = None
+
     def __init__(self):
         self.glossary = []
     @property
@@ -42,52 +207,253 @@ class Glossary:
         return iter(self.glossary)
     def append(self,definition):
         self.glossary.append(definition) 
+
+    def build_usage_index(self, contract):
+        """Index every use of the glossary's terms in contract.text, kept as `usage`.
+
+        Args:
+            contract (Contract): The contract the glossary was found in.
+
+        Returns:
+            UsageIndex: The index.
+        """
+        self.usage = UsageIndex.build(self.terms, contract.text)
+        return self.usage
     
 class DefinitionFinder(object):
-    def __init__(self):
-        pass
+    """Find the terms a contract defines and their definitions.
+
+    Sentences are searched segment by segment, with segments titled like a definitions article
+    handed out first. With several workers the segments are searched in parallel processes. The
+    glossaries of the segments are merged in document order, so a term defined in two places
+    keeps the definition that comes first, as when searching serially.
+
+    The worker processes are started on first use and run until `close`, which the pipeline
+    calls from its own `close`. The finder can also be used as a context manager.
+
+    Args:
+        n_workers (int): Number of processes searching segments, 1 searches in the current process.
+    """
+    requires = ("text", "sentences", "segments")
+
+    def __init__(self, n_workers=1):
+        self.n_workers = n_workers
+        self.executor = None
+
+    def __getstate__(self):
+        # worker processes get the settings, not the pool
+        state = self.__dict__.copy()
+        state["executor"] = None
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Shut down the worker processes."""
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def extract(self, text, terms, glossary):
+        """Add the definitions found in one whitespace normalized sentence to the glossary.
+
+        Args:
+            text (str): The sentence.
+            terms (set): Lower cased terms already defined, the first definition of a term wins.
+            glossary (Glossary): Glossary the definitions are added to.
+        """
+        if not DefinitionPatterns.quotes.search(text):
+            return
+        for ptn in DefinitionPatterns.patterns:
+            for match in ptn[0].finditer(text):
+                term, start, end = match.group('term'), match.start('term'), match.end('term')
+                term = NOT_TERM.sub('', term)
+                term_lower = term.lower()
+                if term_lower in terms:
+                    continue
+                if not term:
+                    # nothing left of the term to look for, the rest of this pattern's matches are skipped
+                    break
+                found = text.find(term)
+                if found != -1:
+                    self.define(term, text, found + len(term), start, end, terms, glossary)
+
+    def define(self, term, text, after, start, end, terms, glossary):
+        """Add the definition of term to the glossary from the text following its first occurrence.
+
+        The trigger earliest in DefinitionPatterns.triggers found after the term gives the
+        definition, unless it is not the first trigger and the term is followed by a colon. An
+        upper case term spelled out by the initials of the words before it is defined by them,
+        and also by a later trigger.
+
+        Args:
+            term (str): The term, as cleaned of punctuation.
+            text (str): The sentence.
+            after (int): Offset in text where the first occurrence of term ends.
+            start (int): Offset of the matched term in text.
+            end (int): End offset of the matched term in text.
+        """
+        trigger, position = None, -1
+        for match in DefinitionPatterns.trigger_regex.finditer(text, after):
+            candidate = match.group(1)
+            if trigger is None or DefinitionPatterns.trigger_rank[candidate] < DefinitionPatterns.trigger_rank[trigger]:
+                trigger, position = candidate, match.start()
+                if candidate == DefinitionPatterns.triggers[0]:
+                    break
+        if trigger is not None and trigger == DefinitionPatterns.triggers[0]:
+            self.add(term, text[position + len(trigger):].strip(), text, start, end, terms, glossary)
+            return
+        if text[after + 1:after + 2] == ":":
+            self.add(term, text[after:].split(":", 1)[1].strip(), text, start, end, terms, glossary)
+            return
+        if term.isupper():
+            words = self.spelled_out(term, text[:after - len(term)])
+            if words is not None:
+                self.add(term, words, text, start, end, terms, glossary)
+        if trigger is not None:
+            self.add(term, text[position + len(trigger):].strip(), text, start, end, terms, glossary)
+
+    def spelled_out(self, term, before):
+        """The words before an acronym whose initials spell it, or None.
+
+        Words are taken in groups as long as the acronym from the start of the sentence, so
+        only groups starting at a multiple of its length are tried.
+        """
+        words = before.split()
+        initials = ''.join(word[0] for word in words)
+        size = len(term)
+        for i in range(0, len(words), size):
+            if initials[i:i + size] == term:
+                return ' '.join(words[i:i + size])
+        return None
+
+    def add(self, term, definition, text, start, end, terms, glossary):
+        terms.add(term.lower())
+        glossary.append(Definition(term, definition, text, start, end))
+
+    def segment_groups(self, contract, texts, starts):
+        """Sentences that may define something, as (index, text) lists for each segment in document order.
+
+        Returns:
+            tuple: The groups, and the indexes of the groups under a definitions heading.
+        """
+        segments = list(contract.segments) if contract.segments else []
+        groups = [[] for _ in range(max(len(segments), 1))]
+        # sentences before the first segment go with it
+        owners = contract.segments.index_at(starts).tolist() if segments else [0] * len(texts)
+        for index, (text, owner) in enumerate(zip(texts, owners)):
+            if DefinitionPatterns.quotes.search(text):
+                groups[owner].append((index, text))
+        headings = {i for i, segment in enumerate(segments) if segment.title and DEFINITION_HEADINGS.search(segment.title)}
+        return groups, headings
+
+    def search(self, groups, headings):
+        """Definitions found in each run of segments, in document order.
+
+        Segments under a definitions heading are searched first. Between them, consecutive
+        segments are searched together in runs of about the same number of sentences, a run
+        finding what its segments would one after the other.
+        """
+        size = max(sum(map(len, groups)) // (4 * max(self.n_workers, 1)), 1)
+        runs, first, run = [], [], []
+        for i, group in enumerate(groups):
+            if i in headings and group:
+                if run:
+                    runs.append(run)
+                first.append(len(runs))
+                runs.append(group)
+                run = []
+                continue
+            run.extend(group)
+            if len(run) >= size:
+                runs.append(run)
+                run = []
+        if run:
+            runs.append(run)
+        order = first + sorted(set(range(len(runs))) - set(first))
+        if self.n_workers <= 1 or len(runs) < 2:
+            found = {i: find_definitions(self, runs[i]) for i in order}
+            return [found[i] for i in range(len(runs))]
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        futures = {i: self.executor.submit(find_definitions, self, runs[i]) for i in order}
+        return [futures[i].result() for i in range(len(runs))]
+
     def __call__(self,contract):
+        texts = [normalize_sentence(text) for text in contract.sentences.text]
+        starts = contract.sentences.starts.tolist()
         glossary = Glossary()
         terms = set()
 
+        # a segment's definitions only stand where no earlier segment defined the term
+        for found in self.search(*self.segment_groups(contract, texts, starts)):
+            defined = set()
+            for index, definition in found:
+                term = definition.term.lower()
+                if term not in terms:
+                    defined.add(term)
+                    glossary.append(self.locate(definition, contract.text, starts[index]))
+            terms |= defined
+
+        contract.glossary = glossary
+        return contract
+
+    def locate(self, definition, document, phrase_start):
+        """Turn the offsets of a definition in its sentence into offsets in the document."""
+        definition.start, definition.end = document_span(definition.phrase, document, phrase_start,
+                                                         definition.start, definition.end)
+        definition.phrase_start = phrase_start
+        return definition
+
+    def moved(self, definition, phrase_start):
+        """Definition found in a previous version, with its offsets moved to where its sentence now starts."""
+        if definition.phrase_start is None:
+            return definition
+        shift = phrase_start - definition.phrase_start
+        return Definition(definition.term, definition.definition, definition.phrase,
+                          definition.start + shift, definition.end + shift, phrase_start)
+
+    def update(self, contract, previous, diff):
+        """Find definitions in a revised version of a contract, only searching sentences that are new.
+
+        Sentences that were already in the previous version get the definitions found in them
+        then. A term those sentences define that was shadowed by an earlier definition the
+        amendment removed is only picked up by a full run.
+
+        Args:
+            contract (Contract): The revised contract.
+            previous (Contract): The processed previous version.
+            diff (SegmentDiff): Segments of contract matched against those of previous.
+
+        Returns:
+            Contract: The processed contract.
+        """
+        if previous.glossary is None or previous.sentences is None:
+            return self(contract)
+        known = {}
+        for definition in previous.glossary:
+            known.setdefault(definition.phrase, []).append(definition)
+        seen = {normalize_sentence(sent.text) for sent in previous.sentences}
+
+        glossary = Glossary()
+        terms = set()
         for sent in contract.sentences:
-            text = re.sub(r"\s+", ' ', sent.text).strip()
-
-            for ptn in DefinitionPatterns.patterns:
-                matches = re.finditer(ptn[0], text)
-
-                for match in matches:
-                    term, start, end = match.group('term'), match.start('term'), match.end('term')
-                    term = re.sub('[^0-9a-zA-Z\s]+', '', term)
-                    term_lower = term.lower()  # Convert term to lowercase
-
-                    if term_lower not in terms:
-                        try:
-                            split_sent = text.split(term, 1)
-                        except ValueError:
-                            break
-                        if len(split_sent) > 1:  # Check if there are enough elements
-                            for trigger in DefinitionPatterns.triggers:
-                                if split_sent[1].find(trigger) != -1:
-                                    definition = split_sent[1].split(trigger, 1)[1].strip()
-                                    terms.add(term_lower)
-                                    glossary.append(Definition(term, definition, text, start, end))
-                                    break
-                                if term_lower not in terms and split_sent[1][1] == ":":
-                                    definition = split_sent[1].split(":", 1)[1].strip()
-                                    terms.add(term_lower)
-                                    glossary.append(Definition(term, definition, text, start, end))
-                                    break
-                                if term_lower not in terms and term.isupper():
-                                    term_len = len(term)
-                                    split_sent = text.split(term, 1)
-                                    candidates = [split_sent[0].split()[i:i + term_len] for i in range(0, len(split_sent[0]), term_len)]
-                                    for candidate in candidates:
-                                        candidate_accro = ''.join(word[0] for word in candidate)
-                                        if candidate_accro == term:
-                                            terms.add(term_lower)
-                                            glossary.append(Definition(term, ' '.join(word for word in candidate), text, start, end))
-                                            break
+            text = normalize_sentence(sent.text)
+            if text not in seen:
+                count = len(glossary.glossary)
+                self.extract(text, terms, glossary)
+                for definition in glossary.glossary[count:]:
+                    self.locate(definition, contract.text, sent.start)
+                continue
+            for definition in known.get(text, ()):
+                if definition.term.lower() not in terms:
+                    terms.add(definition.term.lower())
+                    glossary.append(self.moved(definition, sent.start))
+
         contract.glossary = glossary
         return contract
-                                
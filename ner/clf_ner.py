@@ -1,4 +1,5 @@
 from transformers import BertPreTrainedModel
+from functools import partial
 from typing import List
 import torch
 from torch import nn
@@ -6,6 +7,8 @@ import numpy as np
 from transformers import AutoTokenizer,BertModel
 from ner.named_entity_recognizer import NamedEntityRecognizer
 from ner.named_entity import NamedEntity
+from ner.windows import stitch_windows
+from utils.models import share_model
 
 class ClassifierNER(BertPreTrainedModel):
     def __init__(self,config):
@@ -34,7 +37,11 @@ class ClassifierNER(BertPreTrainedModel):
           clf_loss = self.loss_fct(clf_logits.view(-1, self.clf_classes), clf_labels_tensor.view(-1))
         ner_output = outputs[0]
         ner_output = self.dropout(ner_output)
-        lstm_output,hc = self.ner_lstm(ner_output)
+        # pack the sequences so padding in a batch doesn't leak into the backward LSTM pass
+        lengths = attention_mask.sum(dim=1).cpu()
+        packed = nn.utils.rnn.pack_padded_sequence(ner_output,lengths,batch_first=True,enforce_sorted=False)
+        lstm_output,hc = self.ner_lstm(packed)
+        lstm_output,_ = nn.utils.rnn.pad_packed_sequence(lstm_output,batch_first=True,total_length=ner_output.size(1))
         ner_logits = self.ner_linear(lstm_output)        
         ner_loss = 0
         if ner_labels is not None:
@@ -45,16 +52,44 @@ class ClassifierNER(BertPreTrainedModel):
         else:
             return clf_logits,ner_logits
     def predict(self,text):
+        return self.predict_batch([text])[0]
+    def predict_batch(self,texts,batch_size=16,stride=None):
+        """Run the model over several texts, one padded forward pass per batch.
+
+        Texts are sorted by length first so each batch is only padded to its own longest member.
+        With a stride, texts longer than 512 tokens are split into windows overlapping by `stride`
+        tokens instead of being truncated; the windows run in the same batches and their
+        predictions are stitched back onto the text's character offsets.
+        Returns one {"classification","entities"} dict per text, in input order.
+        """
+        results = [None] * len(texts)
+        order = sorted(range(len(texts)),key=lambda i: len(texts[i]))
         with torch.no_grad():
-            tokenized = self.tokenizer.encode_plus(text,truncation=True,max_length=512,return_tensors="pt",return_offsets_mapping=True)
-            clf_prediction,ner_prediction = self(tokenized['input_ids'],tokenized['token_type_ids'],tokenized['attention_mask'])
-            clf_prediction = self.clf_labels[str(torch.argmax(clf_prediction,dim=-1).item())]
-            ner_prediction = self.align_predictions(text,ner_prediction,tokenized['offset_mapping'])
-        return {"classification":clf_prediction,"entities":ner_prediction}    
+            for b in range(0,len(order),batch_size):
+                idxs = order[b:b + batch_size]
+                tokenized = self.tokenizer([texts[i] for i in idxs],truncation=True,max_length=512,padding=True,return_tensors="pt",return_offsets_mapping=True,
+                                           return_overflowing_tokens=stride is not None,stride=stride or 0)
+                clf_probs,ner_ids = [],[]
+                for r in range(0,len(tokenized['input_ids']),batch_size):
+                    clf_prediction,ner_prediction = self(tokenized['input_ids'][r:r + batch_size],tokenized['token_type_ids'][r:r + batch_size],tokenized['attention_mask'][r:r + batch_size])
+                    clf_probs.extend(torch.softmax(clf_prediction,dim=-1).tolist())
+                    ner_ids.extend(torch.argmax(ner_prediction,dim=-1).tolist())
+                for k,(rows,labels,offsets) in enumerate(stitch_windows(tokenized,ner_ids,stride)):
+                    i = idxs[k]
+                    results[i] = {"classification":self.classify_windows([clf_probs[row] for row in rows]),
+                                  "entities":self.align_predictions(texts[i],labels,offsets)}
+        return results
+    def classify_windows(self,window_probs):
+        # a text is positive when any of its windows is, labelled by the most confident positive window
+        best_label,best_score = None,-1.0
+        for probs in window_probs:
+            idx = max(range(len(probs)),key=probs.__getitem__)
+            label = self.clf_labels[str(idx)]
+            if label != "Negative" and probs[idx] > best_score:
+                best_label,best_score = label,probs[idx]
+        return best_label if best_label is not None else "Negative"
     def align_predictions(self,text,predictions,offsets):
         results = []
-        predictions = torch.argmax(predictions,dim=-1)[0].tolist()
-        offsets = offsets[0].tolist()
         idx = 0
         while idx < len(predictions):
             pred = predictions[idx]
@@ -86,13 +121,27 @@ class ClassifierNER(BertPreTrainedModel):
         return results
     
 class CLF_NER(NamedEntityRecognizer):
-    def __init__(self, model=None, keywords=None, normalizer=None):
-        super().__init__(keywords=keywords, normalizer=normalizer)
+    def __init__(self, model=None, keywords=None, normalizer=None, batch_size=16, stride=128):
+        super().__init__(keywords=keywords, normalizer=normalizer, batch_size=batch_size)
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = ClassifierNER.from_pretrained(model)
+        share_model(self, "clf_ner", model, partial(ClassifierNER.from_pretrained, model))
+        self.model_name = model
+        # overlap between 512 token windows of long segments, None truncates them instead
+        self.stride = stride
 
     def predict(self, text):
-        res =  self.model.predict(text)
+        res =  self.model.predict_batch([text], stride=self.stride)[0]
+        yield from self.to_entities(res)
+
+    def forward(self, texts):
+        return self.model.predict_batch(texts, batch_size=self.batch_size, stride=self.stride)
+
+    def predict_batch(self, texts):
+        if not texts:
+            return []
+        return [list(self.to_entities(res)) for res in self.run_model(texts)]
+
+    def to_entities(self, res):
         clf_prediction = res["classification"]
         ner_prediction = res["entities"]
         if clf_prediction != "Negative":
@@ -1,3 +1,4 @@
+from functools import partial
 from typing import List, Optional, Tuple, Dict, Union, Generator
 from transformers import AutoTokenizer, AutoModel
 import torch
@@ -7,6 +8,8 @@ from sentence_transformers import SentenceTransformer
 from ner.lstm_config import BiLSTM_CRFConfig
 from ner.named_entity_recognizer import NamedEntityRecognizer
 from ner.named_entity import NamedEntity
+from ner.windows import stitch_windows
+from utils.models import share_model
 
 class BiLSTM_CRF(nn.Module):
     """
@@ -59,7 +62,15 @@ class BiLSTM_CRF(nn.Module):
             outputs = self.embedding_model(input_ids=input_ids, attention_mask=attention_mask)
             embeddings = outputs.last_hidden_state
         
-        lstm_outputs, _ = self.lstm(embeddings)
+        if attention_mask is not None:
+            # pack the sequences so padding in a batch doesn't leak into the backward LSTM pass
+            lengths = attention_mask.sum(dim=1).cpu()
+            packed = nn.utils.rnn.pack_padded_sequence(embeddings, lengths, batch_first=self.batch_first, enforce_sorted=False)
+            lstm_outputs, _ = self.lstm(packed)
+            lstm_outputs, _ = nn.utils.rnn.pad_packed_sequence(lstm_outputs, batch_first=self.batch_first,
+                                                               total_length=embeddings.size(1 if self.batch_first else 0))
+        else:
+            lstm_outputs, _ = self.lstm(embeddings)
         lstm_outputs = self.drop(lstm_outputs)
         logits = self.linear(lstm_outputs)
         
@@ -81,25 +92,50 @@ class BiLSTM_CRF(nn.Module):
                 tags = self.crf.decode(logits, mask=attention_mask.bool())
                 return logits, tags
 
-    def predict(self, text):
+    def predict(self, text, stride: Optional[int] = None):
+        return self.predict_batch([text], stride=stride)[0]
+
+    def predict_batch(self, texts: List[str], batch_size: int = 16, stride: Optional[int] = None) -> List[List[dict]]:
+        """
+        Predicts entities for several texts, running one padded forward pass per batch.
+
+        Texts are sorted by length so each batch is only padded to its own longest member.
+
+        Args:
+            texts (List[str]): The input texts.
+            batch_size (int): Number of texts per forward pass.
+            stride (Optional[int]): Split texts longer than 512 tokens into windows overlapping by
+                this many tokens and stitch their predictions back together. Defaults to None,
+                which truncates long texts.
+
+        Returns:
+            List[List[dict]]: The aligned entities of each text, in input order.
+        """
+        results = [None] * len(texts)
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
         with torch.no_grad():
-            tokenized = self.tokenizer.encode_plus(text, truncation=True, max_length=512,
-                                                    return_tensors="pt", return_offsets_mapping=True)
-            if not self.use_crf:
-                logits = self(tokenized['input_ids'], tokenized['attention_mask'])            
-                aligned_predictions = self.align_predictions(text, logits, tokenized['offset_mapping'])
-            else:
-                logits, tags = self(tokenized['input_ids'], tokenized['attention_mask'])      
-                aligned_predictions = self.align_predictions(text, tags, tokenized['offset_mapping'])
-        return aligned_predictions
+            for b in range(0, len(order), batch_size):
+                idxs = order[b:b + batch_size]
+                tokenized = self.tokenizer([texts[i] for i in idxs], truncation=True, max_length=512, padding=True,
+                                           return_tensors="pt", return_offsets_mapping=True,
+                                           return_overflowing_tokens=stride is not None, stride=stride or 0)
+                predictions = []
+                for r in range(0, len(tokenized['input_ids']), batch_size):
+                    input_ids = tokenized['input_ids'][r:r + batch_size]
+                    attention_mask = tokenized['attention_mask'][r:r + batch_size]
+                    if not self.use_crf:
+                        logits = self(input_ids, attention_mask)
+                        predictions.extend(torch.argmax(logits, dim=-1).tolist())
+                    else:
+                        logits, tags = self(input_ids, attention_mask)
+                        predictions.extend(tags)
+                for k, (rows, labels, offsets) in enumerate(stitch_windows(tokenized, predictions, stride)):
+                    i = idxs[k]
+                    results[i] = self.align_predictions(texts[i], labels, offsets)
+        return results
 
-    def align_predictions(self, text, logits_or_tags, offsets):
+    def align_predictions(self, text, predictions, offsets):
         results = []
-        if self.use_crf:
-            predictions = logits_or_tags[0]  # tags
-        else:
-            predictions = torch.argmax(logits_or_tags, dim=-1)[0].tolist()
-        offsets = offsets[0].tolist()
         idx = 0
         
         while idx < len(predictions):
@@ -136,6 +172,9 @@ class BiLSTM_CRF(nn.Module):
         print(f"Model and configuration loaded from {path}")
         return model
     
+def load_to_device(path: str, device: str) -> BiLSTM_CRF:
+    return BiLSTM_CRF.load_model(path).to(device)
+
 class BILSTM_NER(NamedEntityRecognizer):
     """
     BILSTM_NER is a named entity recognizer that uses a BiLSTM model for predictions.
@@ -144,6 +183,9 @@ class BILSTM_NER(NamedEntityRecognizer):
         model (str): Path to the pre-trained BiLSTM model.
         keywords (Optional[List[str]]): List of keywords for the NamedEntityRecognizer. Defaults to None.
         normalizer (Optional[Callable[[str], str]]): Function to normalize text. Defaults to None.
+        batch_size (int): Number of segments per forward pass. Defaults to 16.
+        stride (Optional[int]): Token overlap between the 512 token windows of long segments.
+            None truncates long segments instead. Defaults to 128.
 
     Attributes:
         model (BiLSTM): The loaded BiLSTM-CRF model.
@@ -151,18 +193,24 @@ class BILSTM_NER(NamedEntityRecognizer):
     Methods:
         predict(text: str) -> Generator[NamedEntity, None, None]:
             Predicts named entities in the given text.
+
+        predict_batch(texts: List[str]) -> List[List[NamedEntity]]:
+            Predicts named entities for several texts in padded batches.
         
-        __call__(text: str) -> List[NamedEntity]:
-            Calls the predict method and returns the results.
+        __call__(contract: Contract) -> Contract:
+            Finds the entities of the contract's eligible segments.
     """
 
     def __init__(self, model: str, 
                  keywords: Optional[list] = None, 
-                 normalizer: Optional[callable] = None):
-        super().__init__(keywords=keywords, normalizer=normalizer)
+                 normalizer: Optional[callable] = None,
+                 batch_size: int = 16,
+                 stride: Optional[int] = 128):
+        super().__init__(keywords=keywords, normalizer=normalizer, batch_size=batch_size)
         device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = BiLSTM_CRF.load_model(model)
-        self.model.to(device)
+        share_model(self, f"lstm_crf:{device}", model, partial(load_to_device, model, device))
+        self.model_name = model
+        self.stride = stride
 
     def predict(self, text: str) -> Generator[NamedEntity, None, None]:
         """
@@ -174,27 +222,40 @@ class BILSTM_NER(NamedEntityRecognizer):
         Yields:
             NamedEntity: A named entity found in the text.
         """
-        res = self.model.predict(text)
-        clf_prediction = res["classification"]
-        ner_prediction = res["entities"]
-        if clf_prediction != "Negative":
-            for ent in ner_prediction:
-                named_ent = NamedEntity(
-                    name=ent["entity"],
-                    label=ent['label'],
-                    start=ent['start'],
-                    end=ent["end"]
-                )
-                yield named_ent
-
-    def __call__(self, text: str) -> list:
+        res = self.model.predict(text, stride=self.stride)
+        yield from self.to_entities(res)
+
+    def predict_batch(self, texts: List[str]) -> List[List[NamedEntity]]:
         """
-        Calls the predict method and returns the results.
+        Predicts named entities for several texts in padded batches.
 
         Args:
-            text (str): The input text to process.
+            texts (List[str]): The input texts to process.
+
+        Returns:
+            List[List[NamedEntity]]: The named entities found in each text.
+        """
+        results = self.model.predict_batch(texts, batch_size=self.batch_size, stride=self.stride)
+        return [list(self.to_entities(res)) for res in results]
+
+    def to_entities(self, ner_prediction: List[dict]) -> Generator[NamedEntity, None, None]:
+        for ent in ner_prediction:
+            named_ent = NamedEntity(
+                name=ent["entity"],
+                label=ent['label'],
+                start=ent['start'],
+                end=ent["end"]
+            )
+            yield named_ent
+
+    def __call__(self, contract):
+        """
+        Finds the entities of the contract's eligible segments.
+
+        Args:
+            contract (Contract): The contract object to process.
 
         Returns:
-            List[NamedEntity]: A list of named entities found in the text.
+            Contract: The contract with its entities updated.
         """
-        return list(self.predict(text))
\ No newline at end of file
+        return super().__call__(contract)
\ No newline at end of file
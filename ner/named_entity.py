@@ -1,3 +1,7 @@
+import numpy as np
+from ner.span_index import SpanIndex
+from utils.columns import SpanColumns
+
 class NamedEntity:
     def __init__(self, name=None, normalized = None, label=None, start=0, end=0, bbox=None):
         self.name = name
@@ -7,10 +11,15 @@ class NamedEntity:
         self.end = end
         self.lei_info = None
         self.bbox = bbox
+        # the DocumentSegment the entity was found in
+        self.segment = None
 
 class Entities:
     def __init__(self, entities=None):
         self._entities = entities if entities is not None else []
+        # character spans already taken, shared by every recognizer adding to this collection
+        self.spans = SpanIndex((ent.start, ent.end) for ent in self._entities)
+        self._columns = None
 
     @property
     def ents(self):
@@ -19,5 +28,28 @@ class Entities:
     def __iter__(self):
         return iter(self._entities)
 
+    def overlaps(self, start, end):
+        return self.spans.overlaps(start, end)
+
     def append(self, entity):
-        self._entities.append(entity)
\ No newline at end of file
+        self._entities.append(entity)
+        self.spans.add(entity.start, entity.end)
+        self._columns = None
+
+    def __len__(self):
+        return len(self._entities)
+
+    @property
+    def columns(self):
+        """SpanColumns of the entities' offsets in document order, built on first use."""
+        if self._columns is None:
+            # position in the collection of the entity of each span
+            self._order = np.argsort([ent.start for ent in self._entities], kind="stable").tolist()
+            self._columns = SpanColumns(None, [self._entities[i].start for i in self._order],
+                                        [self._entities[i].end for i in self._order])
+        return self._columns
+
+    def within(self, start, end):
+        """The entities lying entirely inside [start, end), in document order."""
+        spans = self.columns.indexes_within(start, end)
+        return [self._entities[i] for i in self._order[spans.start:spans.stop]]
\ No newline at end of file
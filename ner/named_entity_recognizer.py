@@ -1,49 +1,72 @@
+from copy import copy
 from ner.named_entity import Entities
+from utils.cache import model_identity
+from utils.inference import shared_scheduler
+from utils.models import RegisteredModel
 
 class NamedEntityRecognizer:
-    def __init__(self, rules=None, keywords=None, normalizer=None):
+    requires = ("segments", "tokens")
+    # model backed recognizers load it through the registry on first use, see utils.models.share_model
+    model = RegisteredModel()
+
+    def __init__(self, rules=None, keywords=None, normalizer=None, batch_size=16):
         """Initialize the NamedEntityRecognizer.
 
         Args:
             rules (list): List of rules for entity recognition.
             keywords (list): List of keywords for filtering.
             normalizer (Normalizer): Object for normalizing entity names.
+            batch_size (int): Number of segments sent to the model at once by predict_batch.
         """
         self.entities = Entities()
         self.rules = rules
         self.keywords = keywords
         self.normalizer = normalizer
+        self.batch_size = batch_size
+        # name or path the model was loaded from, identifies it in ContractPipeline.fingerprint
+        self.model_name = None
+        self.scheduler = None
 
-    def find_entities(self, contract):
-        entity_idxs = set()
-        if contract.ents is not None:
-            self.entities = contract.ents
-            entity_idxs.update(range(ent.start, ent.end) for ent in contract.ents)
+    def config(self):
+        """Settings that change the recognizer's output, hashed into ContractPipeline.fingerprint."""
+        return {
+            "model": model_identity(self.model_name),
+            "keywords": self.keywords,
+            "normalizer": type(self.normalizer).__name__ if self.normalizer else None,
+            "stride": getattr(self, "stride", None),
+        }
 
+    def eligible_segments(self, contract):
+        """Yield the segments of the contract whose title matches the keywords, or all of them without keywords."""
         for segment in contract.segments:
-            text = segment.text
             title = segment.title
-
             if self.keywords and title and any(keyword in title.lower().split() for keyword in self.keywords):
-                entities = self.predict(text)
+                yield segment
             elif not self.keywords:
-                entities = self.predict(text)
-            else:
-                entities = []
+                yield segment
+
+    def find_entities(self, contract):
+        segments = list(self.eligible_segments(contract))
+        predictions = self.predict_batch([segment.text for segment in segments])
+        self.add_entities(contract, segments, predictions)
+        return self.entities
+
+    def add_entities(self, contract, segments, predictions):
+        """Place the entities predicted for each segment into the contract, skipping overlaps."""
+        if contract.ents is not None:
+            self.entities = contract.ents
+        token_index = contract.token_index
 
+        for segment, entities in zip(segments, predictions):
             for ent in entities:
                 start, end = ent.start + segment.start, ent.end + segment.start
-                overlapped = any(idx in entity_idxs for idx in range(start, end))
 
-                if not overlapped:
-                    entity_idxs.update(range(start, end))
+                if not self.entities.overlaps(start, end):
                     ent.start, ent.end = start, end
+                    ent.segment = segment
 
-                    # Find tokens corresponding to the entity's start and end positions
-                    entity_tokens = [token for token in contract.tokens if token.idx >= start and token.idx + len(token.text) <= end]
-                    
-                    # Extract bounding boxes corresponding to the tokens
-                    entity_bboxes = [token._.bbox for token in entity_tokens]
+                    # Extract bounding boxes of the tokens within the entity's start and end positions
+                    entity_bboxes = [token._.bbox for token in token_index.within(start, end)] if token_index else []
 
                     # Associate bounding boxes with the entity
                     ent.bbox_span = entity_bboxes
@@ -54,10 +77,48 @@ class NamedEntityRecognizer:
 
         return self.entities
 
+    def schedule(self, max_batch_size=None, max_wait_ms=5):
+        """Send the model calls through an InferenceScheduler shared with every recognizer running the same model.
+
+        Segments from contracts processed at the same time, in other threads or pipelines, are
+        then batched into the same forward passes.
+
+        Args:
+            max_batch_size (int): Most segments per forward pass, batch_size by default.
+            max_wait_ms (float): How long a segment waits for others to fill its batch.
+
+        Returns:
+            NamedEntityRecognizer: self.
+        """
+        key = (type(self).__name__, model_identity(self.model_name), self.batch_size, getattr(self, "stride", None))
+        self.scheduler = shared_scheduler(key, self.forward, max_batch_size=max_batch_size or self.batch_size,
+                                          max_wait_ms=max_wait_ms, name=f"{type(self).__name__}:{self.model_name}")
+        return self
+
+    def forward(self, texts):
+        """Raw model output for each text. Model backed recognizers implement this to be scheduled."""
+        raise NotImplementedError(f"{type(self).__name__} has no model to schedule.")
+
+    def run_model(self, texts):
+        """forward, through the scheduler when there is one."""
+        if self.scheduler is not None:
+            return self.scheduler.submit(texts)
+        return self.forward(texts)
+
     def predict(self, text):
         raise NotImplementedError("Subclasses must implement the predict method.")
-   
-    
+
+    def predict_batch(self, texts):
+        """Predict entities for several texts. Model backed recognizers override this to run batched forward passes.
+
+        Args:
+            texts (list): Segment texts.
+
+        Returns:
+            list: One list of NamedEntity per text, with offsets relative to that text.
+        """
+        return [list(self.predict(text)) for text in texts]
+
     def __call__(self, contract):
         """Process the contract to find entities.
 
@@ -71,3 +132,78 @@ class NamedEntityRecognizer:
         self.find_entities(contract)
         contract.ents = self.entities
         return contract
+
+    def update(self, contract, previous, diff):
+        """Find entities in a revised version of a contract, only predicting the segments that changed.
+
+        Entities found in unchanged segments of the previous version are copied over once, by
+        whichever recognizer runs first, with their offsets shifted to where the segment moved.
+
+        Args:
+            contract (Contract): The revised contract.
+            previous (Contract): The processed previous version.
+            diff (SegmentDiff): Segments of contract matched against those of previous.
+
+        Returns:
+            Contract: The processed contract.
+        """
+        if not self.carry_entities(contract, previous, diff):
+            return self(contract)
+        segments = [segment for segment in self.eligible_segments(contract) if diff.previous(segment) is None]
+        self.entities = Entities()
+        self.add_entities(contract, segments, self.predict_batch([segment.text for segment in segments]))
+        contract.ents = self.entities
+        return contract
+
+    def carry_entities(self, contract, previous, diff):
+        """Copy the entities of unchanged segments from previous into contract, if no other recognizer did yet.
+
+        Returns:
+            bool: False when the previous entities can't be traced back to their segments.
+        """
+        previous_ents = list(previous.ents) if previous.ents is not None else []
+        if any(getattr(ent, "segment", None) is None for ent in previous_ents):
+            return False
+        if diff.entities_carried:
+            return True
+        diff.entities_carried = True
+        if contract.ents is None:
+            contract.ents = Entities()
+        token_index = contract.token_index
+        for ent in previous_ents:
+            segment = diff.current(ent.segment)
+            if segment is None:
+                continue
+            shift = segment.start - ent.segment.start
+            start, end = ent.start + shift, ent.end + shift
+            if contract.ents.overlaps(start, end):
+                continue
+            ent = copy(ent)
+            ent.start, ent.end, ent.segment = start, end, segment
+            # the layout may have changed even where the text didn't
+            ent.bbox_span = [token._.bbox for token in token_index.within(start, end)] if token_index else []
+            contract.ents.append(ent)
+        return True
+
+    def pipe(self, contracts):
+        """Process several contracts, batching the eligible segments of all of them through predict_batch.
+
+        Args:
+            contracts (list): Contract objects to process.
+
+        Returns:
+            list: The processed contracts.
+        """
+        contracts = list(contracts)
+        jobs = [(contract, segment) for contract in contracts for segment in self.eligible_segments(contract)]
+        predictions = self.predict_batch([segment.text for _, segment in jobs])
+        by_contract = {id(contract): ([], []) for contract in contracts}
+        for (contract, segment), entities in zip(jobs, predictions):
+            segments, contract_predictions = by_contract[id(contract)]
+            segments.append(segment)
+            contract_predictions.append(entities)
+        for contract in contracts:
+            self.entities = Entities()
+            self.add_entities(contract, *by_contract[id(contract)])
+            contract.ents = self.entities
+        return contracts
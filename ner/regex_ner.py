@@ -1,11 +1,57 @@
 from ner.named_entity import NamedEntity
 from ner.named_entity_recognizer import NamedEntityRecognizer
+from utils.regex_prefix import can_match_empty, first_char_class, first_char_guard
 import re
 
+# back references and conditionals point at group numbers, which shift once rules are combined
+GROUP_REFERENCE = re.compile(r"\\[1-9]|\(\?P=|\(\?\(")
+SCOPED_FLAGS = [(re.IGNORECASE, "i"), (re.MULTILINE, "m"), (re.DOTALL, "s"), (re.ASCII, "a"), (re.VERBOSE, "x")]
+
+def combine_rules(regexes):
+    """Compile one alternation of all the rules, or return None when they can't be combined.
+
+    The alternation matches wherever any of the rules matches, so no rule can match starting
+    between two of its hits, see `candidate_windows`. Rules that can match the empty string
+    would make every position a hit and aren't combined.
+    """
+    parts = []
+    starts = []
+    for regex, _ in regexes:
+        if not isinstance(regex.pattern, str) or GROUP_REFERENCE.search(regex.pattern) or can_match_empty(regex):
+            return None
+        flags = "".join(letter for flag, letter in SCOPED_FLAGS if regex.flags & flag)
+        scope = f"(?{flags}:" if flags else "(?:"
+        cls = first_char_class(regex)
+        starts = None if starts is None or cls is None else starts + [f"{scope}{cls})"]
+        # verbose patterns may end in a comment, keep it from swallowing the next alternative
+        pattern = regex.pattern + "\n" if regex.flags & re.VERBOSE else regex.pattern
+        parts.append(f"{scope}{pattern})")
+    if not parts:
+        return None
+    alternation = "|".join(parts)
+    if starts:
+        # skip positions none of the rules can start at before trying the alternatives
+        alternation = f"(?={'|'.join(dict.fromkeys(starts))})(?:{alternation})"
+    try:
+        return re.compile(alternation)
+    except re.error:
+        # e.g. two rules using the same group name
+        return None
+
+def candidate_windows(combined, text):
+    """(start, end) of the stretches of text where a match of one of the combined rules can start.
+
+    Searching from the end of a hit of the alternation finds the leftmost position at or after
+    it where any rule matches, so a rule's match can only start inside one of the hits.
+    """
+    return [match.span() for match in combined.finditer(text)]
+
 class RegexNER(NamedEntityRecognizer):
     def __init__(self, rules=None, keywords=None, normalizer=None):
         super().__init__(rules=rules, keywords=keywords, normalizer=normalizer)
         self.regexes = list()
+        self._compiled = None
+        self._compiled_for = None
 
     def load_rules(self, rules):
         self.regexes.extend(rules)
@@ -17,9 +63,32 @@ class RegexNER(NamedEntityRecognizer):
                 label_ = rule[1].strip()
                 self.regexes.append((re.compile(regex_), label_))
 
+    def config(self):
+        config = super().config()
+        config["rules"] = [(regex.pattern, regex.flags, label) for regex, label in self.regexes]
+        return config
+
+    def compiled(self):
+        """The combined prefilter and the guarded rules, rebuilt whenever the rules change."""
+        key = [regex for regex, _ in self.regexes]
+        if key != self._compiled_for:
+            guarded = [(first_char_guard(regex), label) for regex, label in self.regexes]
+            self._compiled = (combine_rules(self.regexes), guarded)
+            self._compiled_for = key
+        return self._compiled
+
     def predict(self, text):
-        for regex, label in self.regexes:
-            for match in regex.finditer(text):
+        combined, guarded = self.compiled()
+        if combined is None:
+            matches = ((regex.finditer(text), label) for regex, label in guarded)
+        else:
+            windows = candidate_windows(combined, text)
+            if not windows:
+                return
+            matches = ((self.matches_within(regex, text, windows), label) for regex, label in guarded)
+        # rule by rule, as each rule running finditer over the whole text
+        for found, label in matches:
+            for match in found:
                 start, end = match.span()
                 ent = NamedEntity(
                     name=match.group(),
@@ -28,6 +97,24 @@ class RegexNER(NamedEntityRecognizer):
                     label=label
                 )
                 yield ent
-                
+
+    def matches_within(self, regex, text, windows):
+        """The matches regex.finditer(text) finds, trying regex only at the positions inside windows.
+
+        As with finditer, the next match is looked for from the end of the one before, which
+        may be past its window.
+        """
+        pos = 0
+        for start, end in windows:
+            i = max(start, pos)
+            while i < end:
+                match = regex.match(text, i)
+                if match is None:
+                    i += 1
+                    continue
+                yield match
+                # combined rules never match the empty string, so this moves on
+                pos = i = match.end()
+
     def __call__(self, text):
         return super().__call__(text)
@@ -0,0 +1,54 @@
+from bisect import bisect_left, bisect_right
+
+class SpanIndex:
+    """Sorted, non overlapping character spans with O(log n) overlap checks.
+
+    Args:
+        spans (iterable): (start, end) pairs to index. Spans overlapping one already
+            indexed are ignored.
+    """
+    def __init__(self, spans=()):
+        self.starts = []
+        self.ends = []
+        for start, end in spans:
+            self.add(start, end)
+
+    def overlaps(self, start, end):
+        """Whether [start, end) shares at least one character with an indexed span."""
+        if end <= start:
+            return False
+        i = bisect_right(self.starts, start)
+        # the span starting at or before `start` and the first one starting after it are the only candidates
+        if i > 0 and self.ends[i - 1] > start:
+            return True
+        return i < len(self.starts) and self.starts[i] < end
+
+    def add(self, start, end):
+        """Index [start, end). Returns False when it overlaps an indexed span and was skipped."""
+        if end <= start:
+            return True
+        if self.overlaps(start, end):
+            return False
+        i = bisect_right(self.starts, start)
+        self.starts.insert(i, start)
+        self.ends.insert(i, end)
+        return True
+
+    def __len__(self):
+        return len(self.starts)
+
+class TokenIndex:
+    """Bisect lookup from character spans to the tokens they contain.
+
+    Args:
+        tokens (list): Tokens sorted by their character offset `idx`.
+    """
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.starts = [token.idx for token in tokens]
+
+    def within(self, start, end):
+        """Tokens lying entirely inside [start, end)."""
+        lo = bisect_left(self.starts, start)
+        hi = bisect_right(self.starts, end)
+        return [token for token in self.tokens[lo:hi] if token.idx + len(token.text) <= end]
@@ -1,18 +1,33 @@
+from functools import partial
 from ner.named_entity_recognizer import NamedEntityRecognizer
 from ner.named_entity import NamedEntity
 from transformers import pipeline
+from utils.models import share_model
 import torch
 
 class TransformersNER(NamedEntityRecognizer):
-    def __init__(self, model=None, keywords=None, normalizer=None):
-        super().__init__(keywords=keywords, normalizer=normalizer)
+    def __init__(self, model=None, keywords=None, normalizer=None, batch_size=16):
+        super().__init__(keywords=keywords, normalizer=normalizer, batch_size=batch_size)
         # device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.model = pipeline("ner",model,aggregation_strategy="max",device="cpu")
+        share_model(self, "ner", model, partial(pipeline, "ner", model, aggregation_strategy="max", device="cpu"))
+        self.model_name = model
     
 
     def predict(self, text):
         ner_prediction =  self.model(text)
         # print(ner_prediction)
+        yield from self.to_entities(ner_prediction)
+
+    def forward(self, texts):
+        # the pipeline pads each batch of texts and runs a single forward pass over it
+        return self.model(list(texts), batch_size=self.batch_size)
+
+    def predict_batch(self, texts):
+        if not texts:
+            return []
+        return [list(self.to_entities(ner_prediction)) for ner_prediction in self.run_model(texts)]
+
+    def to_entities(self, ner_prediction):
         for ent in ner_prediction:
                 named_ent = NamedEntity(
                     name=ent["word"],
@@ -0,0 +1,46 @@
+def stitch_windows(tokenized, predictions, stride=None):
+    """
+    Stitch the token predictions of overlapping windows back into one sequence per text.
+
+    Consecutive windows of a text share `stride` tokens. The shared tokens are split in half,
+    the first half is taken from the earlier window and the second half from the later one,
+    so every token is predicted with some context on both sides and appears exactly once.
+
+    Args:
+        tokenized (BatchEncoding): Output of a fast tokenizer, optionally called with
+            return_overflowing_tokens and return_offsets_mapping.
+        predictions (list): Predicted label ids for every row of `tokenized`.
+        stride (int): Number of tokens shared by consecutive windows. None when not windowed.
+
+    Returns:
+        list: One (rows, label_ids, offsets) tuple per input text, where rows are the indexes
+        of the text's windows in `tokenized` and offsets are character spans in the text.
+    """
+    offsets = tokenized["offset_mapping"].tolist()
+    if "overflow_to_sample_mapping" in tokenized:
+        sample_map = tokenized["overflow_to_sample_mapping"].tolist()
+    else:
+        sample_map = list(range(len(offsets)))
+
+    windows = {}
+    for row, sample in enumerate(sample_map):
+        # sequence id 0 marks the text's own tokens, special tokens and padding are None
+        content = [p for p, seq_id in enumerate(tokenized.sequence_ids(row)) if seq_id == 0]
+        windows.setdefault(sample, []).append((row, [(predictions[row][p], offsets[row][p]) for p in content]))
+
+    head = (stride or 0) // 2
+    tail = (stride or 0) - head
+    stitched = []
+    for sample in range(len(windows)):
+        rows, label_ids, spans = [], [], []
+        sample_windows = windows[sample]
+        last = len(sample_windows) - 1
+        for w, (row, tokens) in enumerate(sample_windows):
+            lo = head if w > 0 else 0
+            hi = len(tokens) - tail if w < last else len(tokens)
+            rows.append(row)
+            for label_id, span in tokens[lo:hi]:
+                label_ids.append(label_id)
+                spans.append(span)
+        stitched.append((rows, label_ids, spans))
+    return stitched
@@ -1,22 +1,24 @@
 from normalization.normalizer import Normalizer
-import pandas as pd
+import csv
+from functools import lru_cache
 from pathlib import Path
 
 data_file_path = Path(__file__).parent / r"utils/gpe.csv"
-df = pd.read_csv(data_file_path,encoding="utf-8")
-import numpy as np
-gov_lookup = {}
-for i, row in df.iterrows():
-    if pd.isna(row["State/Province"]):
-        gov_lookup[row["Country"]] = (row["Location"],row["Priority"])
-    else:
-        gov_lookup[row["State/Province"]] = (row["Location"],row["Priority"])
+
+@lru_cache(maxsize=None)
+def load_gov_lookup(path=data_file_path):
+    """Map of country or state/province to its (location, priority), read from gpe.csv on first use."""
+    gov_lookup = {}
+    with open(path, encoding="utf-8", newline="") as csv_file:
+        for row in csv.DictReader(csv_file):
+            gov_lookup[row["State/Province"] or row["Country"]] = (row["Location"], int(row["Priority"]))
+    return gov_lookup
 
 class GovNorm(Normalizer):
     def __init__(self,lookups:dict=None):
         super().__init__()
         if not lookups:
-            self.lookups = gov_lookup
+            self.lookups = load_gov_lookup()
         else:
             self.lookups = lookups
         
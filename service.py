@@ -0,0 +1,413 @@
+"""
+Asyncio HTTP service that queues contracts for processing so many users can submit at once.
+
+    python service.py --port 8000 --effective-date --currency
+
+    POST /jobs?filename=contract.pdf   body: the document, returns the job id (202)
+    GET  /jobs/<id>                    status of a job
+    GET  /jobs/<id>/result             entities, glossary and sections once the job is done
+    GET  /health                       job counts, inference batching metrics and loaded models
+
+The pipeline is split into runs of consecutive components by how they spend their time.
+File loading waits on OCR subprocesses and runs on threads, the cleaning, tokenizing,
+segmenting and rule based components are CPU bound and run in a process pool, and model
+based components run on one inference thread that batches the documents waiting for it.
+The event loop only parses requests and moves documents between the stages.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import date
+from pathlib import Path
+from urllib.parse import urlsplit, parse_qs
+
+from contract import Contract, ContractPipeline
+from utils.cache import ResultCache
+from utils.inference import scheduler_metrics
+from utils.models import MODELS
+
+LOAD, CPU, INFERENCE = "load", "cpu", "inference"
+# job status while each kind of stage runs
+STAGE_STATUS = {LOAD: "loading", CPU: "processing", INFERENCE: "inference"}
+FINISHED = ("done", "failed")
+MAX_HEADER_LINES = 100
+REASONS = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 422: "Unprocessable Entity", 500: "Internal Server Error",
+           503: "Service Unavailable"}
+
+def stage_of(component):
+    """Which executor a pipeline component runs on."""
+    if getattr(component, "thread_safe", False):
+        return LOAD
+    # looked up in the instance, reading component.model would load it
+    state = getattr(component, "__dict__", {})
+    if getattr(component, "model_name", None) is not None or state.get("model_loader") is not None \
+            or state.get("_model", state.get("model")) is not None:
+        return INFERENCE
+    return CPU
+
+def plan(pipeline):
+    """Split the pipeline items into runs of consecutive items on the same kind of stage, as (stage, items)."""
+    runs = []
+    for item in pipeline:
+        stage = stage_of(item["component"])
+        if runs and runs[-1][0] == stage:
+            runs[-1][1].append(item)
+        else:
+            runs.append((stage, [item]))
+    return runs
+
+def _json_default(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+def summarize(contract, attributes=()):
+    """The parts of a processed contract returned by the service, as plain JSON types."""
+    return {
+        "attributes": {attribute: getattr(contract, attribute, None) for attribute in attributes},
+        "entities": [{"name": ent.name, "label": ent.label, "normalized": ent.normalized,
+                      "start": ent.start, "end": ent.end} for ent in (contract.ents or ())],
+        "glossary": [{"term": definition.term, "definition": definition.definition,
+                      "start": definition.start, "end": definition.end} for definition in (contract.glossary or ())],
+        "sections": [{"section": segment.section, "subsection": segment.subsection, "title": segment.title,
+                      "start": segment.start, "end": segment.end} for segment in (contract.segments or ())],
+    }
+
+class Job:
+    def __init__(self, name, path):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.path = path
+        self.status = "queued"
+        self.error = None
+        self.result = None
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def info(self):
+        return {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "error": self.error,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+_worker_pipeline = None
+
+def _init_worker(pipeline):
+    global _worker_pipeline
+    _worker_pipeline = pipeline
+
+def _run_items(contract, start, end):
+    # runs in a pool process, on the CPU bound items of the pipeline it was started with
+    _worker_pipeline._apply(_worker_pipeline.pipeline[start:end], [contract])
+    return contract
+
+class IngestionService:
+    """Accepts documents over HTTP and runs them through a ContractPipeline in the background.
+
+    Args:
+        pipeline (ContractPipeline): The pipeline documents are processed with. Its result cache,
+            if any, is checked before a document is queued.
+        processes (int): Size of the process pool for the CPU bound components, the number of
+            CPUs by default. 0 runs them on the loading threads instead.
+        threads (int): Number of documents loaded and OCR'd at the same time.
+        batch_size (int): Most documents handed to the model based components at once.
+        max_active (int): Most documents in the pipeline at once, the others wait queued.
+        max_queued (int): Submissions are refused with 503 while this many jobs are waiting.
+        max_jobs (int): Finished jobs kept for polling, the oldest are forgotten first.
+        max_upload_bytes (int): Largest document accepted.
+        upload_dir (str): Where uploads are kept while their job runs.
+    """
+    def __init__(self, pipeline, processes=None, threads=8, batch_size=8, max_active=None, max_queued=1000,
+                 max_jobs=10000, max_upload_bytes=100 * 2**20, upload_dir=os.path.join("tmp", "uploads")):
+        self.pipeline = pipeline
+        self.processes = os.cpu_count() if processes is None else processes
+        self.threads = threads
+        self.batch_size = batch_size
+        self.max_active = max_active or 2 * max(threads, self.processes, 1)
+        self.max_queued = max_queued
+        self.max_jobs = max_jobs
+        self.max_upload_bytes = max_upload_bytes
+        self.upload_dir = upload_dir
+        # attributes set by the classifiers, returned with the results
+        self.attributes = [item["component"].attribute for item in pipeline.pipeline
+                           if getattr(item["component"], "attribute", None)]
+        self.runs = plan(pipeline.pipeline)
+        # the pool processes only get the CPU bound items, each CPU run is a slice of them
+        self.cpu_pipeline = ContractPipeline(defaults=False)
+        self.cpu_slices = {}
+        for i, (stage, items) in enumerate(self.runs):
+            if stage == CPU:
+                start = len(self.cpu_pipeline.pipeline)
+                self.cpu_pipeline.pipeline.extend(items)
+                self.cpu_slices[i] = (start, len(self.cpu_pipeline.pipeline))
+        self.jobs = OrderedDict()
+        self.server = None
+        self._tasks = set()
+
+    async def start(self, host="127.0.0.1", port=8000):
+        self.loader = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix="load")
+        self.inference = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+        self.pool = None
+        if self.processes and self.cpu_slices:
+            # forking while the loading threads hold locks (e.g. logging's) deadlocks the workers, spawn them instead
+            self.pool = ProcessPoolExecutor(max_workers=self.processes, mp_context=multiprocessing.get_context("spawn"),
+                                            initializer=_init_worker, initargs=(self.cpu_pipeline,))
+        self.slots = asyncio.Semaphore(self.max_active)
+        self.inference_queue = asyncio.Queue()
+        self.inference_worker = asyncio.create_task(self._batch_inference())
+        self.server = await asyncio.start_server(self._handle, host, port)
+        logging.info(f"Serving on {', '.join(str(sock.getsockname()) for sock in self.server.sockets)}")
+        return self.server
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        for task in list(self._tasks) + [self.inference_worker]:
+            task.cancel()
+        await asyncio.gather(*self._tasks, self.inference_worker, return_exceptions=True)
+        self.loader.shutdown(wait=False, cancel_futures=True)
+        self.inference.shutdown(wait=False, cancel_futures=True)
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pipeline.close()
+
+    def counts(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job.status] = counts.get(job.status, 0) + 1
+        return counts
+
+    async def submit(self, name, data):
+        """Save a document and queue it, returning its Job."""
+        job = Job(name, None)
+        job.path = os.path.join(self.upload_dir, job.id, name)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.loader, _write_file, job.path, data)
+        self.jobs[job.id] = job
+        self._forget_old_jobs()
+        task = asyncio.create_task(self._process(job))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return job
+
+    def _forget_old_jobs(self):
+        excess = len(self.jobs) - self.max_jobs
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.status in FINISHED][:max(excess, 0)]:
+            del self.jobs[job_id]
+
+    async def _process(self, job):
+        loop = asyncio.get_running_loop()
+        try:
+            async with self.slots:
+                job.started = time.time()
+                job.status = STAGE_STATUS[LOAD]
+                key, contract = await loop.run_in_executor(self.loader, self.pipeline._load_cached, job.path)
+                if contract is None:
+                    contract = await self._run_stages(job, Contract(job.path))
+                    await loop.run_in_executor(self.loader, self.pipeline._store_cached, key, contract)
+            if contract.error is not None:
+                job.error = contract.error
+                job.status = "failed"
+            else:
+                job.result = json.loads(json.dumps(summarize(contract, self.attributes), default=_json_default))
+                job.status = "done"
+        except asyncio.CancelledError:
+            job.error = "service stopped"
+            job.status = "failed"
+            raise
+        except Exception:
+            logging.error(f"Job {job.id} ({job.name}) failed")
+            job.error = traceback.format_exc()
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+            shutil.rmtree(os.path.dirname(job.path), ignore_errors=True)
+
+    async def _run_stages(self, job, contract):
+        loop = asyncio.get_running_loop()
+        for i, (stage, items) in enumerate(self.runs):
+            if contract.error is not None:
+                break
+            job.status = STAGE_STATUS[stage]
+            if stage == INFERENCE:
+                future = loop.create_future()
+                await self.inference_queue.put((i, contract, future))
+                contract = await future
+            elif stage == CPU and self.pool is not None:
+                start, end = self.cpu_slices[i]
+                contract = await loop.run_in_executor(self.pool, _run_items, contract, start, end)
+            else:
+                contract = (await loop.run_in_executor(self.loader, self.pipeline._apply, items, [contract]))[0]
+        return contract
+
+    async def _batch_inference(self):
+        """Run the model based components over whatever documents are waiting for them, in batches."""
+        loop = asyncio.get_running_loop()
+        while True:
+            waiting = [await self.inference_queue.get()]
+            while len(waiting) < self.batch_size and not self.inference_queue.empty():
+                waiting.append(self.inference_queue.get_nowait())
+            # documents waiting on different runs of the pipeline are batched separately
+            by_run = OrderedDict()
+            for i, contract, future in waiting:
+                by_run.setdefault(i, []).append((contract, future))
+            for i, entries in by_run.items():
+                contracts = [contract for contract, _ in entries]
+                try:
+                    await loop.run_in_executor(self.inference, self.pipeline._apply, self.runs[i][1], contracts)
+                except Exception as err:
+                    for contract in contracts:
+                        contract.error = repr(err)
+                for (_, future), contract in zip(entries, contracts):
+                    if not future.done():
+                        future.set_result(contract)
+
+    async def _handle(self, reader, writer):
+        try:
+            status, body = await self._respond(reader)
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+            return
+        except Exception:
+            logging.error(f"Request failed: {traceback.format_exc()}")
+            status, body = 500, {"error": "internal error"}
+        payload = json.dumps(body, default=_json_default).encode("utf-8")
+        writer.write(f"HTTP/1.1 {status} {REASONS.get(status, '')}\r\n"
+                     f"Content-Type: application/json\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode("latin-1") + payload)
+        try:
+            await writer.drain()
+        finally:
+            writer.close()
+
+    async def _respond(self, reader):
+        request_line = (await reader.readline()).decode("latin-1").split()
+        if len(request_line) != 3:
+            return 400, {"error": "malformed request line"}
+        method, target, _ = request_line
+        headers = {}
+        for _ in range(MAX_HEADER_LINES):
+            line = (await reader.readline()).decode("latin-1")
+            if line in ("\r\n", "\n", ""):
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        else:
+            return 400, {"error": "too many headers"}
+        url = urlsplit(target)
+        parts = [part for part in url.path.split("/") if part]
+
+        if parts == ["health"] and method == "GET":
+            return 200, {"jobs": self.counts(), "inference": scheduler_metrics(), "models": MODELS.loaded()}
+        if parts == ["jobs"]:
+            if method != "POST":
+                return 405, {"error": "use POST to submit a document"}
+            length = headers.get("content-length", "")
+            if not length.isdecimal():
+                return 400, {"error": "pass the size of the document as a Content-Length header"}
+            length = int(length)
+            if length > self.max_upload_bytes:
+                return 413, {"error": f"documents are limited to {self.max_upload_bytes} bytes"}
+            name = Path(parse_qs(url.query).get("filename", [headers.get("x-filename", "")])[0]).name
+            if "." not in name:
+                return 400, {"error": "pass the document's file name, with its extension, as ?filename="}
+            if self.counts().get("queued", 0) >= self.max_queued:
+                return 503, {"error": "too many documents queued, retry later"}
+            data = await reader.readexactly(length)
+            job = await self.submit(name, data)
+            return 202, dict(job.info(), status_url=f"/jobs/{job.id}", result_url=f"/jobs/{job.id}/result")
+        if len(parts) in (2, 3) and parts[0] == "jobs" and method == "GET":
+            job = self.jobs.get(parts[1])
+            if job is None:
+                return 404, {"error": "unknown job"}
+            if len(parts) == 2:
+                return 200, job.info()
+            if parts[2] != "result":
+                return 404, {"error": "not found"}
+            if job.status == "done":
+                return 200, dict(job.info(), result=job.result)
+            if job.status == "failed":
+                return 422, job.info()
+            return 202, job.info()
+        return 404, {"error": "not found"}
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+def build_pipeline(args):
+    """The default pipeline with the components picked on the command line, as in app.py."""
+    pipeline = ContractPipeline(defaults=True, cache=ResultCache(args.cache) if args.cache else None)
+    if args.governing_law:
+        from ner.clf_ner import CLF_NER
+        from normalization.gov_normalizer import GovNorm
+        pipeline.add_pipe(name="governing_law", component=CLF_NER(keywords=["law", "jurisdicition", "governing"],
+                                                                 model="sguarnaccio/gov_law_clf_ner", normalizer=GovNorm()))
+    if args.effective_date:
+        from ner.regex_ner import RegexNER
+        from ner.rules import EFFECTIVE_DATE_RULES
+        from normalization.date_normalizer import DateNorm
+        eff_date_ner = RegexNER(normalizer=DateNorm())
+        eff_date_ner.load_raw_rules(EFFECTIVE_DATE_RULES)
+        pipeline.add_pipe(name="effective_date", component=eff_date_ner)
+    if args.currency:
+        from ner.regex_ner import RegexNER
+        from ner.rules import CURRENCY_RULES
+        currency_ner = RegexNER()
+        currency_ner.load_raw_rules(CURRENCY_RULES)
+        pipeline.add_pipe(name="currency", component=currency_ner)
+    if args.legal_entities:
+        from ner.transformer_ner import TransformersNER
+        from normalization.entity_normalizer import EntityNormalizer
+        pipeline.add_pipe(name="legal_entities", component=TransformersNER(keywords=["signature"], model="sguarnaccio/le_signatory",
+                                                                           normalizer=EntityNormalizer()))
+    return pipeline
+
+async def serve(args):
+    service = IngestionService(build_pipeline(args), processes=args.processes, threads=args.threads,
+                               batch_size=args.batch_size, max_queued=args.max_queued)
+    server = await service.start(args.host, args.port)
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await service.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--processes", type=int, default=None, help="processes for the CPU bound components, the number of CPUs by default")
+    parser.add_argument("--threads", type=int, default=8, help="documents loaded and OCR'd at the same time")
+    parser.add_argument("--batch-size", type=int, default=8, help="most documents per model batch")
+    parser.add_argument("--max-queued", type=int, default=1000, help="refuse submissions while this many jobs wait")
+    parser.add_argument("--cache", default=os.path.join("tmp", "cache"), help="result cache directory, empty to disable")
+    parser.add_argument("--effective-date", action="store_true")
+    parser.add_argument("--currency", action="store_true")
+    parser.add_argument("--governing-law", action="store_true")
+    parser.add_argument("--legal-entities", action="store_true")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    try:
+        asyncio.run(serve(args))
+    except KeyboardInterrupt:
+        pass
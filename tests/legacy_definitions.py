@@ -0,0 +1,41 @@
+"""
+The definition extractor as it was before the triggers were combined into one alternation,
+kept frozen as the reference for test_definitions.py and benchmarks.py.
+"""
+import re
+
+from definitions.definitions import Definition, DefinitionPatterns
+
+def legacy_extract(text, terms, glossary):
+    """DefinitionFinder.extract before the rewrite: every trigger searched for in turn after each term."""
+    for ptn in DefinitionPatterns.patterns:
+        for match in re.finditer(ptn[0], text):
+            term, start, end = match.group('term'), match.start('term'), match.end('term')
+            term = re.sub(r'[^0-9a-zA-Z\s]+', '', term)
+            term_lower = term.lower()
+            if term_lower not in terms:
+                try:
+                    split_sent = text.split(term, 1)
+                except ValueError:
+                    break
+                if len(split_sent) > 1:
+                    for trigger in DefinitionPatterns.triggers:
+                        if split_sent[1].find(trigger) != -1:
+                            definition = split_sent[1].split(trigger, 1)[1].strip()
+                            terms.add(term_lower)
+                            glossary.append(Definition(term, definition, text, start, end))
+                            break
+                        if term_lower not in terms and split_sent[1][1] == ":":
+                            definition = split_sent[1].split(":", 1)[1].strip()
+                            terms.add(term_lower)
+                            glossary.append(Definition(term, definition, text, start, end))
+                            break
+                        if term_lower not in terms and term.isupper():
+                            term_len = len(term)
+                            split_sent = text.split(term, 1)
+                            candidates = [split_sent[0].split()[i:i + term_len] for i in range(0, len(split_sent[0]), term_len)]
+                            for candidate in candidates:
+                                if ''.join(word[0] for word in candidate) == term:
+                                    terms.add(term_lower)
+                                    glossary.append(Definition(term, ' '.join(candidate), text, start, end))
+                                    break
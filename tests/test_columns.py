@@ -0,0 +1,19 @@
+from utils.columns import Tokens
+
+TEXT = "The Buyer shall pay"
+
+def tokens(bboxes=None):
+    return Tokens(TEXT, [0, 3, 4, 9, 10, 15, 16], [3, 4, 9, 10, 15, 16, 19],
+                  [False, True, False, True, False, True, False], bboxes)
+
+def test_index():
+    assert tokens()[2].text == "Buyer"
+    assert tokens()[-1].text == "pay"
+
+def test_slice():
+    sliced = tokens(bboxes=list(range(7)))[2:5]
+    assert isinstance(sliced, Tokens)
+    assert [token.text for token in sliced] == ["Buyer", " ", "shall"]
+    assert [token.is_space for token in sliced] == [False, True, False]
+    assert [token._.bbox for token in sliced] == [2, 3, 4]
+    assert [token.text for token in tokens()[::-2]] == ["pay", "shall", "Buyer", "The"]
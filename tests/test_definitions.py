@@ -0,0 +1,76 @@
+import glob
+from pathlib import Path
+
+import pytest
+
+import definitions.definitions as definitions
+from contract import ContractPipeline
+from definitions.definitions import NOT_TERM, DefinitionFinder, Glossary, normalize_sentence
+from legacy_definitions import legacy_extract
+
+CORPUS = str(Path(__file__).parent / "*.txt")
+
+@pytest.fixture(scope="module")
+def contracts():
+    pipeline = ContractPipeline(defaults=True)
+    pipeline.pipeline = [item for item in pipeline.pipeline if item["name"] != "definition_finder"]
+    return list(pipeline.stream(sorted(glob.glob(CORPUS))))
+
+def glossary(extract, contract):
+    found, terms = Glossary(), set()
+    for sentence in contract.sentences:
+        extract(normalize_sentence(sentence.text), terms, found)
+    return [(d.term, d.definition, d.phrase, d.start, d.end) for d in found]
+
+def test_extract_matches_legacy_extractor(contracts):
+    finder = DefinitionFinder()
+    for contract in contracts:
+        assert glossary(finder.extract, contract) == glossary(legacy_extract, contract), contract.file_path
+
+def test_glossary_by_segment_matches_sentence_order(contracts):
+    finder = DefinitionFinder()
+    for contract in contracts:
+        expected = [entry[:3] for entry in glossary(finder.extract, contract)]
+        assert [(d.term, d.definition, d.phrase) for d in finder(contract).glossary] == expected, contract.file_path
+
+def test_offsets_point_at_terms(contracts):
+    finder = DefinitionFinder()
+    for contract in contracts:
+        for definition in finder(contract).glossary:
+            text = contract.text[definition.start:definition.end]
+            assert "".join(NOT_TERM.sub("", text).split()) == "".join(definition.term.split())
+
+def test_glossary_on_workers_matches_serial_search(contracts):
+    sample = contracts[:10]
+    serial = [[(d.term, d.definition, d.start, d.end) for d in DefinitionFinder()(contract).glossary] for contract in sample]
+    finder = DefinitionFinder(n_workers=2)
+    pipeline = ContractPipeline(defaults=False)
+    pipeline.add_pipe(finder, name="definition_finder")
+    with pipeline:
+        pooled = [[(d.term, d.definition, d.start, d.end) for d in finder(contract).glossary] for contract in sample]
+        assert finder.executor is not None
+    assert finder.executor is None, "closing the pipeline left the worker processes running"
+    assert pooled == serial
+
+def test_definition_headings_searched_first(contracts, monkeypatch):
+    finder = DefinitionFinder()
+    searched = []
+
+    def record(finder, sentences):
+        searched.append(sentences)
+        return find_definitions(finder, sentences)
+
+    find_definitions = definitions.find_definitions
+    monkeypatch.setattr(definitions, "find_definitions", record)
+    checked = 0
+    for contract in contracts:
+        texts = [normalize_sentence(text) for text in contract.sentences.text]
+        groups, headings = finder.segment_groups(contract, texts, contract.sentences.starts.tolist())
+        first = [groups[i] for i in sorted(headings) if groups[i]]
+        if not first or first[0] is groups[0]:
+            continue
+        searched.clear()
+        finder(contract)
+        assert searched[:len(first)] == first, contract.file_path
+        checked += 1
+    assert checked, "no sample contract has a definitions heading after its first segment"
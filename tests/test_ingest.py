@@ -0,0 +1,48 @@
+import glob
+import os
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+from contract import ContractPipeline
+from utils.ocr import FileProcessor
+
+DOCUMENTS = [str(Path(__file__).parent / f"*.{ext}") for ext in ("txt", "pdf", "jpg")]
+
+@pytest.fixture(scope="module")
+def paths():
+    return sorted(path for pattern in DOCUMENTS for path in glob.glob(pattern))
+
+def load(paths, n_threads):
+    pipeline = ContractPipeline(defaults=False)
+    pipeline.add_pipe(FileProcessor(), name="file_loader")
+    return [(contract.raw, contract.bbox_info, contract.error is None)
+            for contract in pipeline.pipe(paths, batch_size=len(paths), n_threads=n_threads)]
+
+def test_threaded_load_matches_serial_load(paths):
+    assert load(paths, 8) == load(paths, 1)
+
+def test_threaded_load_keeps_working_directory(paths, tmp_path, monkeypatch):
+    # loading must not depend on, or change, where the process runs from
+    monkeypatch.chdir(tmp_path)
+    expected = load(paths, 1)
+    seen = set()
+    done = threading.Event()
+
+    def watch_cwd():
+        while not done.is_set():
+            seen.add(os.getcwd())
+            time.sleep(0.001)
+
+    watcher = threading.Thread(target=watch_cwd)
+    watcher.start()
+    try:
+        result = load(paths, 8)
+    finally:
+        done.set()
+        watcher.join()
+    assert seen == {str(tmp_path)}
+    assert result == expected
+    assert not list(tmp_path.iterdir()), "loading wrote files into the working directory"
@@ -0,0 +1,48 @@
+import glob
+import re
+from pathlib import Path
+
+import pytest
+
+from ner.regex_ner import RegexNER
+from ner.rules import CURRENCY_RULES, EFFECTIVE_DATE_RULES
+
+CORPUS = str(Path(__file__).parent / "*.txt")
+
+def per_rule(ner, text):
+    """What RegexNER found before the rules were combined: each rule's finditer in turn."""
+    return [(match.span(), label) for regex, label in ner.regexes for match in regex.finditer(text)]
+
+def predicted(ner, text):
+    return [((ent.start, ent.end), ent.label) for ent in ner.predict(text)]
+
+@pytest.fixture(scope="module")
+def paragraphs():
+    texts = []
+    for path in sorted(glob.glob(CORPUS)):
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            texts.extend(f.read().split("\n\n"))
+    return texts
+
+def test_combined_rules_match_per_rule_loop(paragraphs):
+    ner = RegexNER()
+    ner.load_raw_rules(EFFECTIVE_DATE_RULES + CURRENCY_RULES)
+    assert ner.compiled()[0] is not None
+    for text in paragraphs:
+        assert predicted(ner, text) == per_rule(ner, text)
+
+def test_rules_starting_inside_another_rules_match():
+    # the alternation's hit on "dated 1 May 2020" hides where the other rules start
+    ner = RegexNER()
+    ner.load_rules([(re.compile(r"dated \d+ \w+ \d{4}"), "DATED"),
+                    (re.compile(r"\d+ \w+"), "DAY"),
+                    (re.compile(r"May \d{4}(?: and \w+)?"), "MONTH")])
+    text = "This agreement dated 1 May 2020 and amended 3 June 2021, dated 2 May 2022."
+    assert predicted(ner, text) == per_rule(ner, text)
+    assert ((23, 43), "MONTH") in predicted(ner, text)
+
+def test_rules_that_match_empty_strings_are_not_combined():
+    ner = RegexNER()
+    ner.load_rules([(re.compile(r"\d*"), "NUMBER"), (re.compile(r"May"), "MONTH")])
+    assert ner.compiled()[0] is None
+    assert predicted(ner, "1 May") == per_rule(ner, "1 May")
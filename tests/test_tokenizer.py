@@ -0,0 +1,47 @@
+import utils.ocr as ocr
+from contract import Contract
+from tokenization.tokenizer import Tokenizer
+from utils.clean_text import TextCleaner
+
+TEXT_LAYER_PAGE = "The parties agree that payment shall be made within thirty days of the invoice date."
+SCANNED_WORDS = ("Payment shall be made within thirty days of the invoice date and the "
+                 "Supplier shall deliver the goods on time").split()
+
+def scanned_page(page_num):
+    words = {column: [] for column in ocr.WORD_COLUMNS}
+    for i, word in enumerate(SCANNED_WORDS):
+        words["text"].append(word)
+        words["left"].append(100 + 50 * (i % 10))
+        words["top"].append(100 + 40 * (i // 10))
+        words["width"].append(45)
+        words["height"].append(30)
+        words["conf"].append(95)
+    return {"page": page_num, "text": " ".join(SCANNED_WORDS), "words": words}
+
+def process(pages, monkeypatch):
+    monkeypatch.setattr(ocr, "extract_pdf", lambda *args, **kwargs: pages)
+    text, bbox, _ = ocr.convert_to_text("mixed.pdf", "pdf", config={"convert_as_image": True})
+    contract = Contract(text=text)
+    contract.bbox_info = bbox
+    contract = TextCleaner()(contract, lower=False, remove_num=False)
+    return Tokenizer()(contract)
+
+def test_text_layer_and_scanned_pages(monkeypatch):
+    empty = {column: [] for column in ocr.WORD_COLUMNS}
+    contract = process([{"page": 1, "text": TEXT_LAYER_PAGE, "words": empty}, scanned_page(2)], monkeypatch)
+    words = [token for token in contract.tokens if not token.is_space]
+    split = contract.text.index(SCANNED_WORDS[0])
+    layer = [token for token in words if token.idx < split]
+    scanned = [token for token in words if token.idx >= split]
+    assert all(token._.bbox is None for token in layer)
+    assert [token.text for token in scanned] == SCANNED_WORDS
+    points = ocr.to_points(scanned_page(2)["words"])
+    assert [token._.bbox for token in scanned] == [
+        {"page": 2, "left": points["left"][i], "top": points["top"][i], "width": points["width"][i], "height": points["height"][i]}
+        for i in range(len(SCANNED_WORDS))]
+
+def test_scanned_pages_only(monkeypatch):
+    contract = process([scanned_page(1), scanned_page(2)], monkeypatch)
+    boxes = [token._.bbox for token in contract.tokens if not token.is_space]
+    assert len(boxes) == 2 * len(SCANNED_WORDS)
+    assert [box["page"] for box in boxes] == [1] * len(SCANNED_WORDS) + [2] * len(SCANNED_WORDS)
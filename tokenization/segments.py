@@ -1,7 +1,10 @@
 import re
+from difflib import SequenceMatcher
 from typing import Generator
 from utils.clean_text import TextCleaner
 from utils.street_endings import street_endings
+from utils.columns import SpanColumns
+from utils.regex_prefix import first_char_class
 
 clean_text = TextCleaner()
 class DocumentSegment:
@@ -13,7 +16,9 @@ class DocumentSegment:
                  title_end: int = 0,
                  text: str = '',
                  section: str = '',
-                 subsection:str=''):
+                 subsection:str='',
+                 document: str = None,
+                 text_start: int = None):
         self.start = start
         self.end = end
         self.section = section
@@ -21,7 +26,24 @@ class DocumentSegment:
         self.title_start = title_start
         self.title_end = title_end
         self.subsection = subsection
-        self.text = text
+        # given a document, the text is document[text_start:end], sliced when it is asked for
+        self.document = document
+        self.text_start = text_start
+        self._text = text
+        # classifier predictions for this segment keyed by the contract attribute they set,
+        # reused when an amended version of the contract is processed
+        self.predictions = {}
+
+    @property
+    def text(self):
+        if self.document is None:
+            return self._text
+        return self.document[self.text_start:self.end]
+
+    @text.setter
+    def text(self, text):
+        self.document = None
+        self._text = text
 
     def __str__(self):
         return f'{self.title} [{self.start}: {self.end}]'
@@ -34,81 +56,174 @@ class DocumentSegment:
                and self.title == other.title and self.title_start == other.title_start \
                and self.title_end == other.title_end and self.text == other.text
 
+# The first pattern accepting a line gives the section its title and number, so the patterns
+# with title and section groups come before the generic ones matching the same headings.
 TITLE_PATTERNS = [
+    re.compile(r'^([SECTIONsection]{7})?\s*(?P<section>[IVX\d]+(?:\.[IVX\d]+)*(?:(?=\s|$)|\.))\s*(?P<title>[A-Z][^\r\n]*?)(?=$|[^\w\s\-])(?:\.|\s|$)(?!(?:(?:\d{1,5}\s+[A-Za-z.,]+(?:\s+[A-Za-z.,]+)*)|(?:[A-Za-z.,]+\s*\d{1,5}(?:[A-Za-z.,]+\s*\d{1,5})*)))(?!%)'),
+    re.compile(r'^(ARTICLE|[Aa]rticle)\s*(?P<section>[IVX\d]+(?:\.[IVX\d]+)*):?\s*(?P<title>.*)$'),
     re.compile(r'\b(?:section|part|chapter|article)\s*[IVX]+(?:\s*[-–]\s*[IVX]+)?\b', re.IGNORECASE),
     re.compile(r'\b(?:sub\s*[-–]?\s*section|subsection)\s*[A-Za-z0-9]+\b', re.IGNORECASE),
     re.compile(r'\b(?:[IVX]+\.\s*)+[A-Za-z0-9]+\b'),
-    re.compile(r'^([SECTIONsection]{7})?\s*(?P<section>[IVX\d]+(?:\.[IVX\d]+)*(?:(?=\s|$)|\.))\s*(?P<title>[A-Z][^\r\n]*?)(?=$|[^\w\s\-])(?:\.|\s|$)(?!(?:(?:\d{1,5}\s+[A-Za-z.,]+(?:\s+[A-Za-z.,]+)*)|(?:[A-Za-z.,]+\s*\d{1,5}(?:[A-Za-z.,]+\s*\d{1,5})*)))(?!%)'),
-    re.compile(r'^(ARTICLE|[Aa]rticle)\s*(?P<section>[IVX\d]+(?:\.[IVX\d]+)*):?\s*(?P<title>.*)$'),
     re.compile(r'(IN\s+WITNESS\s+)',re.IGNORECASE),
     re.compile(r'(SIGNATURES)'),
     re.compile(r'By its signature'),
     re.compile(r'^(Signed\s+by\s+the\s+Parties:?)'),
+    re.compile(r'\bTABLE OF CONTENTS\b.*?(?=\b[A-Z]+\s+\d+\b|$)', re.DOTALL),
+    re.compile(r"^(?P<title>(?:[A-Z][a-z\d]*(?:[\s\-;]+|$))+)$"),
     re.compile(r'^(?P<title>(Schedule|Appendix|Addendum|Annex|Exhibit|Annexure)\s.*)$'),
     re.compile(r'^(?:Dear\s(.+?)|(Ladies\sand\sGentlemen:))'),
     re.compile(r'\n^(Best\sregards|Sincerely|Yours\ssincerely|Kind\sregards|Very\struly\syours)'),
-    re.compile(r'\bTABLE OF CONTENTS\b.*?(?=\b[A-Z]+\s+\d+\b|$)', re.DOTALL),
-    re.compile(r"^(?P<title>(?:[A-Z][a-z\d]*(?:[\s\-;]+|$))+)$"),
     re.compile(r"The\s+parties\s+hereto")
     # re.compile(r'(?P<title>IN WITNESS WHEREOF,.*?Dated.*?[0-9]{1,2} [A-Za-z]+ [0-9]{4})'),
     # re.compile(r'^(?:\d+\.|[a-zA-Z]\.)\s*(?P<title>[^\r\n]+)$'),
     # re.compile(r'^\s{4,}(?P<title>[^\r\n]+)$')
 ]
 
+# titles mentioning a street are address lines rather than headings
+STREET_ENDINGS = re.compile("|".join(re.escape(ending) for ending in sorted(set(street_endings), key=len, reverse=True)))
+SIGNATURE_WORDS = ["witness", "signature", "signed by", "hereto"]
+
+class LineClassifier:
+    """Find the first title pattern accepting a line, trying only the patterns that can match its first character.
+
+    Args:
+        patterns (list): Compiled title patterns, in order of precedence.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.heads = []
+        for pattern in self.patterns:
+            head = first_char_class(pattern)
+            self.heads.append(re.compile(head, pattern.flags) if head else None)
+        self._candidates = {}
+
+    def candidates(self, line):
+        first = line[:1]
+        candidates = self._candidates.get(first)
+        if candidates is None:
+            candidates = self._candidates[first] = [pattern for pattern, head in zip(self.patterns, self.heads)
+                                                    if head is None or head.match(first)]
+        return candidates
+
+    def classify(self, line):
+        """Return the (pattern, match) of the first pattern accepting the stripped line, or None."""
+        for pattern in self.candidates(line):
+            match = pattern.match(line)
+            if not match:
+                continue
+            title = match.group()
+            words = title.split()
+            # a long run of lower case words is a sentence rather than a heading
+            if len(words) > 7 and sum(1 for word in words if word.islower()) > 4:
+                return None
+            last = title.strip()[-1:]
+            if not STREET_ENDINGS.search(title) and not (last.isdigit() or last == "%"):
+                return pattern, match
+        return None
+
 class DocumentSegments:
+    """The segments of a contract, their offsets also kept as SpanColumns for lookups by offset."""
     def __init__(self):
         self.segments = []
+        self._columns = None
     @property
     def text(self):
         return [segment.text for segment in self.segments]
     def __iter__(self):
         return iter(self.segments)
+    def __len__(self):
+        return len(self.segments)
     def append(self, segment):
         self.segments.append(segment)
+        self._columns = None
+
+    @property
+    def columns(self):
+        """SpanColumns of the segments' start and end offsets, built on first use."""
+        if self._columns is None:
+            document = self.segments[0].document if self.segments else None
+            self._columns = SpanColumns(document, [segment.start for segment in self.segments],
+                                        [segment.end for segment in self.segments])
+        return self._columns
+
+    def index_at(self, offsets):
+        """Index of the segment each offset falls in, 0 for offsets before the first segment."""
+        return self.columns.index_at(offsets).clip(min=0)
         
+class SegmentDiff:
+    """Match the segments of a revised contract against those of its previous version.
+
+    Segments are compared by title and text, and matched in document order so repeated
+    boilerplate segments pair up with their own counterparts.
+
+    Args:
+        previous (DocumentSegments): Segments of the previous version.
+        current (DocumentSegments): Segments of the revised version.
+    """
+    def __init__(self, previous, current):
+        old = list(previous)
+        new = list(current)
+        matcher = SequenceMatcher(None, [(s.title, s.text) for s in old], [(s.title, s.text) for s in new], autojunk=False)
+        self._previous = {}
+        self._current = {}
+        for block in matcher.get_matching_blocks():
+            for k in range(block.size):
+                self._previous[id(new[block.b + k])] = old[block.a + k]
+                self._current[id(old[block.a + k])] = new[block.b + k]
+        self.changed = [segment for segment in new if id(segment) not in self._previous]
+        # set by the first named entity recognizer that copies over the previous entities
+        self.entities_carried = False
+
+    def previous(self, segment):
+        """The unchanged segment of the previous version matching `segment`, or None if it changed."""
+        return self._previous.get(id(segment))
+
+    def current(self, segment):
+        """The segment of the revised version an unchanged previous `segment` moved to, or None if it changed."""
+        return self._current.get(id(segment))
+
 class SectionSegmenter(object):
+    requires = ("text",)
+
     def __init__(self,rules=TITLE_PATTERNS):
         self.regexes = rules
+        self.classifier = LineClassifier(rules)
+
+    def config(self):
+        return [(pattern.pattern, pattern.flags) for pattern in self.regexes]
         
     def identify_sections(self,text):
         sections = []
         current_section = {"start": 0, "end": 0, "title_start": 0, "title_end": 0, "section": None, "sub_section": None}
-        in_table_of_contents = False
-        lines = text.split('\n')
         text_index = 0
 
-        for line in lines:
-            for pattern in TITLE_PATTERNS:
-                match = pattern.match(line.strip())
-                if match:
-                    # checks to see if length of title is too long
-                    if len(match.group().split()) > 7:
-                        if sum(1 for word in match.group().split() if word.islower()) > 4:
-                            break
-                    if not any(ending in match.group() for ending in street_endings)\
-                        and not (match.group().strip()[-1].isdigit() or match.group().strip()[-1]=="%"):
-                        current_section["end"] = text_index
-                        sections.append(current_section.copy())
-                        current_section["start"] = text_index
-                        if 'title' in pattern.groupindex and match.group("title"):
-                            current_section["title"] = match.group("title").strip()
-                            current_section["title_start"] = text_index + match.start("title")
-                            current_section["title_end"] = text_index + match.end("title")
-                        else:
-                            if any(word.lower() in match.group().lower() for word in ["witness","signature","signed by","hereto"]):
-                                current_section["title"] = "SIGNATURE BLOCK"
-                            else:
-                                current_section["title"] = ""
-                            current_section["title_start"] = text_index
-                            current_section["title_end"] = text_index
-                        if 'section' in pattern.groupindex and match.group("section"):
-                            section_str = match.group("section")
-                            section_split = section_str.split(".", 1)
-                            current_section["section"] = section_split[0].rstrip(".")
-                            current_section["subsection"] = section_split[1].rstrip(".") if len(section_split) > 1 else None
-                        else:
-                            current_section["section"] = None
-                            current_section["subsection"] = None 
+        for line in text.split('\n'):
+            found = self.classifier.classify(line.strip())
+            if found:
+                pattern, match = found
+                current_section["end"] = text_index
+                sections.append(current_section.copy())
+                current_section["start"] = text_index
+                if 'title' in pattern.groupindex and match.group("title"):
+                    current_section["title"] = match.group("title").strip()
+                    current_section["title_start"] = text_index + match.start("title")
+                    current_section["title_end"] = text_index + match.end("title")
+                else:
+                    heading = match.group().lower()
+                    if any(word in heading for word in SIGNATURE_WORDS):
+                        current_section["title"] = "SIGNATURE BLOCK"
+                    else:
+                        current_section["title"] = ""
+                    current_section["title_start"] = text_index
+                    current_section["title_end"] = text_index
+                if 'section' in pattern.groupindex and match.group("section"):
+                    section_str = match.group("section")
+                    section_split = section_str.split(".", 1)
+                    current_section["section"] = section_split[0].rstrip(".")
+                    current_section["subsection"] = section_split[1].rstrip(".") if len(section_split) > 1 else None
+                else:
+                    current_section["section"] = None
+                    current_section["subsection"] = None 
             text_index += len(line) + 1  # Add 1 for the newline character
 
         # Set the end of the last section after the loop
@@ -116,6 +231,15 @@ class SectionSegmenter(object):
         sections.append(current_section)
         return sections
 
+    def text_start(self, text, start, end):
+        """Where a segment's text starts after its title, past the dots and then the newlines following it."""
+        start = start or 0
+        while start < end and text[start] == ".":
+            start += 1
+        while start < end and text[start] == "\n":
+            start += 1
+        return start
+
     def __call__(self,contract) -> Generator:
         text = contract.text
         sections = self.identify_sections(text)
@@ -130,9 +254,9 @@ class SectionSegmenter(object):
                     title_end=section.get("title_end", None),
                     section=section.get("section", None),
                     subsection=section.get("subsection", None),
-                    text=
-                    text[section.get("title_end", section.get("title_start")):
-                        section.get("end", len(text))].lstrip(".").lstrip("\n")
+                    document=text,
+                    text_start=self.text_start(text, section.get("title_end", section.get("title_start")),
+                                               section.get("end", len(text)))
                 ))
         contract.table_of_contents =[(segment.section, segment.subsection, segment.title) for segment in contract.segments]
         return contract
\ No newline at end of file
@@ -1,23 +1,41 @@
-import re, string
+import re
+from bisect import bisect_left
+from utils.columns import SpanColumns
 
 class Sentence:
-    def __init__(self, start=0, end=0, text=None):
+    """A sentence of a contract, the text of `document` between the character offsets start and end.
+
+    The sentence only keeps the offsets, its text is sliced from the document when asked for.
+    """
+    def __init__(self, start=0, end=0, document=None):
         self.start = start
         self.end = end
-        self.text = text
+        self.document = document
 
-class Sentences:
-    def __init__(self):
-        self.sentences = []
     @property
     def text(self):
-        return [sentence.text for sentence in self.sentences]
+        return self.document[self.start:self.end] if self.document is not None else ""
+
+class Sentences(SpanColumns):
+    """The sentences of a contract as offset columns over its text, iterated as Sentence objects."""
+    @property
+    def text(self):
+        return self.texts()
+    @property
+    def sentences(self):
+        return list(self)
     def __iter__(self):
-        return iter(self.sentences)
+        document = self.document
+        for start, end in zip(self.starts.tolist(), self.ends.tolist()):
+            yield Sentence(start, end, document)
     def append(self, sentence):
-        self.sentences.append(sentence)
+        if self.document is None:
+            self.document = sentence.document
+        self.extend([sentence.start], [sentence.end])
 
 class SentenceTokenizer:
+    requires = ("text", "tokens")
+
     def __init__(self):
         self.newline_and_spaces = re.compile(r"\n[ \t]{2,}")
         self.two_more_newlines = re.compile(r"\n{2,}")
@@ -28,43 +46,66 @@ class SentenceTokenizer:
     def is_potential_line_break(self, token):
         return token in self.terminators or self.newline_and_spaces.match(token) or self.two_more_newlines.match(token)
 
-    def create_sentence(self, tokens, i, j):
-        sentence_text = " ".join(tokens[i:j]).strip()
+    def line_breaks(self, tokens):
+        """Ascending indexes of the tokens that may end a sentence, alone or joined to the token before."""
+        terminators = set(self.terminators)
+        longest = max(map(len, terminators))
+        # a break starts with a character of a terminator, or follows a token starting with a
+        # newline, which the patterns need. Only those tokens are looked at
+        first = {char for terminator in terminators for char in terminator} | {"\n"}
+        starts = [j for j, token in enumerate(tokens) if token[:1] in first]
+        after_newline = [(j + 1) % len(tokens) for j in starts if tokens[j][:1] == "\n"]
+        breaks = []
+        for j in sorted(set(starts).union(after_newline)):
+            token, previous = tokens[j], tokens[j - 1]
+            if (token in terminators
+                    or (len(previous) + len(token) <= longest and previous + token in terminators)
+                    or (token[:1] == "\n" and self.is_potential_line_break(token))
+                    or (previous[:1] == "\n" and self.is_potential_line_break(previous + token))):
+                breaks.append(j)
+        return breaks
 
-        # Remove space before punctuation marks
-        sentence_text = re.sub(r'\s+([{}])'.format(re.escape(string.punctuation)), r'\1', sentence_text)
+    def split(self, tokens):
+        """Sentences of a list of token texts, as (i, j) ranges of the tokens.
 
-        return Sentence(start=i, end=j, text=sentence_text)
-
-    def __call__(self,contract):
-        text = contract.tokens
-        tokens = [t.text for t in text if not t.is_space]
-        len_tks = len(tokens)
-        i, j = 0, 0
-        sentences = Sentences()
-
-        while j < len_tks:
-            if self.is_potential_line_break(tokens[j]) or self.is_potential_line_break(tokens[j - 1] + tokens[j]):
-                if tokens[j - 1].isdigit() or tokens[j - 2].isdigit():
+        Only the tokens that may end a sentence are visited, the scan jumps from one to the next.
+        """
+        n = len(tokens)
+        marks = self.line_breaks(tokens)
+        breaks = set(marks)
+        quotes = set(self.quotes)
+        ranges = []
+        i, j, k = 0, 0, 0
+        while True:
+            k = bisect_left(marks, j, k)
+            if k == len(marks):
+                break
+            j = marks[k]
+            if tokens[j - 1].isdigit() or (n > 1 and tokens[j - 2].isdigit()):
+                j += 1
+                continue
+            if self.newline_and_spaces.match(tokens[j]):
+                if j + 1 < n and not self.sent_start_re.match(tokens[j + 1]):
                     j += 1
                     continue
-                if self.newline_and_spaces.match(tokens[j]):
-                    if j + 1 < len_tks and not self.sent_start_re.match(tokens[j + 1]):
-                        j += 1
-                        continue
 
-                while j < len_tks and (
-                        self.is_potential_line_break(tokens[j]) or
-                        self.is_potential_line_break(tokens[j - 1] + tokens[j]) or
-                        tokens[j] in self.quotes):
-                    if tokens[j] in self.quotes and tokens[j] != tokens[j - 1]:
-                        break  # Balanced quotes
-                    j += 1
+            while j < n and (j in breaks or tokens[j] in quotes):
+                if tokens[j] in quotes and tokens[j] != tokens[j - 1]:
+                    break  # Balanced quotes
+                j += 1
 
-                sentences.append(self.create_sentence(tokens, i, j))
-                i = j
+            ranges.append((i, j))
+            i = j
             j += 1
 
-        sentences.append(self.create_sentence(tokens, i, j))  # Handle the last sentence
-        contract.sentences = sentences
+        ranges.append((i, n))  # Handle the last sentence
+        return ranges
+
+    def __call__(self,contract):
+        tokens = contract.tokens
+        words = ~tokens.is_space
+        document = tokens.document
+        starts, ends = tokens.starts[words].tolist(), tokens.ends[words].tolist()
+        ranges = [(i, j) for i, j in self.split([document[start:end] for start, end in zip(starts, ends)]) if i < j]
+        contract.sentences = Sentences(contract.text, [starts[i] for i, _ in ranges], [ends[j - 1] for _, j in ranges])
         return contract
@@ -1,74 +1,153 @@
-import spacy
-from spacy.tokens import Doc, Token, Span
-import string
+from functools import lru_cache
+import numpy as np
+from unidecode import unidecode
+from utils.columns import Tokens
 
-# Set extensions on the Doc, Token and Span
-Token.set_extension("bbox", default=None, force=True)
+# how far ahead in the words a token that doesn't continue where the last one ended is looked
+# for, in characters. Text the cleaner dropped or changed is skipped, it never takes long
+RESYNC_WINDOW = 64
+
+def _normalize(text):
+    # the same folding TextCleaner applies, without the whitespace the words don't have
+    if text.isascii() and not text.isspace() and len(text.split()) == 1:
+        return text.lower()
+    return "".join(unidecode(text).lower().split())
+
+def _union(boxes):
+    left = min(box["left"] for box in boxes)
+    top = min(box["top"] for box in boxes)
+    return {
+        "page": boxes[0]["page"],
+        "left": left,
+        "top": top,
+        "width": max(box["left"] + box["width"] for box in boxes) - left,
+        "height": max(box["top"] + box["height"] for box in boxes) - top,
+    }
+
+def align_tokens_to_words(tokens, bbox_info, token_pages=None):
+    """
+    Match tokens to the OCR'd words they were read from, in one pass over both.
+
+    The words of all pages are joined into one string without whitespace, and each token is
+    looked up where the previous one ended. Tokens only move forward through the words, so
+    the alignment is linear in the length of the text rather than comparing every token with
+    every word. A token that doesn't follow on directly (the cleaner dropped or changed some
+    text) is looked for in the next RESYNC_WINDOW characters, and gets no box if it isn't there.
+
+    Given the page of every token, a token is only matched starting in the words of its own
+    page, so the tokens of a page without words, e.g. read from a pdf text layer, get no box
+    rather than taking the words of the next page.
+
+    Args:
+        tokens (list): Tokens of the contract text in order.
+        bbox_info (list): Per page word columns (text, left, top, width, height) as produced by
+            FileProcessor.
+        token_pages (list): Index in bbox_info of the page each token starts on, or None.
+
+    Returns:
+        list: One box per token, a dict with page, left, top, width and height, or None.
+    """
+    chunks = []
+    owners = []
+    boxes = []
+    # where the words of each page start and end in the joined string
+    spans = {}
+    length = 0
+    for page_num, words in enumerate(bbox_info, start=1):
+        if not isinstance(words, dict):
+            continue
+        start = length
+        for i, word in enumerate(words.get("text", ())):
+            word = _normalize(word)
+            if not word:
+                continue
+            chunks.append(word)
+            length += len(word)
+            owners.extend([len(boxes)] * len(word))
+            boxes.append({
+                "page": page_num,
+                "left": words["left"][i],
+                "top": words["top"][i],
+                "width": words["width"][i],
+                "height": words["height"][i],
+            })
+        spans[page_num - 1] = (start, length)
+    stream = "".join(chunks)
+    aligned = []
+    pos = 0
+    for i, token in enumerate(tokens):
+        text = _normalize(token.text)
+        if not text:
+            aligned.append(None)
+            continue
+        lo, hi = (0, len(stream)) if token_pages is None else spans.get(token_pages[i], (0, 0))
+        pos = max(pos, lo)
+        if pos >= hi:
+            aligned.append(None)
+            continue
+        if stream.startswith(text, pos):
+            found = pos
+        else:
+            # the token may run on into the next page, as long as it starts on its own
+            found = stream.find(text, pos, min(pos + RESYNC_WINDOW, hi - 1) + len(text))
+        if found < 0:
+            aligned.append(None)
+            continue
+        pos = found + len(text)
+        first, last = owners[found], owners[pos - 1]
+        if first == last:
+            # nearly every token lies within one word, its tokens share the word's box
+            aligned.append(boxes[first])
+            continue
+        # a token broken over two pages is placed on the first
+        aligned.append(_union([box for box in boxes[first:last + 1] if box["page"] == boxes[first]["page"]]))
+    return aligned
+
+def token_pages(contract):
+    """Index in bbox_info of the page each token of the contract starts on, or None when the pages don't record where they start.
+
+    The pages record the offset in contract.raw where their text starts, see convert_to_text,
+    and the tokens are mapped back to raw through contract.offsets.
+    """
+    starts = [words.get("start") if isinstance(words, dict) else None for words in contract.bbox_info]
+    if None in starts:
+        return None
+    positions = contract.tokens.starts
+    if contract.offsets is not None:
+        positions = contract.offsets.to_raw_array(positions)
+    return (np.searchsorted(np.asarray(starts), positions, side="right") - 1).tolist()
+
+@lru_cache(maxsize=None)
+def blank_tokenizer():
+    """The tokenizer of a blank English spaCy pipeline, created on first use."""
+    import spacy
+    return spacy.blank("en").tokenizer
 
 class Tokenizer(object):
+    requires = ("text", "bbox_info")
+
     def __init__(self, tokenizer=None, default=True):
-        if default:
-            self.tokenizer = spacy.blank("en").tokenizer
-        else:
-            self.tokenizer = tokenizer
-    
-    def preprocess_text(self, text):
-        # Remove punctuation marks from the text
-        return text.translate(str.maketrans('', '', string.punctuation))
-
-    def align_words_to_bbox(self, tokens, bbox_info):
-            aligned_tokens = []
-            word_index = 0  # Initialize word index
-            for token in tokens:
-                # Find the bbox information corresponding to the token
-                bboxes = self.find_bbox_for_token(token, bbox_info)
-                if bboxes:
-                    for bbox in bboxes:
-                        token._.bbox = bbox
-
-    def find_bbox_for_token(self, token, bbox_info):
-        bboxes = []
-        token_text = self.preprocess_text(token.text)
-        for page_num, page_data in enumerate(bbox_info, start=1):
-            for i, text in enumerate(page_data["text"]):
-                bbox_text = self.preprocess_text(text)
-                if bbox_text.strip() == token_text.strip():
-                    bbox = {
-                        "page": page_num,  # Add the page number
-                        "left": page_data["left"][i],
-                        "top": page_data["top"][i],
-                        "width": page_data["width"][i],
-                        "height": page_data["height"][i]
-                    }
-                    self.merge_bbox(bboxes, bbox)
-        return bboxes
-    
-    def merge_bbox(self, bboxes, new_bbox):
-        merged = False
-        for bbox in bboxes:
-            if self.are_bboxes_overlapping(bbox, new_bbox) or self.are_bboxes_adjacent(bbox, new_bbox):
-                # Merge new_bbox into bbox
-                bbox["left"] = min(bbox["left"], new_bbox["left"])
-                bbox["top"] = min(bbox["top"], new_bbox["top"])
-                bbox["width"] = max(bbox["left"] + bbox["width"], new_bbox["left"] + new_bbox["width"]) - bbox["left"]
-                bbox["height"] = max(bbox["top"] + bbox["height"], new_bbox["top"] + new_bbox["height"]) - bbox["top"]
-                merged = True
-                break
-        if not merged:
-            bboxes.append(new_bbox)
-
-    def are_bboxes_overlapping(self, bbox1, bbox2):
-        x_overlap = max(0, min(bbox1["left"] + bbox1["width"], bbox2["left"] + bbox2["width"]) - max(bbox1["left"], bbox2["left"]))
-        y_overlap = max(0, min(bbox1["top"] + bbox1["height"], bbox2["top"] + bbox2["height"]) - max(bbox1["top"], bbox2["top"]))
-        return x_overlap > 0 and y_overlap > 0
-
-    def are_bboxes_adjacent(self, bbox1, bbox2):
-        x_distance = abs((bbox1["left"] + bbox1["width"]) - bbox2["left"]) if bbox1["left"] < bbox2["left"] else abs((bbox2["left"] + bbox2["width"]) - bbox1["left"])
-        y_distance = abs((bbox1["top"] + bbox1["height"]) - bbox2["top"]) if bbox1["top"] < bbox2["top"] else abs((bbox2["top"] + bbox2["height"]) - bbox1["top"])
-        return x_distance <= 1 or y_distance <= 1
+        # spaCy is only imported once the first contract is tokenized
+        self._tokenizer = None if default else tokenizer
+
+    @property
+    def tokenizer(self):
+        if self._tokenizer is None:
+            self._tokenizer = blank_tokenizer()
+        return self._tokenizer
+
+    @tokenizer.setter
+    def tokenizer(self, tokenizer):
+        self._tokenizer = tokenizer
+
+    def align_words_to_bbox(self, tokens, bbox_info, pages=None):
+        """Set `token._.bbox` from the word boxes of the pages, see align_tokens_to_words."""
+        tokens.bboxes = align_tokens_to_words(tokens, bbox_info, pages)
 
     def __call__(self, contract):
-        contract.tokens = [token for token in self.tokenizer(contract.text)]
-        # contract.aligned_tokens = self.align_words_to_bbox(contract.tokens, contract.bbox_info)
+        # only the offsets of the tokens are kept, the Doc is released once they are read
+        contract.tokens = Tokens.from_doc(self.tokenizer(contract.text), contract.text)
+        if contract.bbox_info:
+            self.align_words_to_bbox(contract.tokens, contract.bbox_info, token_pages(contract))
         return contract
 
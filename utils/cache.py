@@ -0,0 +1,133 @@
+"""
+On disk cache of processed contracts, keyed by the content of the document and the
+configuration of the pipeline that processed it.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+# bump when the layout of cached results changes so stale entries are never loaded
+CACHE_VERSION = 5
+DEFAULT_CACHE_DIR = os.path.join("tmp", "cache")
+SUFFIX = ".pkl"
+
+def model_identity(model):
+    """Identify a model by name, or for a local file by path, size and modification time."""
+    if isinstance(model, (str, os.PathLike)) and os.path.isfile(model):
+        stat = os.stat(model)
+        return f"{os.fspath(model)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return None if model is None else str(model)
+
+class ResultCache:
+    """Content addressed store of pickled results with least recently used eviction.
+
+    Entries are files named after their key. Reading an entry bumps its modification time, and
+    once the store outgrows its limits the entries that were used longest ago are deleted.
+    Writes go through a temporary file so concurrent processes never read a partial entry.
+
+    Args:
+        directory (str): Where the entries are stored, created if missing.
+        max_bytes (int): Total size the store is trimmed back to after each write.
+        max_entries (int): Number of entries the store is trimmed back to, None for no limit.
+    """
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=2**30, max_entries=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, fingerprint):
+        """Key for a document under a pipeline fingerprint.
+
+        Args:
+            source (str|bytes): Path of the document, its text or its raw bytes.
+            fingerprint (str): Identifies the configuration producing the result.
+        """
+        digest = hashlib.sha256(f"{CACHE_VERSION}:{fingerprint}:".encode("utf-8"))
+        if isinstance(source, bytes):
+            digest.update(source)
+        elif isinstance(source, (str, os.PathLike)) and os.path.isfile(source):
+            with open(source, "rb") as f:
+                for chunk in iter(lambda: f.read(2**20), b""):
+                    digest.update(chunk)
+        else:
+            digest.update(str(source).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def get(self, key):
+        """The value stored under key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as err:
+            logging.warning(f"Dropping unreadable cache entry {path}: {err}")
+            self._remove(path)
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            # evicted by another process in the meantime
+            pass
+        return value
+
+    def put(self, key, value):
+        """Store value under key and evict old entries. Values that can't be pickled are skipped."""
+        try:
+            data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception as err:
+            logging.warning(f"Not caching result {key}: {err}")
+            return False
+        if len(data) > self.max_bytes:
+            return False
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as err:
+            logging.warning(f"Failed to write cache entry {key}: {err}")
+            self._remove(tmp_path)
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Delete the least recently used entries until the store is within its limits."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(SUFFIX):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes and (self.max_entries is None or count <= self.max_entries):
+                break
+            self._remove(path)
+            total -= size
+            count -= 1
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                self._remove(os.path.join(self.directory, name))
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,9 +1,23 @@
-import spacy
+from functools import lru_cache
 from unidecode import unidecode
+from utils.offsets import OffsetBuilder, OffsetMap
 import re
-from spacy.lang.en import EnglishDefaults
 
-nlp = spacy.load('en_core_web_md')
+@lru_cache(maxsize=None)
+def default_stop_words():
+    """spaCy's English stop words, imported the first time they are needed."""
+    from spacy.lang.en.stop_words import STOP_WORDS
+    return frozenset(STOP_WORDS)
+
+def stop_words(add_stop_words=None, remove_stop_words=None):
+    """spaCy's English stop words with the words of one call added or removed, leaving the defaults unchanged."""
+    words = default_stop_words()
+    if add_stop_words:
+        words = words | {word.lower() for word in add_stop_words}
+    if remove_stop_words:
+        words = words - {word.lower() for word in remove_stop_words}
+    return words
+
 NORMALIZE_SPACE = re.compile(r"[\r\t\f\v  ]+")
 NORMALIZE_NEWLINES = re.compile(r'(\n\s*)+')
 REMOVE_NUM = re.compile(
@@ -36,7 +50,113 @@ SINGLE_QUOTE_REGEX = re.compile("|".join(bad_single_quotes))
 page_number_pattern = re.compile(r'\n+(\d+)\n{2,}', re.MULTILINE)
 digit_word_pattern = re.compile(r'(\d)([A-Za-z])')  # Match a digit followed by a letter
 
+NON_ASCII = re.compile(r"[^\x00-\x7f]+")
+# Every place the cleaning changes the folded text, found in one scan. Each starts with one of
+# the characters in the leading class, which lets the regex engine skip straight to them:
+# - lines: a line break and the whitespace after it, along with page numbers on their own line
+# - spaces, space: runs of spaces and tabs other than a single space
+# - digit: a digit followed by a letter
+CLEAN_EVENTS = re.compile(
+    r"[\t\n\r\f\v 0-9]"
+    r"(?:(?<=\n)(?P<lines>(?:\s|(?<=\n)\d+(?=\n))*)"
+    r"|(?<= )(?P<spaces>[\r\t\f\v ]+)"
+    r"|(?<=[\r\t\f\v])(?P<space>[\r\t\f\v ]*)"
+    r"|(?<=\d)(?P<digit>)(?=[A-Za-z]))"
+)
+PAGE_NUMBERS = re.compile(r"(\d+)")
+
+def fold(text, lower=False):
+    """Lowercase text if asked and transliterate it to ASCII, along with the OffsetMap back to text.
+
+    Only the non ASCII runs go through unidecode, one character at a time so each keeps its offset.
+    """
+    if text.isascii():
+        return (text.lower() if lower else text), OffsetMap.identity(len(text))
+    builder = OffsetBuilder()
+    last = 0
+    for match in NON_ASCII.finditer(text):
+        chunk = text[last:match.start()]
+        builder.add(chunk.lower() if lower else chunk, last)
+        for i, char in enumerate(match.group(), match.start()):
+            builder.add(unidecode(char.lower() if lower else char), i, i + 1)
+        last = match.end()
+    chunk = text[last:]
+    builder.add(chunk.lower() if lower else chunk, last)
+    return builder.build(len(text))
+
+def _clean_lines(builder, text, start, end):
+    # a line break and the whitespace after it become a single line break, dropping the page
+    # numbers on their own line that are followed by a blank one. A page number right after a
+    # dropped one is kept, its line break went with the first.
+    # a line starting with a lowercase letter carries on the one before
+    joined = end < len(text) and "a" <= text[end] <= "z"
+    if end - start == 1:
+        if not joined:
+            builder.add("\n", start)
+        return
+    parts = PAGE_NUMBERS.split(text[start:end])
+    kept = []
+    offset = start + len(parts[0])
+    dropped = False
+    for i in range(1, len(parts), 2):
+        before, digits, after = parts[i - 1], parts[i], parts[i + 1]
+        dropped = after.startswith("\n\n") and not (dropped and not before.strip("\n"))
+        if not dropped:
+            kept.append((digits, offset))
+        offset += len(digits) + len(after)
+    line_break = start
+    for digits, at in kept:
+        builder.add("\n", line_break, at)
+        builder.add(digits, at)
+        line_break = at + len(digits)
+    if not joined:
+        builder.add("\n", line_break, end)
+
+def normalize(text, lower=False):
+    """Clean text in one scan, along with the OffsetMap from the cleaned text back to text.
+
+    Folds the text to ASCII, collapses spaces and tabs, drops page numbers, collapses blank
+    lines, separates digits from the letters after them and joins lines that start with a
+    lowercase letter to the line before.
+
+    Args:
+        text (str): The raw text.
+        lower (bool, optional): Whether to lowercase the text. Defaults to False.
+
+    Returns:
+        tuple: The cleaned text and its OffsetMap.
+    """
+    folded, folded_offsets = fold(text, lower)
+    builder = OffsetBuilder()
+    last = 0
+    for match in CLEAN_EVENTS.finditer(folded):
+        start, end = match.span()
+        builder.add(folded[last:start], last)
+        kind = match.lastgroup
+        if kind == "lines":
+            _clean_lines(builder, folded, start, end)
+        elif kind in ("spaces", "space"):
+            builder.add(" ", start, end)
+        else:
+            builder.add(folded[start] + " ", start, end)
+        last = end
+    builder.add(folded[last:], last)
+    cleaned, offsets = builder.build(len(folded))
+    return cleaned, offsets.compose(folded_offsets)
+
+def remove_numbers(text):
+    """text without its numbers, along with the OffsetMap back to text."""
+    builder = OffsetBuilder()
+    last = 0
+    for match in REMOVE_NUM.finditer(text):
+        builder.add(text[last:match.start()], last)
+        last = match.end()
+    builder.add(text[last:], last)
+    return builder.build(len(text))
+
 class TextCleaner(object):
+    requires = ("raw",)
+
     def __init__(self):
         pass
     def __call__(self,
@@ -44,7 +164,8 @@ class TextCleaner(object):
                 lower:bool=True,
                 remove_num:bool=True,
                 add_stop_words:set=None,
-                remove_stop_words:list=None) -> str:
+                remove_stop_words:list=None,
+                drop_stop_words:bool=False) -> str:
 
         """Preproccessing of text prior to running through a function
         Args:
@@ -52,46 +173,35 @@ class TextCleaner(object):
             lower (bool, optional): Whether to return lowercase only. Defaults to True.
             remove_num (bool, optional): Whether to renove numbers completly . Defaults to True.
             add_stop_words (set, optional): Set of additional words to be added to list of stopwords. Defaults to None.
+            remove_stop_words (list, optional): Words not to treat as stopwords. Defaults to None.
+            drop_stop_words (bool, optional): Whether to reduce the text to its words without stopwords,
+                punctuation and single characters. Defaults to False.
         Returns:
-            str: cleaned up text
+            Contract: the contract with the cleaned up text, and the OffsetMap from it back to the raw text as `offsets`
         """
-        text = str(contract.raw)
-        if lower:
-            text = text.lower()
-        text = unidecode(text)
-        text = NORMALIZE_SPACE.sub(" ",text)
-        text = page_number_pattern.sub("\n",text)
-        text = NORMALIZE_NEWLINES.sub("\n",text)
-        text = digit_word_pattern.sub(r"\1 \2",text) 
-        text = self.fix_line_breaks(text)    
+        text, offsets = normalize(str(contract.raw), lower=lower)
         if remove_num:
-            text = REMOVE_NUM.sub('',text)
-        if not add_stop_words == None:
-            nlp.Defaults.stop_words |= add_stop_words
-        if not remove_stop_words == None:
-            for word in remove_stop_words:
-                nlp.vocab[word].is_stop = False
-        tokens = nlp.tokenizer(text)
-        #text = ' '.join([token.text for token in tokens if (not token.is_space and not token.is_punct and not token.is_stop \
-        #    and not len(token)==1) or token.is_digit])
+            text, removed = remove_numbers(text)
+            offsets = removed.compose(offsets)
+        if drop_stop_words:
+            text, dropped = self.drop_stop_words(text, stop_words(add_stop_words, remove_stop_words))
+            offsets = dropped.compose(offsets)
         contract.text = text
+        contract.offsets = offsets
         return contract
     
-    def fix_line_breaks(self,text):
-        # Split text into lines
-        lines = text.split('\n')
-        
-        # Merge words that are split across lines
-        cleaned_lines = []
-        for i in range(len(lines)):
-            # Check if the line is not empty and contains at least one character
-            if lines[i] and lines[i][0].islower():
-                # Merge with previous line if the current line starts with a lowercase letter
-                cleaned_lines[-1] += lines[i]
-            else:
-                cleaned_lines.append(lines[i])
-        
-        # Join lines back into a single text
-        cleaned_text = '\n'.join(cleaned_lines)
-        
-        return cleaned_text
\ No newline at end of file
+    def drop_stop_words(self, text, stop_words):
+        """Words of text joined by spaces, leaving out stopwords, punctuation and single characters but not numbers.
+
+        Returns:
+            tuple: The words and the OffsetMap back to text.
+        """
+        from tokenization.tokenizer import blank_tokenizer
+        builder = OffsetBuilder()
+        for token in blank_tokenizer()(text):
+            if (not token.is_space and not token.is_punct and token.lower_ not in stop_words \
+                and not len(token)==1) or token.is_digit:
+                if builder.length:
+                    builder.add(' ', token.idx, token.idx)
+                builder.add(token.text, token.idx)
+        return builder.build(len(text))
@@ -0,0 +1,136 @@
+"""
+Columnar storage of the spans of a contract's text.
+
+Tokens, sentences and segments used to be one Python object each, every one with its own copy
+of its text, and the tokens kept the whole spaCy Doc alive. SpanColumns keeps the start and end
+offsets of its spans in NumPy arrays over the one text they were found in, and only slices the
+text of a span when it is asked for. Iterating still yields an object per span, made on the fly.
+"""
+import numpy as np
+
+# offsets fit in 32 bits for any text under 2GB
+OFFSET = np.int32
+
+class SpanColumns:
+    """Start and end offsets of ascending, non overlapping spans of a text.
+
+    Args:
+        document (str): The text the offsets point into.
+        starts (iterable): Start offset of every span.
+        ends (iterable): End offset of every span.
+    """
+    def __init__(self, document=None, starts=(), ends=()):
+        self.document = document
+        self.starts = np.asarray(starts, dtype=OFFSET)
+        self.ends = np.asarray(ends, dtype=OFFSET)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def span_text(self, i):
+        """Text of span i, sliced from the document."""
+        return self.document[self.starts[i]:self.ends[i]] if self.document is not None else ""
+
+    def texts(self):
+        """Text of every span."""
+        if self.document is None:
+            return [""] * len(self)
+        document = self.document
+        return [document[start:end] for start, end in zip(self.starts.tolist(), self.ends.tolist())]
+
+    def extend(self, starts, ends):
+        """Add spans after the last one."""
+        self.starts = np.concatenate([self.starts, np.asarray(starts, dtype=OFFSET)])
+        self.ends = np.concatenate([self.ends, np.asarray(ends, dtype=OFFSET)])
+
+    def indexes_within(self, start, end):
+        """range of the indexes of the spans lying entirely inside [start, end)."""
+        lo = int(np.searchsorted(self.starts, start, side="left"))
+        # the spans don't overlap, so their ends are ascending too
+        hi = int(np.searchsorted(self.ends, end, side="right"))
+        return range(lo, max(lo, hi))
+
+    def index_at(self, offsets):
+        """Index of the last span starting at or before each offset, -1 before the first span."""
+        return np.searchsorted(self.starts, offsets, side="right") - 1
+
+class Token:
+    """A token read from the columns of a Tokens table, with the attributes of a spaCy token the pipeline uses."""
+    __slots__ = ("tokens", "i", "idx", "end")
+
+    def __init__(self, tokens, i, idx, end):
+        self.tokens = tokens
+        self.i = i
+        self.idx = idx
+        self.end = end
+
+    @property
+    def text(self):
+        return self.tokens.document[self.idx:self.end]
+
+    @property
+    def is_space(self):
+        return bool(self.tokens.is_space[self.i])
+
+    @property
+    def _(self):
+        # extension attributes, as token._.bbox on spaCy tokens
+        return self
+
+    @property
+    def bbox(self):
+        return self.tokens.bboxes[self.i] if self.tokens.bboxes is not None else None
+
+    def __len__(self):
+        return self.end - self.idx
+
+    def __repr__(self):
+        return self.text
+
+class Tokens(SpanColumns):
+    """Tokens of a text as offset columns, replacing the list of spaCy tokens and their Doc.
+
+    Args:
+        document (str): The tokenized text.
+        starts (iterable): Offset of every token.
+        ends (iterable): End offset of every token.
+        is_space (iterable): Whether each token is whitespace.
+        bboxes (list): Box of the OCR'd words of each token, see align_tokens_to_words, or None.
+    """
+    def __init__(self, document=None, starts=(), ends=(), is_space=(), bboxes=None):
+        super().__init__(document, starts, ends)
+        self.is_space = np.asarray(is_space, dtype=bool)
+        self.bboxes = bboxes
+
+    @classmethod
+    def from_doc(cls, doc, document):
+        """Columns of the tokens of a spaCy Doc, or any sequence of tokens with idx, text and is_space."""
+        count = len(doc)
+        starts = np.fromiter((token.idx for token in doc), dtype=OFFSET, count=count)
+        lengths = np.fromiter((len(token.text) for token in doc), dtype=OFFSET, count=count)
+        is_space = np.fromiter((token.is_space for token in doc), dtype=bool, count=count)
+        return cls(document, starts, starts + lengths, is_space)
+
+    def __iter__(self):
+        for i, (start, end) in enumerate(zip(self.starts.tolist(), self.ends.tolist())):
+            yield Token(self, i, start, end)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            bboxes = self.bboxes[i] if self.bboxes is not None else None
+            return Tokens(self.document, self.starts[i], self.ends[i], self.is_space[i], bboxes)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("token index out of range")
+        return Token(self, i, int(self.starts[i]), int(self.ends[i]))
+
+    def words(self):
+        """The tokens that aren't whitespace, as a Tokens table of their own."""
+        keep = ~self.is_space
+        bboxes = [bbox for bbox, kept in zip(self.bboxes, keep.tolist()) if kept] if self.bboxes is not None else None
+        return Tokens(self.document, self.starts[keep], self.ends[keep], self.is_space[keep], bboxes)
+
+    def within(self, start, end):
+        """Tokens lying entirely inside [start, end), as TokenIndex.within."""
+        return [self[i] for i in self.indexes_within(start, end)]
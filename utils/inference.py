@@ -0,0 +1,180 @@
+"""
+Micro-batching of model calls made from several threads at once.
+
+Each contract in flight used to run its own forward pass. An InferenceScheduler sits in front
+of a loaded model, collects the texts submitted by every caller for a few milliseconds or until
+a batch is full, runs them as one padded batch and hands each caller back its own results.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from collections import Counter
+from concurrent.futures import Future
+
+class InferenceScheduler:
+    """Batch texts submitted from any number of threads into shared calls of fn.
+
+    Args:
+        fn (callable): Runs the model over a list of texts and returns one result per text.
+        max_batch_size (int): Most texts passed to fn at once.
+        max_wait_ms (float): How long the first text of a batch waits for others to join it.
+        name (str): Shown in the logs and metrics.
+    """
+    def __init__(self, fn, max_batch_size=16, max_wait_ms=5, name=None):
+        self.fn = fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.max_wait = max_wait_ms / 1000
+        self.key = None
+        self.name = name or getattr(fn, "__qualname__", "model")
+        self._reset()
+        self._closed = False
+
+    def _reset(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._requests = 0
+        self._items = 0
+        self._batches = 0
+        self._max_queue_depth = 0
+        self._batch_sizes = Counter()
+        self._busy = 0.0
+        self._waited = 0.0
+
+    def __reduce__(self):
+        # components are pickled into worker processes, which get a scheduler of their own
+        if self.key is None:
+            return (InferenceScheduler, (self.fn, self.max_batch_size, self.max_wait_ms, self.name))
+        return (shared_scheduler, (self.key, self.fn, self.max_batch_size, self.max_wait_ms, self.name))
+
+    def submit(self, texts):
+        """Run texts through the model along with whatever other callers submit, blocking until done.
+
+        Returns:
+            list: One result of fn per text, in order.
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        futures = []
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"Inference scheduler {self.name} is closed")
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name=f"inference-{self.name}", daemon=True)
+                self._worker.start()
+            self._requests += 1
+            now = time.perf_counter()
+            for text in texts:
+                future = Future()
+                futures.append(future)
+                self._queue.put((text, future, now))
+            self._max_queue_depth = max(self._max_queue_depth, self._queue.qsize())
+        return [future.result() for future in futures]
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size and batch[-1] is not None:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            stop = batch[-1] is None
+            batch = [entry for entry in batch if entry is not None]
+            if batch:
+                self._run_batch(batch)
+            if stop:
+                return
+
+    def _run_batch(self, batch):
+        start = time.perf_counter()
+        try:
+            results = self.fn([text for text, _, _ in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"{self.name} returned {len(results)} results for {len(batch)} texts")
+        except Exception as err:
+            for _, future, _ in batch:
+                future.set_exception(err)
+            results = None
+        end = time.perf_counter()
+        with self._lock:
+            self._batches += 1
+            self._items += len(batch)
+            self._batch_sizes[len(batch)] += 1
+            self._busy += end - start
+            self._waited += sum(start - submitted for _, _, submitted in batch)
+        logging.debug(f"{self.name}: ran a batch of {len(batch)} in {end - start:.3f}s, {self._queue.qsize()} waiting")
+        if results is not None:
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def metrics(self):
+        """Counters since the scheduler started: requests, texts, batches, batch sizes and queue depth."""
+        with self._lock:
+            return {
+                "requests": self._requests,
+                "items": self._items,
+                "batches": self._batches,
+                "queue_depth": self._queue.qsize(),
+                "max_queue_depth": self._max_queue_depth,
+                "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+                "batch_sizes": dict(sorted(self._batch_sizes.items())),
+                "busy_seconds": self._busy,
+                "mean_wait_ms": 1000 * self._waited / self._items if self._items else 0.0,
+            }
+
+    def close(self):
+        """Finish the texts already submitted and stop the worker thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            worker = self._worker
+        if worker is not None:
+            self._queue.put(None)
+            worker.join()
+        with _schedulers_lock:
+            if _schedulers.get(self.key) is self:
+                del _schedulers[self.key]
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+def shared_scheduler(key, fn, max_batch_size=16, max_wait_ms=5, name=None):
+    """The scheduler registered under key, created around fn on first use.
+
+    Components running the same model with the same settings pass the same key, so their
+    calls from all pipelines and threads end up in the same batches.
+    """
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = InferenceScheduler(fn, max_batch_size, max_wait_ms, name)
+            scheduler.key = key
+        return scheduler
+
+def _after_fork():
+    # a forked worker process inherits the schedulers but not their threads, start afresh
+    global _schedulers_lock
+    _schedulers_lock = threading.Lock()
+    for scheduler in _schedulers.values():
+        scheduler._reset()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+def scheduler_metrics():
+    """Metrics of every shared scheduler, by name."""
+    with _schedulers_lock:
+        schedulers = list(_schedulers.values())
+    return {scheduler.name: scheduler.metrics() for scheduler in schedulers}
@@ -0,0 +1,88 @@
+"""
+Process wide registry of loaded models, so pipelines built with the same models share them.
+
+Components don't load their model when they are created. They register how to load it and
+the model is loaded through the registry the first time it is used, once per process however
+many pipelines, threads or sidebar toggles ask for it.
+"""
+import logging
+import threading
+import time
+from utils.cache import model_identity
+
+class ModelRegistry:
+    """Loaded models keyed by what they were loaded from.
+
+    Models are loaded once, the first time they are asked for, while other threads asking for
+    the same model wait for it. Different models load at the same time.
+    """
+    def __init__(self):
+        self._models = {}
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, key, loader):
+        """The model under key, calling loader() to load it if it isn't resident."""
+        model = self._models.get(key)
+        if model is not None:
+            return model
+        with self._lock:
+            lock = self._loading.setdefault(key, threading.Lock())
+        with lock:
+            model = self._models.get(key)
+            if model is None:
+                start = time.perf_counter()
+                model = loader()
+                logging.info(f"Loaded model {key} in {time.perf_counter() - start:.1f}s")
+                self._models[key] = model
+        with self._lock:
+            self._loading.pop(key, None)
+        return model
+
+    def __contains__(self, key):
+        return key in self._models
+
+    def loaded(self):
+        """Keys of the resident models."""
+        return list(self._models)
+
+    def evict(self, key=None):
+        """Drop the model under key, or all of them. Components load it again the next time they use it."""
+        with self._lock:
+            if key is None:
+                self._models.clear()
+            else:
+                self._models.pop(key, None)
+
+MODELS = ModelRegistry()
+
+class RegisteredModel:
+    """The `model` attribute of a component, loaded through MODELS when the component registered a loader.
+
+    Assigning a model directly replaces the registered one for that component only.
+    """
+    def __get__(self, component, owner=None):
+        if component is None:
+            return self
+        loader = component.__dict__.get("model_loader")
+        if loader is not None:
+            return MODELS.get(component.model_key, loader)
+        return component.__dict__.get("_model")
+
+    def __set__(self, component, model):
+        component.__dict__["model_loader"] = None
+        component.__dict__["_model"] = model
+
+def share_model(component, kind, name, loader):
+    """Have component.model loaded on first use, and shared with every component loading name the same way.
+
+    Args:
+        component: A recognizer or classifier with a RegisteredModel `model` attribute.
+        kind (str): How the model is loaded, e.g. the transformers pipeline task.
+        name (str): Name or path of the model.
+        loader (callable): Loads the model. Must be picklable, e.g. a functools.partial, so the
+            component can be sent to worker processes without its model.
+    """
+    component.model_key = (kind, model_identity(name))
+    component.__dict__["model_loader"] = loader
+    component.__dict__["_model"] = None
@@ -1,28 +1,54 @@
 import tempfile
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from unidecode import unidecode
 import os
 import subprocess
 import logging
 from copy import deepcopy
 from pathlib import Path
-from pdf2image import convert_from_path
-import chardet
-import textract
 from shutil import rmtree
-import PyPDF2
 
-logging.basicConfig(level=logging.DEBUG)
+# resolution pages are rendered at for OCR
+OCR_DPI = 200
+TESSERACT_ARGS = "--psm 1"
+# columns of the tesseract tsv output kept for each word
+WORD_COLUMNS = ("text", "left", "top", "width", "height", "conf")
+# a text layer is used instead of OCR when it has at least this many characters per square
+# inch of page, a full page of text has 20-40, and nearly all of them are printable
+MIN_TEXT_DENSITY = 1.0
+MIN_PRINTABLE_RATIO = 0.9
 
 class FileProcessor():
-    def __init__(self):
-        pass
+    requires = ()
+    # keeps no state between documents and never changes the working directory, so
+    # ContractPipeline.pipe can load several documents at once on threads
+    thread_safe = True
+
+    def __init__(self, cache=None, ocr_workers=None, text_layer=True):
+        """
+        Args:
+        - cache (ResultCache): Store the OCR text and word boxes of every page, keyed by file
+          hash and page number and by the hash of the rendered page, so pages that were OCR'd
+          before (also as part of an earlier version of the document) skip tesseract.
+        - ocr_workers (int): Number of pages OCR'd in parallel, the number of CPUs by default.
+        - text_layer (bool): Read pdf pages that have a usable text layer directly and only OCR
+          the others. False OCRs every page.
+        """
+        self.cache = cache
+        self.ocr_workers = ocr_workers
+        self.text_layer = text_layer
        
     def __call__(self, contract):
         input_fn = ""
         try:
             input_fn, input_fmt = pre_process(contract.file_path)
             logging.debug(f"Preprocessed input file: {input_fn}, format: {input_fmt}")
-            text,bbox,_ = convert_to_text(input_fn, input_fmt, config={"convert_as_image": True})
+            text,bbox,_ = convert_to_text(input_fn, input_fmt, config={"convert_as_image": True,
+                                                                               "ocr_workers": self.ocr_workers,
+                                                                               "text_layer": self.text_layer},
+                                        cache=self.cache)
         except Exception as err:
             logging.error(f"An error occurred: {err}")
             raise err
@@ -35,12 +61,13 @@ class FileProcessor():
         contract.bbox_info = bbox  
         return contract
 
-def run_system_command(cmd:str, ignore:bool=False):
+def run_system_command(cmd:str, ignore:bool=False, cwd:str=None, env:dict=None):
     """
-    Call a system command. Ignore=True to ignore errors
+    Call a system command. Ignore=True to ignore errors, cwd sets the directory it runs in
+    and env its environment
     """
     logging.debug(f"Running system command = {cmd}")
-    result = subprocess.run(cmd.split(), stderr=subprocess.PIPE, stdout=subprocess.PIPE)
+    result = subprocess.run(cmd.split(), stderr=subprocess.PIPE, stdout=subprocess.PIPE, cwd=cwd, env=env)
     if not ignore:
         assert result.returncode == 0, f"Error running {cmd}"
     try:
@@ -49,63 +76,195 @@ def run_system_command(cmd:str, ignore:bool=False):
         result = result.stdout.decode("unicode_escape")
     return result
 
-def pdf_to_images(pdf_fn, config):
-    """pdftoppm to create image files"""
-    logging.debug("Converting pdf to images")
-    file_list = []
-    pth = os.path.dirname(pdf_fn)
-    if pth:
-        os.chdir(pth)
-    pages = convert_from_path(pdf_fn)
-    temp_dir = tempfile.mkdtemp()
-    for count, page in enumerate(pages):
-        page.save(os.path.join(temp_dir, f'out{count}.jpg'), 'JPEG')
-        file_list.append(os.path.join(temp_dir, f'out{count}.jpg'))
-    with open("file_list", "w") as f:
-        f.write("\n".join(file_list))
-    config["first_page"] = 1
-    config["last_page"] = len(pages)
-    return os.path.join(pth, "file_list"), config
-
-def images_to_pdf(image_fn, config=None):
-    """tesseract to OCR the images back into single pdf"""
-    logging.debug("Converting image to pdf")
-    file_path = os.path.dirname(image_fn)
-    original_path = os.getcwd() 
-    os.chdir(file_path) 
-    cmd = f"tesseract -c textonly_pdf=1 {image_fn} OCR --psm 1 pdf"
-    _ = run_system_command(cmd)
-    pdf_path = os.path.join(file_path, "OCR.pdf")
-    return pdf_path, config
-
-
-def convert_to_images_pdf(pdf_fn, config=None):
-    """Convert to images and then back to single pdf"""
-    image_fn, new_config = pdf_to_images(pdf_fn, config)
-    pdf_fn, new_config = images_to_pdf(image_fn, new_config)
-    return pdf_fn, new_config
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+@lru_cache(maxsize=None)
+def ocr_fingerprint():
+    """Tesseract version and settings, so cached pages are redone when either changes."""
+    try:
+        result = subprocess.run(["tesseract", "--version"], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        version = result.stdout.decode("utf-8", errors="replace").splitlines()[0]
+    except (OSError, IndexError):
+        version = "unknown"
+    return f"{version}:{TESSERACT_ARGS}:{OCR_DPI}"
+
+# the pdf and office format libraries are imported by the functions using them, so a pipeline
+# built on text that is already extracted never loads them
+
+def count_pages(pdf_fn):
+    import PyPDF2
+    with open(pdf_fn, "rb") as pdf_file:
+        return len(PyPDF2.PdfReader(pdf_file).pages)
+
+def render_page(pdf_fn, page_num, dpi=OCR_DPI):
+    """Rasterize one page (1 based) of a pdf."""
+    from pdf2image import convert_from_path
+    return convert_from_path(pdf_fn, dpi=dpi, first_page=page_num, last_page=page_num)[0]
+
+def parse_tsv(tsv):
+    """Word rows of tesseract tsv output as columns, the layout of pytesseract's image_to_data dicts."""
+    words = {column: [] for column in WORD_COLUMNS}
+    lines = tsv.splitlines()
+    if not lines:
+        return words
+    header = lines[0].split("\t")
+    for line in lines[1:]:
+        row = dict(zip(header, line.split("\t")))
+        # level 5 rows are words, the others are the blocks, paragraphs and lines containing them
+        if row.get("level") != "5" or not row.get("text", "").strip():
+            continue
+        for column in WORD_COLUMNS:
+            value = row[column]
+            words[column].append(value if column == "text" else int(float(value)))
+    return words
+
+def ocr_image(image_fn):
+    """Run tesseract over an image, returning its text and word boxes."""
+    work_dir = os.path.dirname(image_fn)
+    # pages are OCR'd in parallel, one thread per tesseract keeps them from oversubscribing the cores
+    env = dict(os.environ, OMP_THREAD_LIMIT="1")
+    run_system_command(f"tesseract {os.path.basename(image_fn)} page {TESSERACT_ARGS} txt tsv", cwd=work_dir, env=env)
+    with open(os.path.join(work_dir, "page.txt"), "r", encoding="utf-8") as f:
+        # tesseract ends every page with a form feed
+        text = f.read().rstrip("\f")
+    with open(os.path.join(work_dir, "page.tsv"), "r", encoding="utf-8") as f:
+        words = parse_tsv(f.read())
+    return text, words
+
+def ocr_page(pdf_fn, page_num, digest, cache=None):
+    """
+    OCR one page of a pdf.
+
+    With a cache, the page is first looked up by file hash and page number, then by the hash
+    of the rendered page, which also finds pages shared with other versions of the document.
+
+    Returns:
+        dict: The page number, its text and its words as columns of text, left, top, width, height and conf.
+    """
+    fingerprint = ocr_fingerprint()
+    page_key = cache.key(f"{digest}:{page_num}".encode("utf-8"), fingerprint) if cache is not None else None
+    if page_key is not None:
+        page = cache.get(page_key)
+        if page is not None:
+            return page
+
+    image = render_page(pdf_fn, page_num)
+    image_key = None
+    if cache is not None:
+        image_key = cache.key(image.tobytes(), f"{fingerprint}:{image.mode}:{image.size}")
+        page = cache.get(image_key)
+        if page is not None:
+            page = dict(page, page=page_num)
+            cache.put(page_key, page)
+            return page
+
+    work_dir = tempfile.mkdtemp()
+    try:
+        image_fn = os.path.join(work_dir, "page.png")
+        image.save(image_fn)
+        text, words = ocr_image(image_fn)
+    finally:
+        rmtree(work_dir, ignore_errors=True)
+    page = {"page": page_num, "text": text, "words": words}
+    if cache is not None:
+        cache.put(image_key, page)
+        cache.put(page_key, page)
+    return page
+
+def ocr_pdf(pdf_fn, cache=None, workers=None, page_nums=None):
+    """
+    OCR pages of a pdf, all of them by default, see ocr_page.
+
+    Pages are rendered and OCR'd independently by a pool of `workers` threads, the number of
+    CPUs by default, so only as many page images as there are workers are in memory at once.
+    The pages are returned in page order.
+    """
+    if page_nums is None:
+        page_nums = range(1, count_pages(pdf_fn) + 1)
+    page_nums = list(page_nums)
+    if not page_nums:
+        return []
+    digest = file_digest(pdf_fn) if cache is not None else None
+    workers = min(workers or os.cpu_count() or 1, len(page_nums))
+    ocr_fingerprint()
+    if workers == 1:
+        return [ocr_page(pdf_fn, page_num, digest, cache) for page_num in page_nums]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda page_num: ocr_page(pdf_fn, page_num, digest, cache), page_nums))
+
+def has_text_layer(text, width, height):
+    """Whether text extracted from a page of width x height points is dense and clean enough to skip OCR."""
+    chars = [char for char in text if not char.isspace()]
+    if not chars or width <= 0 or height <= 0:
+        return False
+    area = (width / 72) * (height / 72)
+    printable = sum(1 for char in chars if char.isprintable() and char != "\ufffd")
+    return len(chars) / area >= MIN_TEXT_DENSITY and printable / len(chars) >= MIN_PRINTABLE_RATIO
+
+def text_layer_pages(pdf_fn):
+    """Text layer of every page of a pdf, None for pages without a usable one."""
+    import PyPDF2
+    texts = []
+    with open(pdf_fn, "rb") as pdf_file:
+        for page in PyPDF2.PdfReader(pdf_file).pages:
+            try:
+                text = page.extract_text() or ""
+            except Exception as err:
+                logging.debug(f"Failed to extract the text layer of a page: {err}")
+                text = ""
+            box = page.mediabox
+            texts.append(text if has_text_layer(text, float(box.width), float(box.height)) else None)
+    return texts
+
+def extract_pdf(pdf_fn, cache=None, workers=None, text_layer=True):
+    """
+    Text and word boxes of every page of a pdf.
+
+    Pages with a usable text layer are read from it and only the others are rendered and
+    OCR'd, see ocr_pdf. Pages read from the text layer have no word boxes.
+    """
+    if not text_layer:
+        return ocr_pdf(pdf_fn, cache, workers)
+    texts = text_layer_pages(pdf_fn)
+    scanned = [page_num for page_num, text in enumerate(texts, start=1) if text is None]
+    logging.debug(f"{len(texts) - len(scanned)} of {len(texts)} pages have a text layer")
+    ocred = dict(zip(scanned, ocr_pdf(pdf_fn, cache, workers, scanned)))
+    return [ocred[page_num] if text is None else {"page": page_num, "text": text, "words": {column: [] for column in WORD_COLUMNS}}
+            for page_num, text in enumerate(texts, start=1)]
+
+def to_points(words, dpi=OCR_DPI):
+    """Word boxes of a page rendered at dpi in pdf points (1/72 inch from the top left), as pdf viewers place annotations."""
+    scale = 72 / dpi
+    points = dict(words)
+    for column in ("left", "top", "width", "height"):
+        points[column] = [round(value * scale, 2) for value in words[column]]
+    return points
 
 def convert_image_to_text(input_fn:str, config=None):
-    original_path = os.getcwd()  # Store original current working directory
-    pth = os.path.dirname(input_fn)
-    if pth:
-        os.chdir(pth)
-    cmd = f"tesseract {input_fn} - --psm 1"
-    result = run_system_command(cmd)  # Execute Tesseract command
-    os.chdir(original_path)  # Return to the original current working directory
+    cmd = f"tesseract {os.path.basename(input_fn)} - {TESSERACT_ARGS}"
+    result = run_system_command(cmd, cwd=os.path.dirname(input_fn) or None)  # Execute Tesseract command
     return result, config
 
-def convert_to_text(input_fn:str, input_fmt:str, config:dict=None):
+def convert_to_text(input_fn:str, input_fmt:str, config:dict=None, cache=None):
     """
     Convert input document to txt
     Config options:
-    - convert_as_image: input_fmt:pdf, convert to images, convert images to pdf, then extract
-    
+    - convert_as_image: input_fmt:pdf, OCR every page from its rendered image
+    - ocr_workers: number of pages OCR'd in parallel, the number of CPUs by default
+    - text_layer: with convert_as_image, read pages that have a usable text layer directly, True by default
+    With convert_as_image the returned bbox has the words of every page as columns of text,
+    left, top, width, height and conf, positions in pdf points, see to_points, and the offset
+    in the text where the page starts as `start`.
+    With a cache, the OCR results of pages are reused, see ocr_page.
     """
-    print(input_fn)
+    logging.debug(f"Converting {input_fn}")
     bbox = []
-    new_config = deepcopy(config)
-    original_path = os.getcwd()  # Store original current working directory
+    new_config = deepcopy(config) or {}
     if input_fmt == "xml":
         input_fmt = "htm"
     if input_fmt in ["png", "jpg", "jpeg"]:
@@ -117,12 +276,14 @@ def convert_to_text(input_fn:str, input_fmt:str, config:dict=None):
             output = f.read()
         return output,bbox,new_config
     if input_fmt != "pdf":
+        import textract
         try:
             output = textract.process(input_fn, extension=input_fmt).decode("utf-8")
         except UnicodeDecodeError:
             logging.debug("Decoding error -- attempting to detect encoding")
             with open(input_fn, "rb") as file_in:
                 input_bytes = file_in.read()
+            import chardet
             enc = chardet.detect(input_bytes)["encoding"]
             if enc is None:
                 raise Exception("Encoding could not be detected")
@@ -134,13 +295,22 @@ def convert_to_text(input_fn:str, input_fmt:str, config:dict=None):
             logging.debug("Input successfully converted to utf-8")
         return output, bbox, new_config
     
-    if new_config["convert_as_image"]:
-        input_fn, new_config = convert_to_images_pdf(input_fn, new_config)
-    os.chdir(os.path.dirname(input_fn))
-    # print(os.getcwd())
-    # cmd = f"pdftotext -f {new_config['first_page']} -l {new_config['last_page']} {input_fn}"
+    if new_config.get("convert_as_image"):
+        pages = extract_pdf(input_fn, cache, new_config.get("ocr_workers"), new_config.get("text_layer", True))
+        new_config["first_page"] = 1
+        new_config["last_page"] = len(pages)
+        joined = "\n".join(page["text"] for page in pages)
+        text = joined.strip()
+        # where each page's text starts in the returned text, so tokens can be matched to the words of their page
+        offset = len(joined.lstrip()) - len(joined)
+        bbox = []
+        for page in pages:
+            points = to_points(page["words"])
+            points["start"] = min(max(offset, 0), len(text))
+            bbox.append(points)
+            offset += len(page["text"]) + 1
+        return text, bbox, new_config
     text,bbox = get_pdf_text(input_fn)
-    os.chdir(original_path)  # Return to the original current working directory
     return text,bbox, new_config
 
 def pre_process(input_file):
@@ -156,6 +326,7 @@ def pre_process(input_file):
     return input_fn, ext
 
 def get_pdf_text(pdf_path):
+    import PyPDF2
     text_content = ''
     bbox_info = []
     with open(pdf_path, 'rb') as pdf_file:
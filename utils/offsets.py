@@ -0,0 +1,145 @@
+"""
+Offsets in a cleaned text mapped back to the raw text it was cleaned from.
+
+Cleaning collapses whitespace, drops page numbers and transliterates characters, so an
+entity found in `contract.text` sits somewhere else in `contract.raw`. The cleaning steps
+record where each piece of their output came from in an OffsetMap.
+"""
+from bisect import bisect_right
+import numpy as np
+
+class OffsetMap:
+    """Map from offsets in a derived text to offsets in its source.
+
+    The derived text is a sequence of pieces, each produced from a span of the source. Pieces
+    copied as they are map one character for one, consecutive ones are stored as one piece, so
+    the map only grows with the number of places the text was changed.
+
+    Args:
+        clean (list): Ascending offsets in the derived text where each piece starts, the first is 0.
+        raw (list): Offset in the source where each piece starts.
+        raw_end (list): Offset in the source where each piece ends.
+        length (int): Length of the derived text.
+        raw_length (int): Length of the source.
+    """
+    def __init__(self, clean, raw, raw_end, length, raw_length):
+        self.clean = clean
+        self.raw = raw
+        self.raw_end = raw_end
+        self.length = length
+        self.raw_length = raw_length
+
+    @classmethod
+    def identity(cls, length):
+        """Map of a text onto itself."""
+        return cls([0], [0], [length], length, length)
+
+    def __len__(self):
+        return len(self.clean)
+
+    def to_raw(self, pos):
+        """Offset in the source of the character at pos of the derived text."""
+        if pos >= self.length:
+            return self.raw_length
+        i = bisect_right(self.clean, pos) - 1
+        # characters a replacement added beyond its source map to its last source character
+        return min(self.raw[i] + pos - self.clean[i], max(self.raw_end[i] - 1, self.raw[i]))
+
+    def to_raw_array(self, positions):
+        """to_raw of every position of a NumPy array."""
+        positions = np.asarray(positions)
+        clean = np.asarray(self.clean)
+        raw = np.asarray(self.raw)
+        last = np.maximum(np.asarray(self.raw_end) - 1, raw)
+        i = np.searchsorted(clean, positions, side="right") - 1
+        mapped = np.minimum(raw[i] + positions - clean[i], last[i])
+        return np.where(positions >= self.length, self.raw_length, mapped)
+
+    def span(self, start, end):
+        """Source span (start, end) of the derived text between start and end."""
+        raw_start = self.to_raw(start)
+        if end <= start:
+            return raw_start, raw_start
+        return raw_start, min(self.to_raw(end - 1) + 1, self.raw_length)
+
+    def pieces(self):
+        """(start, end, raw_start, raw_end) of every piece."""
+        ends = self.clean[1:] + [self.length]
+        return zip(self.clean, ends, self.raw, self.raw_end)
+
+    def compose(self, inner):
+        """Map from this map's derived text to the source of inner, when inner maps onto this map's source."""
+        if len(inner) == 1 and inner.raw_end[0] - inner.raw[0] == inner.length == inner.raw_length:
+            return OffsetMap(self.clean, self.raw, self.raw_end, self.length, inner.raw_length)
+        starts, raws, raw_ends = inner.clean, inner.raw, inner.raw_end
+        ends = starts[1:] + [inner.length]
+
+        def to_raw(pos, j):
+            # inner.to_raw for a pos inside inner's piece j
+            return min(raws[j] + pos - starts[j], max(raw_ends[j] - 1, raws[j]))
+
+        builder = OffsetBuilder()
+        j = 0
+        # both maps run forward through their pieces, so one walk over each composes them
+        for start, end, mid_start, mid_end in self.pieces():
+            while ends[j] <= mid_start and j + 1 < len(ends):
+                j += 1
+            if mid_start >= inner.length:
+                builder.extend(end - start, inner.raw_length, inner.raw_length)
+            elif mid_start == mid_end:
+                raw = to_raw(mid_start, j)
+                builder.extend(end - start, raw, raw)
+            elif end - start != mid_end - mid_start:
+                k = j
+                while ends[k] < mid_end:
+                    k += 1
+                builder.extend(end - start, to_raw(mid_start, j), to_raw(mid_end - 1, k) + 1)
+            else:
+                # a copied piece keeps every piece of inner it covers
+                k = j
+                while mid_start < mid_end:
+                    split = min(ends[k], mid_end)
+                    builder.extend(split - mid_start, to_raw(mid_start, k), to_raw(split - 1, k) + 1)
+                    mid_start = split
+                    k += 1
+        return builder.offsets(inner.raw_length)
+
+class OffsetBuilder:
+    """Builds a text from pieces along with the OffsetMap from it back to the source of each piece."""
+    def __init__(self):
+        self.pieces = []
+        self.length = 0
+        self.clean = []
+        self.raw = []
+        self.raw_end = []
+
+    def extend(self, length, start, end):
+        """Record length characters of output produced from the source between start and end."""
+        if not length:
+            return
+        if (self.clean and self.raw_end[-1] == start and end - start == length
+                and self.raw_end[-1] - self.raw[-1] == self.length - self.clean[-1]):
+            # a copy carrying on from another
+            self.raw_end[-1] = end
+        else:
+            self.clean.append(self.length)
+            self.raw.append(start)
+            self.raw_end.append(end)
+        self.length += length
+
+    def add(self, piece, start, end=None):
+        """Append piece, produced from the source between start and end, by default a copy of it."""
+        if not piece:
+            return
+        length = len(piece)
+        self.extend(length, start, start + length if end is None else end)
+        self.pieces.append(piece)
+
+    def offsets(self, raw_length):
+        if not self.clean:
+            return OffsetMap([0], [0], [0], self.length, raw_length)
+        return OffsetMap(self.clean, self.raw, self.raw_end, self.length, raw_length)
+
+    def build(self, raw_length):
+        """The text and its OffsetMap onto a source raw_length long."""
+        return "".join(self.pieces), self.offsets(raw_length)
@@ -0,0 +1,131 @@
+"""
+Work out which characters a regex match can start with, so callers can skip the regex
+at positions or on lines where it can't match.
+
+sre only skips ahead by itself when a pattern starts with a literal or a plain alternation
+of literals, anything starting with a group of mixed alternatives or a character category
+is tried in full at every position.
+"""
+import re
+try:
+    from re import _parser as sre_parse, _constants as sre_constants
+except ImportError:
+    import sre_parse, sre_constants
+
+CATEGORIES = {
+    sre_constants.CATEGORY_DIGIT: r"\d",
+    sre_constants.CATEGORY_NOT_DIGIT: r"\D",
+    sre_constants.CATEGORY_SPACE: r"\s",
+    sre_constants.CATEGORY_NOT_SPACE: r"\S",
+    sre_constants.CATEGORY_WORD: r"\w",
+    sre_constants.CATEGORY_NOT_WORD: r"\W",
+}
+ZERO_WIDTH = (sre_constants.AT, sre_constants.ASSERT, sre_constants.ASSERT_NOT)
+
+def _literal(code):
+    return re.escape(chr(code))
+
+def _set_item(op, av):
+    if op is sre_constants.LITERAL:
+        return _literal(av)
+    if op is sre_constants.RANGE:
+        return f"{_literal(av[0])}-{_literal(av[1])}"
+    if op is sre_constants.CATEGORY and av in CATEGORIES:
+        return CATEGORIES[av]
+    return None
+
+def _first_of_item(op, av):
+    """Character classes one parsed item can start with, as (classes, nullable). classes is None for any character."""
+    if op is sre_constants.LITERAL:
+        return [_literal(av)], False
+    if op is sre_constants.NOT_LITERAL:
+        return [f"[^{_literal(av)}]"], False
+    if op is sre_constants.IN:
+        negate = bool(av) and av[0][0] is sre_constants.NEGATE
+        items = [_set_item(item_op, item_av) for item_op, item_av in (av[1:] if negate else av)]
+        if not items or None in items:
+            return None, False
+        return [("[^" if negate else "[") + "".join(items) + "]"], False
+    if op is sre_constants.SUBPATTERN:
+        group, add_flags, del_flags, sub = av
+        if add_flags or del_flags:
+            # scoped flags would change what the classes match outside the group
+            return None, False
+        return _first_of_sequence(sub)
+    if op is sre_constants.BRANCH:
+        classes, nullable = [], False
+        for alternative in av[1]:
+            alt_classes, alt_nullable = _first_of_sequence(alternative)
+            if alt_classes is None:
+                return None, False
+            classes += alt_classes
+            nullable = nullable or alt_nullable
+        return classes, nullable
+    if op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+        low, _, sub = av
+        classes, nullable = _first_of_sequence(sub)
+        return classes, nullable or low == 0
+    if op in ZERO_WIDTH:
+        return [], True
+    return None, False
+
+def _first_of_sequence(items):
+    classes = []
+    for op, av in items:
+        item_classes, nullable = _first_of_item(op, av)
+        if item_classes is None:
+            return None, False
+        classes += item_classes
+        if not nullable:
+            return classes, False
+    return classes, True
+
+def first_char_class(regex):
+    """A pattern matching one character a match of `regex` can start with, under the regex's own flags.
+
+    Args:
+        regex (re.Pattern): A compiled str pattern.
+
+    Returns:
+        str: Alternation of character classes, or None when any character may start a match,
+        including when the regex can match the empty string.
+    """
+    if not isinstance(regex.pattern, str):
+        return None
+    try:
+        classes, nullable = _first_of_sequence(sre_parse.parse(regex.pattern, regex.flags))
+    except (re.error, AttributeError, TypeError, ValueError):
+        return None
+    if nullable or not classes:
+        return None
+    literals = [cls for cls in classes if not cls.startswith("[")]
+    others = list(dict.fromkeys(cls for cls in classes if cls.startswith("[")))
+    if literals:
+        others.insert(0, "[" + "".join(dict.fromkeys(literals)) + "]")
+    return "|".join(others)
+
+def can_match_empty(regex):
+    """Whether `regex` may match the empty string somewhere, True when its pattern can't be parsed."""
+    if not isinstance(regex.pattern, str):
+        return True
+    try:
+        return sre_parse.parse(regex.pattern, regex.flags).getwidth()[0] == 0
+    except (re.error, AttributeError, TypeError, ValueError):
+        return True
+
+def first_char_guard(regex):
+    """The regex behind a lookahead on the characters its matches start with.
+
+    The lookahead is zero width and the pattern is wrapped in a non capturing group, so the
+    spans and group numbers of matches are unchanged. Returns the regex itself when its first
+    characters can't be worked out.
+    """
+    cls = first_char_class(regex)
+    if cls is None:
+        return regex
+    # verbose patterns may end in a comment, keep it from swallowing the closing parenthesis
+    pattern = regex.pattern + "\n" if regex.flags & re.VERBOSE else regex.pattern
+    try:
+        return re.compile(f"(?=(?:{cls}))(?:{pattern})", regex.flags)
+    except re.error:
+        return regex